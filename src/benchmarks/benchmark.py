@@ -0,0 +1,205 @@
+from src.benchmarks.synthetic_data import generate_raw_data
+from src.data_pipeline.encoding import encode_categorical
+from src.data_pipeline.preprocess_data import COLUMNS_TO_DROP, STATE_CODE, load_data, plan_columns, preprocess_state
+from src.data_pipeline.preprocessor import Preprocessor, TARGET_COLUMN
+from src.data_pipeline.utils import train_val_test_split
+from src.instrumentation import INSTRUMENTATION, run_stage
+from src.models.model_factory import ModelFactory
+from src.train import CONF_PATH, load_conf
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any
+
+REPORT_DIR = Path("reports/benchmarks")
+REGRESSION_TOLERANCE = 0.25
+# Stages faster than this are too noisy to be flagged as regressions
+MIN_REGRESSION_SECONDS = 0.05
+
+logger = logging.getLogger("Benchmark")
+
+def benchmark_pipeline(traffic_data_path: Path, station_data_path: Path,
+                       model_to_be_used: str, model_params: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Time and memory profile every stage of the data pipeline, training and prediction with
+    the shared instrumentation
+
+    Args:
+        traffic_data_path (Path): Filepath to the raw traffic data
+        station_data_path (Path): Filepath to the raw station data
+        model_to_be_used (str): Model type as specified in conf/model.yaml
+        model_params (Dict[str, Any]): Hyperparameters of the model
+
+    Returns:
+        Dict[str, Dict[str, float]]: Measurements of every stage
+    """
+    INSTRUMENTATION.enable()
+    try:
+        traffic_df, station_df = run_stage("load", load_data, traffic_data_path, station_data_path,
+                                           state_code=STATE_CODE, usecols=plan_columns("pm", COLUMNS_TO_DROP))
+        combined_df = preprocess_state(traffic_df, station_df, "pm", COLUMNS_TO_DROP)
+        del traffic_df, station_df
+
+        combined_df = run_stage("encode_categorical", encode_categorical, combined_df)
+        train, val, test = run_stage("split", train_val_test_split, combined_df, 0.8, 0.1, 0.1)
+        del combined_df
+
+        preprocessor = run_stage("encode_fit", Preprocessor().fit, train)
+        train_X = run_stage("encode_transform", preprocessor.transform, train)
+        test_X = preprocessor.transform(test)
+
+        model = ModelFactory().create_model(model_to_be_used, model_params)
+        run_stage("fit", model.train, train_X, train[TARGET_COLUMN].to_numpy())
+        run_stage("predict", model.predict, test_X)
+    finally:
+        INSTRUMENTATION.disable()
+
+    for name, stage in INSTRUMENTATION.stages.items():
+        logger.info(f"{name}: {stage['seconds']:.3f}s, peak {stage['peak_memory_mb']:.1f} MB")
+
+    return INSTRUMENTATION.stages
+
+def run_benchmarks(row_counts: List[int], num_states: int, num_stations: int, cardinality: int,
+                   seed: int = 42) -> Dict[str, Any]:
+    """
+    Generate synthetic raw data at every scale and benchmark the pipeline on it
+
+    Args:
+        row_counts (List[int]): Number of traffic records of every scale
+        num_states (int): Number of states the stations are spread over
+        num_stations (int): Number of station records
+        cardinality (int): Number of distinct values of the free text categorical columns
+        seed (int): Seed of the random generator
+
+    Returns:
+        Dict[str, Any]: Report with the measurements of every stage at every scale
+    """
+    conf = load_conf(CONF_PATH)
+    model_to_be_used = conf["model"]
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "model": model_to_be_used,
+        "model_params": conf[model_to_be_used],
+        "data_params": {"states": num_states, "stations": num_stations, "cardinality": cardinality, "seed": seed},
+        "scales": {}
+    }
+
+    for num_rows in row_counts:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            logger.info(f"Generating {num_rows} synthetic traffic records")
+            traffic_data_path, station_data_path = generate_raw_data(Path(tmp_dir), num_rows, num_states,
+                                                                     num_stations, cardinality, seed)
+            start_time = time.perf_counter()
+            stages = benchmark_pipeline(traffic_data_path, station_data_path, model_to_be_used,
+                                        conf[model_to_be_used])
+            # Nested stages such as drop and filter inside load would be counted twice in a sum
+            total_seconds = time.perf_counter() - start_time
+
+        report["scales"][str(num_rows)] = {"stages": stages, "total_seconds": total_seconds}
+
+    return report
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any],
+                    tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    """
+    Compare the stage timings of two reports at the scales they have in common
+
+    Args:
+        report (Dict[str, Any]): Report of the current commit
+        baseline (Dict[str, Any]): Report to compare against
+        tolerance (float): Relative slowdown above which a stage is flagged as a regression
+
+    Returns:
+        List[str]: Description of every regression
+    """
+    regressions = []
+    for num_rows, scale in report["scales"].items():
+        baseline_scale = baseline["scales"].get(num_rows)
+        if baseline_scale is None:
+            continue
+
+        for name, stage in scale["stages"].items():
+            baseline_stage = baseline_scale["stages"].get(name)
+            if baseline_stage is None:
+                continue
+
+            ratio = stage["seconds"] / max(baseline_stage["seconds"], 1e-9)
+            logger.info(f"[{num_rows} rows] {name}: {baseline_stage['seconds']:.3f}s -> "
+                        f"{stage['seconds']:.3f}s ({ratio:.2f}x)")
+            if ratio > 1 + tolerance and stage["seconds"] >= MIN_REGRESSION_SECONDS:
+                regressions.append(f"{name} at {num_rows} rows is {ratio:.2f}x slower than {baseline['commit']}")
+
+    return regressions
+
+def git_commit() -> str:
+    """
+    Return the short hash of the current commit, unknown outside of a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def save_report(report: Dict[str, Any], report_dir: Path = REPORT_DIR) -> Path:
+    """
+    Save the report as json, named after its commit and creation time
+
+    Args:
+        report (Dict[str, Any]): Benchmark report
+        report_dir (Path): Folder of the reports
+
+    Returns:
+        Path: Filepath to the saved report
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    timestamp = report["created_at"].replace(":", "").replace("-", "")
+    report_path = Path(report_dir) / f"{timestamp}_{report['commit']}.json"
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+
+    return report_path
+
+def main(argv: List[str] = None):
+    """
+    Run the pipeline benchmarks from the command line, exits with an error when a stage got
+    slower than the baseline report
+
+    Args:
+        argv (List[str]): Command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000],
+                        help="Number of traffic records of every scale")
+    parser.add_argument("--states", type=int, default=3)
+    parser.add_argument("--stations", type=int, default=1000)
+    parser.add_argument("--cardinality", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", type=Path, help="Report to compare the timings against")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.rows, args.states, args.stations, args.cardinality, args.seed)
+    logger.info(f"Report saved to {save_report(report)}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            regressions = compare_reports(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            logger.warning(regression)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,112 @@
+from src.benchmarks.benchmark import REPORT_DIR, git_commit
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List, Any
+
+import numpy as np
+
+# Modules imported by every command path, timed in a fresh interpreter
+IMPORT_PATHS = {
+    "cli": ["src.cli"],
+    "predict": ["src.cli", "src.serve", "src.models.model_factory", "src.data_pipeline.station_store"],
+    "train": ["src.cli", "src.train"]
+}
+# Paths that must not import these packages
+FORBIDDEN_IMPORTS = {
+    "cli": ["sklearn", "pandas"],
+    "predict": ["sklearn"]
+}
+REPEATS = 5
+
+logger = logging.getLogger("Import Benchmark")
+
+def time_import(modules: List[str]) -> Dict[str, Any]:
+    """
+    Import the modules in a fresh interpreter and return the import time in seconds and the
+    top level packages it loaded
+    """
+    code = (
+        "import sys, time, json\n"
+        "start_time = time.perf_counter()\n"
+        f"for module in {modules!r}: __import__(module)\n"
+        "seconds = time.perf_counter() - start_time\n"
+        "print(json.dumps({'seconds': seconds, 'packages': sorted({name.split('.')[0] for name in sys.modules})}))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env={**os.environ, "PYTHONPATH": os.getcwd()}).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+def run_benchmark(repeats: int = REPEATS) -> Dict[str, Any]:
+    """
+    Time the imports of every command path and check that the light paths do not import the
+    forbidden packages
+
+    Args:
+        repeats (int): Number of fresh interpreters per path, the median time is reported
+
+    Returns:
+        Dict[str, Any]: Median import time, loaded forbidden packages per path and the
+            violations found
+    """
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "repeats": repeats,
+        "paths": {},
+        "violations": []
+    }
+    for path, modules in IMPORT_PATHS.items():
+        runs = [time_import(modules) for _ in range(repeats)]
+        packages = runs[-1]["packages"]
+        report["paths"][path] = {
+            "modules": modules,
+            "seconds": float(np.median([run["seconds"] for run in runs])),
+            "sklearn": "sklearn" in packages,
+            "pandas": "pandas" in packages
+        }
+        for package in FORBIDDEN_IMPORTS.get(path, []):
+            if package in packages:
+                report["violations"].append(f"{path} imports {package}")
+        logger.info(f"{path}: {report['paths'][path]['seconds']:.3f}s")
+
+    return report
+
+def main(argv: List[str] = None):
+    """
+    Run the import benchmark from the command line, exits with an error when a light path
+    imports a forbidden package or the predict path is slower than max_predict_seconds
+
+    Args:
+        argv (List[str]): Command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the command paths")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--max-predict-seconds", type=float, help="Import time budget of the predict path")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.repeats)
+    if args.max_predict_seconds is not None and report["paths"]["predict"]["seconds"] > args.max_predict_seconds:
+        report["violations"].append(f"predict imports in {report['paths']['predict']['seconds']:.3f}s, "
+                                    f"more than {args.max_predict_seconds}s")
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    timestamp = report["created_at"].replace(":", "").replace("-", "")
+    report_path = REPORT_DIR / f"imports_{timestamp}_{report['commit']}.json"
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Report saved to {report_path}")
+
+    for violation in report["violations"]:
+        logger.warning(violation)
+    sys.exit(1 if report["violations"] else 0)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
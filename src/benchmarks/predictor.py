@@ -0,0 +1,131 @@
+from src.benchmarks.benchmark import REPORT_DIR, git_commit
+from src.benchmarks.synthetic_data import generate_raw_data
+from src.data_pipeline import datapipeline
+from src.models.model_factory import ModelFactory
+from src.models.tree_arrays import export_trees, predict_trees
+from src.train import CONF_PATH, PIPELINE_CONF_PATH, load_conf
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any
+
+import numpy as np
+
+BATCH_SIZES = [1, 100, 100_000]
+
+logger = logging.getLogger("Predictor Benchmark")
+
+def time_predictions(predict, data_X, repeats: int) -> float:
+    """
+    Return the median latency in milliseconds of predict on data_X
+    """
+    latencies = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        predict(data_X)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+
+    return float(np.median(latencies))
+
+def benchmark_predictors(model, test_X, batch_sizes: List[int], seed: int = 42) -> Dict[str, Dict[str, float]]:
+    """
+    Compare the latency of sklearn's predict with the tree arrays predictor on batches of
+    test rows drawn with replacement, after checking that both predict the same values
+
+    Args:
+        model (Model): Trained tree model
+        test_X: Test features, sparse CSR
+        batch_sizes (List[int]): Number of rows of every batch
+        seed (int): Seed of the random generator picking the rows
+
+    Returns:
+        Dict[str, Dict[str, float]]: Latencies and speedup per batch size
+    """
+    rng = np.random.default_rng(seed)
+    trees = export_trees(model.model)
+
+    results = {}
+    for batch_size in batch_sizes:
+        batch_X = test_X[rng.integers(test_X.shape[0], size=batch_size)]
+        if not np.array_equal(model.model.predict(batch_X), predict_trees(trees, batch_X)):
+            raise AssertionError(f"Tree arrays predictions differ from sklearn at batch size {batch_size}")
+
+        repeats = max(min(1_000_000 // batch_size, 200), 3)
+        sklearn_ms = time_predictions(model.model.predict, batch_X, repeats)
+        arrays_ms = time_predictions(lambda data_X: predict_trees(trees, data_X), batch_X, repeats)
+
+        results[str(batch_size)] = {"sklearn_ms": sklearn_ms, "arrays_ms": arrays_ms,
+                                    "speedup": sklearn_ms / arrays_ms}
+        logger.info(f"Batch of {batch_size}: sklearn {sklearn_ms:.3f} ms, arrays {arrays_ms:.3f} ms "
+                    f"({sklearn_ms / arrays_ms:.2f}x)")
+
+    return results
+
+def run_benchmark(num_rows: int, batch_sizes: List[int], seed: int = 42) -> Dict[str, Any]:
+    """
+    Train the model of conf/model.yaml on synthetic data and benchmark its predictors
+
+    Args:
+        num_rows (int): Number of synthetic traffic records
+        batch_sizes (List[int]): Number of rows of every batch
+        seed (int): Seed of the random generators
+
+    Returns:
+        Dict[str, Any]: Report with the latencies per batch size
+    """
+    conf = load_conf(CONF_PATH)
+    model_to_be_used = conf["model"]
+    pipeline_conf = load_conf(PIPELINE_CONF_PATH)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        traffic_data_path, station_data_path = generate_raw_data(Path(tmp_dir), num_rows, seed=seed)
+        data = datapipeline.run_pipeline(traffic_data_path, station_data_path,
+                                         {**pipeline_conf, "incremental": False,
+                                          "cache_dir": os.path.join(tmp_dir, "processed")})
+
+        model = ModelFactory().create_model(model_to_be_used, conf[model_to_be_used])
+        model.train(data["train"][0], data["train"][1])
+        results = benchmark_predictors(model, data["test"][0], batch_sizes, seed)
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "model": model_to_be_used,
+        "model_params": conf[model_to_be_used],
+        "rows": num_rows,
+        "batches": results
+    }
+
+def main(argv: List[str] = None):
+    """
+    Run the predictor benchmark from the command line
+
+    Args:
+        argv (List[str]): Command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the tree arrays predictor against sklearn")
+    parser.add_argument("--rows", type=int, default=200_000, help="Number of synthetic traffic records")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.rows, args.batch_sizes, args.seed)
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    timestamp = report["created_at"].replace(":", "").replace("-", "")
+    report_path = REPORT_DIR / f"predictor_{timestamp}_{report['commit']}.json"
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Report saved to {report_path}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
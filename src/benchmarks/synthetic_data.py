@@ -0,0 +1,220 @@
+from src.data_pipeline.schema import STATION_COLUMNS, TRAFFIC_COLUMNS, TRAFFIC_VOLUME_COLUMNS
+
+import argparse
+import gzip
+import logging
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# New York first so that the default pipeline configuration finds its state
+STATE_CODES = [36, 6, 48, 12, 17, 42, 39, 13, 37, 26, 34, 51, 53, 4, 25, 47, 18, 29, 24, 55,
+               8, 27, 45, 1, 22, 21, 41, 40, 9, 49, 19, 32, 5, 28, 20, 35, 31, 54, 16, 15,
+               33, 23, 30, 44, 10, 46, 38, 2, 11, 50, 56]
+DIRECTIONS = ["North", "Northeast", "East", "Southeast", "South", "Southwest", "West", "Northwest"]
+FUNCTIONAL_CLASSIFICATIONS = ["Rural: Principal Arterial - Interstate", "Rural: Principal Arterial - Other",
+                              "Rural: Minor Arterial", "Rural: Major Collector", "Rural: Minor Collector",
+                              "Rural: Local System", "Urban: Principal Arterial - Interstate",
+                              "Urban: Principal Arterial - Other Freeways or Expressways",
+                              "Urban: Principal Arterial - Other", "Urban: Minor Arterial",
+                              "Urban: Collector", "Urban: Local System"]
+FUNCTIONAL_CLASSIFICATION_CODES = ["1R", "2R", "6R", "7R", "8R", "9R", "1U", "2U", "4U", "6U", "7U", "9U"]
+# Share of the daily volume counted in every hour, peaking in the am and pm rush hours
+HOURLY_PROFILE = np.array([0.8, 0.5, 0.4, 0.4, 0.7, 1.8, 4.5, 6.8, 6.9, 5.6, 5.1, 5.3,
+                           5.6, 5.6, 6.0, 6.7, 7.4, 7.7, 6.6, 4.9, 3.9, 3.4, 2.6, 1.6])
+CHUNK_SIZE = 200_000
+
+logger = logging.getLogger("Synthetic Data")
+
+def generate_station_data(num_stations: int, num_states: int, cardinality: int,
+                          rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Generate station records with the schema of dot_traffic_stations_2015
+
+    Args:
+        num_stations (int): Number of station records
+        num_states (int): Number of states the stations are spread over
+        cardinality (int): Number of distinct values of the free text categorical columns
+        rng (np.random.Generator): Random generator
+
+    Returns:
+        pd.DataFrame: Station records
+    """
+    def choice(values, size=num_stations):
+        return np.asarray(values, dtype=object)[rng.integers(len(values), size=size)]
+
+    def labels(prefix):
+        return choice([f"{prefix}{value}" for value in range(cardinality)])
+
+    classification_index = rng.integers(len(FUNCTIONAL_CLASSIFICATIONS), size=num_stations)
+    direction_index = rng.integers(len(DIRECTIONS), size=num_stations)
+
+    station_df = pd.DataFrame({
+        "algorithm_of_vehicle_classification": choice(["1", "2", "3", "D", "E", "G"]),
+        "algorithm_of_vehicle_classification_name": choice(["Axle spacing", "Vehicle length", np.nan]),
+        "calibration_of_weighing_system": choice(["0", "2", "A", "B", "P"]),
+        "calibration_of_weighing_system_name": choice(["Test trucks", np.nan, np.nan]),
+        "classification_system_for_vehicle_classification": rng.integers(0, 16, size=num_stations),
+        "concurrent_route_signing": rng.integers(0, 7, size=num_stations),
+        "concurrent_signed_route_number": labels("R"),
+        "direction_of_travel": direction_index + 1,
+        "direction_of_travel_name": np.asarray(DIRECTIONS, dtype=object)[direction_index],
+        "fips_county_code": rng.integers(1, 200, size=num_stations),
+        "fips_state_code": choice(STATE_CODES[:num_states]),
+        "functional_classification": np.asarray(FUNCTIONAL_CLASSIFICATION_CODES, dtype=object)[classification_index],
+        "functional_classification_name": np.asarray(FUNCTIONAL_CLASSIFICATIONS, dtype=object)[classification_index],
+        "hpms_sample_identifier": rng.integers(0, 100000, size=num_stations),
+        "hpms_sample_type": choice(["N", "Y"]),
+        "lane_of_travel": rng.integers(0, 5, size=num_stations),
+        "lane_of_travel_name": choice(["Outside lane", "Inside lane", "Combined lanes"]),
+        "latitude": rng.uniform(25, 49, size=num_stations).round(6),
+        "longitude": rng.uniform(-124, -67, size=num_stations).round(6),
+        "lrs_identification": choice([f"L{value}" for value in range(cardinality)] + [np.nan]),
+        "lrs_location_point": rng.integers(0, 100000, size=num_stations),
+        "method_of_data_retrieval": rng.integers(1, 3, size=num_stations),
+        "method_of_data_retrieval_name": choice(["Manual", "Automated"]),
+        "method_of_traffic_volume_counting": rng.integers(1, 4, size=num_stations),
+        "method_of_traffic_volume_counting_name": choice(["Portable", "Permanent"]),
+        "method_of_truck_weighing": rng.integers(0, 6, size=num_stations),
+        "method_of_truck_weighing_name": choice(["Portable", "Permanent", np.nan]),
+        "method_of_vehicle_classification": rng.integers(1, 4, size=num_stations),
+        "method_of_vehicle_classification_name": choice(["Portable", "Permanent"]),
+        "number_of_lanes_in_direction_indicated": rng.integers(1, 6, size=num_stations),
+        "number_of_lanes_monitored_for_traffic_volume": rng.integers(1, 6, size=num_stations),
+        "number_of_lanes_monitored_for_truck_weight": rng.integers(0, 6, size=num_stations),
+        "number_of_lanes_monitored_for_vehicle_class": rng.integers(0, 6, size=num_stations),
+        "posted_route_signing": rng.integers(1, 9, size=num_stations),
+        "posted_signed_route_number": labels("P"),
+        "previous_station_id": choice([f"S{value:05d}" for value in range(cardinality)] + [np.nan]),
+        "primary_purpose": choice(["P", "Q", "R", "S"]),
+        "primary_purpose_name": choice(["Planning", "Research"]),
+        "record_type": "S",
+        "sample_type_for_traffic_volume": choice(["N", "T", "t", "Y", np.nan]),
+        "sample_type_for_traffic_volume_name": choice(["Used", "Not used"]),
+        "sample_type_for_truck_weight": choice(["N", "B", "L", "T"]),
+        "sample_type_for_truck_weight_name": choice(["Used", "Not used"]),
+        "sample_type_for_vehicle_classification": choice(["N", "H", "Y", "2", "T", np.nan]),
+        "sample_type_for_vehicle_classification_name": choice(["Used", "Not used"]),
+        "shrp_site_identification": choice(["0", "1"]),
+        "station_id": [f"{value:06d}" for value in range(num_stations)],
+        "station_location": labels("Mile marker "),
+        "type_of_sensor": choice(["I", "L", "P", "R"]),
+        "type_of_sensor_name": choice(["Inductance loop", "Piezo", "Radar"]),
+        "year_of_data": 15,
+        "year_station_discontinued": 0,
+        "year_station_established": rng.integers(0, 100, size=num_stations)
+    })
+
+    return station_df[STATION_COLUMNS]
+
+def generate_traffic_data(station_df: pd.DataFrame, station_volumes: np.array, num_rows: int,
+                          rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Generate daily traffic records with the schema of dot_traffic_2015 for randomly picked
+    stations. Hourly volumes follow a daily profile scaled by the station's base volume so
+    that the rush hour volume can be learnt from the earlier hours
+
+    Args:
+        station_df (pd.DataFrame): Station records generated with generate_station_data
+        station_volumes (np.array): Base hourly volume of every station
+        num_rows (int): Number of traffic records
+        rng (np.random.Generator): Random generator
+
+    Returns:
+        pd.DataFrame: Traffic records
+    """
+    station_index = rng.integers(len(station_df), size=num_rows)
+    stations = station_df.iloc[station_index].reset_index(drop=True)
+    dates = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(365, size=num_rows), unit="D")
+
+    traffic_df = pd.DataFrame({
+        "date": dates.strftime("%Y-%m-%d"),
+        "day_of_data": dates.day,
+        "day_of_week": dates.dayofweek + 1,
+        "direction_of_travel": stations["direction_of_travel"],
+        "direction_of_travel_name": stations["direction_of_travel_name"],
+        "fips_state_code": stations["fips_state_code"],
+        "functional_classification": stations["functional_classification"],
+        "functional_classification_name": stations["functional_classification_name"],
+        "lane_of_travel": stations["lane_of_travel"],
+        "month_of_data": dates.month,
+        "record_type": 3,
+        "restrictions": np.nan,
+        "station_id": stations["station_id"],
+        "year_of_data": 15
+    })
+
+    base_volume = station_volumes[station_index]
+    weekday_factor = np.where(traffic_df["day_of_week"].to_numpy() >= 6, 0.7, 1.0)
+    noise = rng.lognormal(0, 0.2, size=(num_rows, len(TRAFFIC_VOLUME_COLUMNS)))
+    volumes = (base_volume * weekday_factor)[:, None] * HOURLY_PROFILE[None, :] * noise
+    traffic_df[TRAFFIC_VOLUME_COLUMNS] = volumes.round().astype(np.int64)
+
+    return traffic_df[TRAFFIC_COLUMNS]
+
+def generate_raw_data(output_dir: Path, num_rows: int, num_states: int = 3, num_stations: int = 1000,
+                      cardinality: int = 20, seed: int = 42, chunksize: int = CHUNK_SIZE) -> Tuple[Path]:
+    """
+    Write synthetic raw traffic and station gzip files with the names and schemas of the
+    Kaggle dataset. Traffic records are generated and appended in chunks so that large files
+    can be written with bounded memory
+
+    Args:
+        output_dir (Path): Folder to write the gzip files into
+        num_rows (int): Number of traffic records
+        num_states (int): Number of states the stations are spread over
+        num_stations (int): Number of station records
+        cardinality (int): Number of distinct values of the free text categorical columns
+        seed (int): Seed of the random generator
+        chunksize (int): Number of traffic records generated at a time
+
+    Returns:
+        Tuple[Path]: Filepaths to the (traffic, station) gzip files
+    """
+    if not 1 <= num_states <= len(STATE_CODES):
+        raise ValueError(f"num_states must be between 1 and {len(STATE_CODES)}")
+
+    rng = np.random.default_rng(seed)
+    output_dir = Path(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    traffic_data_path = output_dir / "dot_traffic_2015.txt.gz"
+    station_data_path = output_dir / "dot_traffic_stations_2015.txt.gz"
+
+    station_df = generate_station_data(num_stations, num_states, cardinality, rng)
+    station_df.to_csv(station_data_path, index=False, compression="gzip")
+    station_volumes = rng.lognormal(4, 1, size=num_stations)
+
+    with gzip.open(traffic_data_path, "wt") as file:
+        for start in range(0, num_rows, chunksize):
+            traffic_df = generate_traffic_data(station_df, station_volumes, min(chunksize, num_rows - start), rng)
+            traffic_df.to_csv(file, index=False, header=start == 0)
+
+    logger.info(f"Wrote {num_rows} traffic records and {num_stations} stations to {output_dir}")
+
+    return traffic_data_path, station_data_path
+
+def main(argv: List[str] = None):
+    """
+    Generate the synthetic raw data from the command line
+
+    Args:
+        argv (List[str]): Command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Generate synthetic raw traffic and station data")
+    parser.add_argument("--output-dir", default="data/synthetic")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of traffic records")
+    parser.add_argument("--states", type=int, default=3, help="Number of states")
+    parser.add_argument("--stations", type=int, default=1000, help="Number of station records")
+    parser.add_argument("--cardinality", type=int, default=20,
+                        help="Distinct values of the free text categorical columns")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    generate_raw_data(Path(args.output_dir), args.rows, args.states, args.stations, args.cardinality, args.seed)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
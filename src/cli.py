@@ -0,0 +1,174 @@
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import List
+
+# Every command imports its modules when it runs, so that predicting a few records does not
+# pay for importing sklearn and the training pipeline
+BENCHMARKS = {
+    "pipeline": "src.benchmarks.benchmark",
+    "predictor": "src.benchmarks.predictor",
+    "synthetic": "src.benchmarks.synthetic_data",
+    "imports": "src.benchmarks.imports"
+}
+# Default folder of the station store, see src/data_pipeline/station_store.py
+STATION_STORE_DIR = Path("data/processed/station_store")
+# Default folder of the partitioned dataset, see src/data_pipeline/dataset.py
+DATASET_DIR = Path("data/interim/dataset")
+# Default run registry, see src/registry.py
+REGISTRY_PATH = Path("models/registry.sqlite")
+
+logger = logging.getLogger("CLI")
+
+def preprocess(args: argparse.Namespace):
+    """
+    Run the data pipeline, cache the encoded matrices and build the station store
+    """
+    from src.data_pipeline import datapipeline
+    from src.data_pipeline.preprocess_data import build_station_store
+    from src.train import PIPELINE_CONF_PATH, RAW_STATION_DATA_PATH, RAW_TRAFFIC_DATA_PATH, load_conf
+
+    pipeline_conf = load_conf(args.pipeline_conf or PIPELINE_CONF_PATH)
+    station_data_path = args.stations or RAW_STATION_DATA_PATH
+    datapipeline.run_pipeline(args.traffic or RAW_TRAFFIC_DATA_PATH, station_data_path, pipeline_conf)
+
+    build_station_store(station_data_path, args.station_store, pipeline_conf.get("csv_engine", "pandas"))
+    logger.info(f"Station store saved to {args.station_store}")
+
+def ingest(args: argparse.Namespace):
+    """
+    Convert the raw files into the partitioned dataset read by the data pipeline
+    """
+    from src.data_pipeline.dataset import ingest_raw_data
+    from src.train import RAW_STATION_DATA_PATH, RAW_TRAFFIC_DATA_PATH
+
+    ingest_raw_data(args.traffic or RAW_TRAFFIC_DATA_PATH, args.stations or RAW_STATION_DATA_PATH, args.dataset_dir)
+    logger.info(f"Dataset saved to {args.dataset_dir}")
+
+def train(args: argparse.Namespace):
+    """
+    Train and evaluate the model configured in conf/model.yaml
+    """
+    from src.train import experiment
+
+    experiment(retrain=args.retrain)
+
+def predict(args: argparse.Namespace):
+    """
+    Predict raw traffic records with a saved model and print the predictions as json
+    """
+    from src.data_pipeline.station_store import StationStore
+    from src.models.model_factory import ModelFactory
+    from src.serve import predict_records
+
+    if args.stations is None and args.station_store is None:
+        raise SystemExit("predict needs --stations or --station-store")
+
+    model = ModelFactory().load_model(args.model_dir)
+    station_df = read_records(args.stations) if args.stations is not None else None
+    station_store = StationStore.load(args.station_store) if args.station_store is not None else None
+    predictions = predict_records(model, read_records(args.traffic), station_df, station_store)
+
+    json.dump({"predictions": [None if prediction != prediction else float(prediction)
+                               for prediction in predictions]}, sys.stdout)
+    sys.stdout.write("\n")
+
+def runs(args: argparse.Namespace):
+    """
+    Print the run with the best val RMSE of every model type in the registry as json
+    """
+    from src.registry import RunRegistry
+
+    registry = RunRegistry(args.registry)
+    columns = ["model_type", "val_rmse", "train_rmse", "test_rmse", "params", "artifact_path", "created_at"]
+    json.dump([{column: run[column] for column in columns} for run in registry.best_runs()], sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    registry.close()
+
+def bench(args: argparse.Namespace):
+    """
+    Run one of the benchmarks with the remaining arguments
+    """
+    from importlib import import_module
+
+    import_module(BENCHMARKS[args.suite]).main(args.bench_args)
+
+def read_records(file_path: Path):
+    """
+    Read raw records from a csv file or a json file holding a list of records, the string
+    columns of the schema are read as strings like in the pipeline
+
+    Args:
+        file_path (Path): Filepath to the records
+
+    Returns:
+        pd.DataFrame: The records
+    """
+    import pandas as pd
+    from src.data_pipeline.schema import STRING_COLUMNS
+
+    if Path(file_path).suffix == ".json":
+        with open(file_path, "r") as file:
+            return pd.DataFrame(json.load(file))
+
+    return pd.read_csv(file_path, dtype={column: str for column in STRING_COLUMNS})
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the parser of the preprocess, ingest, train, predict, runs and bench commands
+    """
+    parser = argparse.ArgumentParser(prog="python -m src", description="US rush hour traffic volume prediction")
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    preprocess_parser = commands.add_parser("preprocess", help="Run the data pipeline and cache its output")
+    preprocess_parser.add_argument("--traffic", type=Path, help="Raw traffic data, defaults to data/raw")
+    preprocess_parser.add_argument("--stations", type=Path, help="Raw station data, defaults to data/raw")
+    preprocess_parser.add_argument("--pipeline-conf", type=Path, help="Defaults to conf/pipeline.yaml")
+    preprocess_parser.add_argument("--station-store", type=Path, default=STATION_STORE_DIR,
+                                   help="Folder to build the station store used by predict into")
+    preprocess_parser.set_defaults(handler=preprocess)
+
+    ingest_parser = commands.add_parser("ingest", help="Convert the raw files into the partitioned dataset")
+    ingest_parser.add_argument("--traffic", type=Path, help="Raw traffic data, defaults to data/raw")
+    ingest_parser.add_argument("--stations", type=Path, help="Raw station data, defaults to data/raw")
+    ingest_parser.add_argument("--dataset-dir", type=Path, default=DATASET_DIR,
+                               help="Folder of the dataset, new years are added next to the ingested ones")
+    ingest_parser.set_defaults(handler=ingest)
+
+    train_parser = commands.add_parser("train", help="Train and evaluate the model of conf/model.yaml")
+    train_parser.add_argument("--retrain", action="store_true",
+                              help="Train even when the run registry holds a run of the same config on the same data")
+    train_parser.set_defaults(handler=train)
+
+    predict_parser = commands.add_parser("predict", help="Predict raw traffic records with a saved model")
+    predict_parser.add_argument("--model-dir", required=True, help="Model folder created by save_model")
+    predict_parser.add_argument("--traffic", type=Path, required=True, help="Traffic records, csv or json")
+    predict_parser.add_argument("--stations", type=Path, help="Station records, csv or json")
+    predict_parser.add_argument("--station-store", type=Path,
+                                help="Station store built by preprocess, for records without station records")
+    predict_parser.set_defaults(handler=predict)
+
+    runs_parser = commands.add_parser("runs", help="Show the best run of every model type in the run registry")
+    runs_parser.add_argument("--registry", type=Path, default=REGISTRY_PATH, help="Defaults to models/registry.sqlite")
+    runs_parser.set_defaults(handler=runs)
+
+    bench_parser = commands.add_parser("bench", help="Run a benchmark, see python -m src bench <suite> -h")
+    bench_parser.add_argument("suite", choices=sorted(BENCHMARKS))
+    bench_parser.add_argument("bench_args", nargs=argparse.REMAINDER)
+    bench_parser.set_defaults(handler=bench)
+
+    return parser
+
+def main(argv: List[str] = None):
+    """
+    Entry point of python -m src
+
+    Args:
+        argv (List[str]): Command line arguments, defaults to sys.argv
+    """
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    args.handler(args)
@@ -0,0 +1,194 @@
+from src.data_pipeline.cache import load_arrays, load_objects, save_arrays
+from src.models.model_factory import ModelFactory
+
+import logging
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger("Cross Validation")
+
+DEFAULT_CV_CONF = {
+    "method": "expanding",
+    "n_folds": 3,
+    "val_months": 1,
+    "train_months": None,
+    "early_stopping_months": 1,
+    "n_jobs": None
+}
+
+# Shared matrix and fold indices memory-mapped by every worker process, set by init_worker
+SHARED_DATA = {}
+
+def rolling_origin_folds(months: np.ndarray, n_folds: int, val_months: int = 1,
+                         train_months: int = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Build time series folds over the months of the rows. The origins of the folds are the
+    last n_folds * val_months months, every fold is validated on the val_months months
+    after its origin and trained on every earlier month (expanding window) or on the
+    train_months months before the origin only (rolling window)
+
+    Args:
+        months (np.ndarray): Month of every row, any sortable period such as month_of_data
+        n_folds (int): Number of folds
+        val_months (int): Number of months validated by every fold
+        train_months (int): Size of the rolling train window in months, None expands the
+            window back to the first month
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: Train and val row indices of every fold, oldest
+            origin first
+    """
+    distinct_months = np.unique(months)
+    first_origin = len(distinct_months) - n_folds * val_months
+    if first_origin < 1:
+        raise ValueError(f"{n_folds} folds of {val_months} months need more than "
+                         f"{len(distinct_months)} months of data")
+
+    folds = []
+    for origin in range(first_origin, len(distinct_months), val_months):
+        train_start = 0 if train_months is None else max(origin - train_months, 0)
+        train_index = np.flatnonzero(np.isin(months, distinct_months[train_start:origin]))
+        val_index = np.flatnonzero(np.isin(months, distinct_months[origin:origin + val_months]))
+        folds.append((train_index, val_index))
+
+    return folds
+
+def split_early_stopping(train_index: np.ndarray, months: np.ndarray,
+                         early_stopping_months: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the last early_stopping_months months of a fold's train rows off as its early
+    stopping rows, so the models that stop early never see the rows the fold is scored on.
+    Folds with too few train months keep every row and train without early stopping
+
+    Args:
+        train_index (np.ndarray): Train row indices of the fold
+        months (np.ndarray): Month of every row
+        early_stopping_months (int): Number of train months held out for early stopping
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Fit and early stopping row indices of the fold
+    """
+    train_distinct_months = np.unique(months[train_index])
+    if early_stopping_months < 1 or len(train_distinct_months) <= early_stopping_months:
+        return train_index, train_index[:0]
+
+    is_stop = np.isin(months[train_index], train_distinct_months[-early_stopping_months:])
+
+    return train_index[~is_stop], train_index[is_stop]
+
+def cross_validate(model_to_be_used: str, model_params: Dict[str, Any], data: Dict[str, Any],
+                   cv_conf: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Cross validate the model with rolling origin folds over the months of the train and val
+    splits, the test split stays held out. The two splits are stacked into one matrix that
+    is written once and memory-mapped by a process pool training the folds in parallel,
+    every fold selects its rows with index arrays. The last early_stopping_months months of
+    every fold's train rows drive early stopping, the fold's val rows are only scored
+
+    Args:
+        model_to_be_used (str): Model type as specified in conf/model.yaml
+        model_params (Dict[str, Any]): Hyperparameters of the model
+        data (Dict[str, Any]): Output of the data pipeline
+        cv_conf (Dict[str, Any]): Cross validation parameters, see conf/model.yaml
+
+    Returns:
+        Dict[str, Any]: Train and val months, val RMSE and fit time of every fold and the mean
+            and standard deviation of the val RMSE
+    """
+    cv_conf = {**DEFAULT_CV_CONF, **cv_conf}
+    months = np.concatenate([data["months"]["train"], data["months"]["val"]])
+    train_months = None if cv_conf["method"] == "expanding" else cv_conf["train_months"]
+    if cv_conf["method"] == "rolling" and train_months is None:
+        raise ValueError("Rolling cross validation needs train_months")
+
+    folds = rolling_origin_folds(months, cv_conf["n_folds"], cv_conf["val_months"], train_months)
+    logger.info(f"Cross validating {len(folds)} {cv_conf['method']} folds")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shared_dir = Path(tmp_dir) / "shared"
+        fold_arrays = {}
+        for fold_index, (train_index, val_index) in enumerate(folds):
+            fit_index, stop_index = split_early_stopping(train_index, months, cv_conf["early_stopping_months"])
+            fold_arrays[f"fold_{fold_index}_train"] = fit_index
+            fold_arrays[f"fold_{fold_index}_stop"] = stop_index
+            fold_arrays[f"fold_{fold_index}_val"] = val_index
+        save_arrays(shared_dir, {
+            "X": sparse.vstack([data["train"][0], data["val"][0]], format="csr"),
+            "y": np.concatenate([data["train"][1], data["val"][1]]),
+            "months": months,
+            **fold_arrays
+        }, {"preprocessor": data["preprocessor"]})
+
+        with ProcessPoolExecutor(max_workers=cv_conf["n_jobs"], initializer=init_worker,
+                                 initargs=(shared_dir,)) as executor:
+            futures = [executor.submit(run_fold, model_to_be_used, model_params, fold_index)
+                       for fold_index in range(len(folds))]
+            fold_results = [future.result() for future in futures]
+
+    val_rmses = [fold["val_rmse"] for fold in fold_results]
+    for fold in fold_results:
+        logger.info(f"Fold {fold['fold']}: val months {fold['val_months']}, val RMSE {fold['val_rmse']:.4f}")
+
+    return {
+        "method": cv_conf["method"],
+        "folds": fold_results,
+        "mean_val_rmse": float(np.mean(val_rmses)),
+        "std_val_rmse": float(np.std(val_rmses))
+    }
+
+def init_worker(shared_dir: Path):
+    """
+    Memory-map the shared matrix and fold indices once per worker process
+
+    Args:
+        shared_dir (Path): Folder written with save_arrays
+    """
+    SHARED_DATA.update(load_arrays(shared_dir))
+    SHARED_DATA.update(load_objects(shared_dir))
+
+def run_fold(model_to_be_used: str, model_params: Dict[str, Any], fold_index: int) -> Dict[str, Any]:
+    """
+    Train the model on the train rows of one fold, stopping early on its early stopping
+    rows, and score it on its val rows, run inside a worker process
+
+    Args:
+        model_to_be_used (str): Model type as specified in conf/model.yaml
+        model_params (Dict[str, Any]): Hyperparameters of the model
+        fold_index (int): Index of the fold
+
+    Returns:
+        Dict[str, Any]: Train, early stopping and val months, val RMSE and fit time of the fold
+    """
+    data_X, data_y, months = SHARED_DATA["X"], SHARED_DATA["y"], SHARED_DATA["months"]
+    train_index = SHARED_DATA[f"fold_{fold_index}_train"]
+    stop_index = SHARED_DATA[f"fold_{fold_index}_stop"]
+    val_index = SHARED_DATA[f"fold_{fold_index}_val"]
+    val_X, val_y = data_X[val_index], data_y[val_index]
+    stop_X = stop_y = None
+    if len(stop_index) > 0:
+        stop_X, stop_y = data_X[stop_index], data_y[stop_index]
+
+    model = ModelFactory().create_model(model_to_be_used, model_params)
+    model.preprocessor = SHARED_DATA["preprocessor"]
+    start_time = time.perf_counter()
+    # The val rows are left out of the fit so the fold is scored on rows it never saw
+    model.train(data_X[train_index], data_y[train_index], stop_X, stop_y)
+    fit_seconds = time.perf_counter() - start_time
+
+    val_score = model.evaluate(val_y, model.predict(val_X), metrics="rmse")
+
+    return {
+        "fold": fold_index,
+        "train_months": np.unique(months[train_index]).tolist(),
+        "early_stopping_months": np.unique(months[stop_index]).tolist(),
+        "val_months": np.unique(months[val_index]).tolist(),
+        "train_rows": int(len(train_index)),
+        "val_rmse": float(val_score),
+        "fit_seconds": float(fit_seconds)
+    }
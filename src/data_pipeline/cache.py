@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Any
+
+import numpy as np
+from joblib import dump, load
+from scipy import sparse
+
+CODE_DIR = Path(__file__).resolve().parent
+FILE_HASHES_NAME = "file_hashes.json"
+MANIFEST_NAME = "manifest.json"
+HASH_BLOCK_SIZE = 1 << 20
+
+def hash_file(file_path: Path, cache_dir: Path) -> str:
+    """
+    Compute the sha256 digest of a file. Digests are memoized in cache_dir keyed on the
+    file's path, size and modification time so that unchanged raw files are not rehashed
+    on every run
+
+    Args:
+        file_path (Path): File to hash
+        cache_dir (Path): Directory where the memoized digests are kept
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    stat = os.stat(file_path)
+    memo_key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    memo_path = Path(cache_dir) / FILE_HASHES_NAME
+
+    memo = {}
+    if memo_path.is_file():
+        with open(memo_path, "r") as file:
+            memo = json.load(file)
+
+    if memo_key not in memo:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+
+        memo[memo_key] = digest.hexdigest()
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(memo_path, "w") as file:
+            json.dump(memo, file, indent=2)
+
+    return memo[memo_key]
+
+def code_version(code_dir: Path = CODE_DIR) -> str:
+    """
+    Hash the source code of the data pipeline so that any change to the pipeline
+    invalidates the previously cached matrices
+
+    Args:
+        code_dir (Path): Folder of the source files, defaults to the data pipeline
+
+    Returns:
+        str: Hex digest of the data pipeline source files
+    """
+    digest = hashlib.sha256()
+    for source_path in sorted(Path(code_dir).glob("*.py")):
+        digest.update(source_path.name.encode())
+        digest.update(source_path.read_bytes())
+
+    return digest.hexdigest()
+
+def cache_key(raw_data_paths: List[Path], params: Dict[str, Any], cache_dir: Path) -> str:
+    """
+    Build the content address of a pipeline run from the raw input files, the pipeline
+    parameters and the code version
+
+    Args:
+        raw_data_paths (List[Path]): Raw input files of the pipeline
+        params (Dict[str, Any]): Pipeline parameters (state code, rush hour type, drop lists, split ratios)
+        cache_dir (Path): Directory where the memoized file digests are kept
+
+    Returns:
+        str: Cache key of the run
+    """
+    key = {
+        "raw_data": [hash_file(path, cache_dir) for path in raw_data_paths],
+        "params": params,
+        "code_version": code_version()
+    }
+    encoded_key = json.dumps(key, sort_keys=True, default=str).encode()
+
+    return hashlib.sha256(encoded_key).hexdigest()[:16]
+
+def save_arrays(entry_dir: Path, arrays: Dict[str, Any], objects: Dict[str, Any] = None):
+    """
+    Save the arrays uncompressed in the .npy format so that they can be memory-mapped
+    when read back. Sparse CSR matrices are saved as their data, indices and indptr arrays.
+    The entry is written to a temporary folder first and renamed once complete so that an
+    interrupted run never leaves a partial entry behind
+
+    Args:
+        entry_dir (Path): Folder of the cache entry
+        arrays (Dict[str, Any]): Dense arrays or sparse CSR matrices to save, keyed by name
+        objects (Dict[str, Any]): Fitted objects saved with joblib, keyed by name
+    """
+    entry_dir = Path(entry_dir)
+    tmp_dir = entry_dir.with_name(entry_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {"arrays": [], "sparse": {}, "objects": sorted(objects or {})}
+    for name, array in arrays.items():
+        if sparse.issparse(array):
+            array = array.tocsr()
+            for component in ["data", "indices", "indptr"]:
+                np.save(tmp_dir / f"{name}.{component}.npy", getattr(array, component), allow_pickle=False)
+            manifest["sparse"][name] = list(array.shape)
+        else:
+            np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False)
+            manifest["arrays"].append(name)
+
+    for name, obj in (objects or {}).items():
+        dump(obj, tmp_dir / f"{name}.joblib")
+
+    with open(tmp_dir / MANIFEST_NAME, "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.rename(tmp_dir, entry_dir)
+
+def load_arrays(entry_dir: Path, mmap_mode: str = "r") -> Dict[str, Any]:
+    """
+    Load the arrays of a cache entry, memory-mapped by default. Sparse matrices are rebuilt
+    on top of their memory-mapped components
+
+    Args:
+        entry_dir (Path): Folder of the cache entry
+        mmap_mode (str): Memory-map mode passed to np.load, None to read into memory
+
+    Returns:
+        Dict[str, Any]: Dense arrays and sparse CSR matrices keyed by name
+    """
+    entry_dir = Path(entry_dir)
+    with open(entry_dir / MANIFEST_NAME, "r") as file:
+        manifest = json.load(file)
+
+    arrays = {name: np.load(entry_dir / f"{name}.npy", mmap_mode=mmap_mode, allow_pickle=False)
+              for name in manifest["arrays"]}
+
+    for name, shape in manifest.get("sparse", {}).items():
+        data, indices, indptr = [np.load(entry_dir / f"{name}.{component}.npy", mmap_mode=mmap_mode,
+                                         allow_pickle=False)
+                                 for component in ["data", "indices", "indptr"]]
+        arrays[name] = sparse.csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+
+    return arrays
+
+def load_objects(entry_dir: Path) -> Dict[str, Any]:
+    """
+    Load the fitted objects of a cache entry
+
+    Args:
+        entry_dir (Path): Folder of the cache entry
+
+    Returns:
+        Dict[str, Any]: Objects keyed by name
+    """
+    entry_dir = Path(entry_dir)
+    with open(entry_dir / MANIFEST_NAME, "r") as file:
+        manifest = json.load(file)
+
+    return {name: load(entry_dir / f"{name}.joblib") for name in manifest.get("objects", [])}
+
+def has_entry(entry_dir: Path) -> bool:
+    """
+    Check whether a complete cache entry exists
+
+    Args:
+        entry_dir (Path): Folder of the cache entry
+
+    Returns:
+        bool: True if the entry can be loaded
+    """
+    return (Path(entry_dir) / MANIFEST_NAME).is_file()
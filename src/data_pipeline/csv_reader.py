@@ -0,0 +1,185 @@
+from pathlib import Path
+from typing import Dict, Iterator, List
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+# Engines of read_csv and read_csv_chunks, arrow falls back to pandas without pyarrow
+CSV_ENGINES = ["pandas", "arrow"]
+# Bytes of csv per block of the arrow engine, the blocks are parsed on separate threads and
+# every block is one chunk
+ARROW_BLOCK_SIZE = 16 << 20
+
+logger = logging.getLogger("CSV Reader")
+
+def resolve_engine(engine: str) -> str:
+    """
+    Return the engine the csv files are read with, arrow falls back to pandas when pyarrow is
+    not installed
+
+    Args:
+        engine (str): Either pandas or arrow
+
+    Returns:
+        str: Engine to read with
+    """
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown csv engine {engine}, expected one of {CSV_ENGINES}")
+
+    if engine == "arrow" and pa_csv is None:
+        logger.warning("pyarrow is not installed, reading the csv files with pandas")
+        return "pandas"
+
+    return engine
+
+def read_csv(data_path: Path, column_types: Dict[str, str], usecols: List[str] = None,
+             engine: str = "pandas") -> pd.DataFrame:
+    """
+    Read a raw gzip csv with the column types of the schema instead of inferring them. Both
+    engines give the same DataFrame
+
+    Args:
+        data_path (Path): File path to the raw gzip csv
+        column_types (Dict[str, str]): Type of every column of the file in file order, see
+            TRAFFIC_COLUMN_TYPES and STATION_COLUMN_TYPES
+        usecols (List[str]): Columns to parse, every column if None
+        engine (str): Either pandas or arrow, the arrow engine parses on every core
+
+    Returns:
+        pd.DataFrame: The parsed columns in file order
+    """
+    if resolve_engine(engine) == "pandas":
+        return pd.read_csv(data_path, compression="gzip", usecols=usecols,
+                           dtype=pandas_dtypes(column_types, usecols))
+
+    table = pa_csv.read_csv(data_path, read_options=pa_csv.ReadOptions(use_threads=True),
+                            convert_options=arrow_convert_options(column_types, usecols))
+
+    return arrow_to_pandas(table, column_types)
+
+def read_csv_chunks(data_path: Path, column_types: Dict[str, str], usecols: List[str],
+                    chunksize: int, engine: str = "pandas") -> Iterator[pd.DataFrame]:
+    """
+    Stream a raw gzip csv in chunks with the column types of the schema. The chunks keep the
+    row numbers of the file as index with either engine
+
+    Args:
+        data_path (Path): File path to the raw gzip csv
+        column_types (Dict[str, str]): Type of every column of the file in file order
+        usecols (List[str]): Columns to parse
+        chunksize (int): Number of rows per chunk of the pandas engine, the arrow engine reads
+            blocks of ARROW_BLOCK_SIZE bytes
+        engine (str): Either pandas or arrow, the arrow engine parses the blocks on every core
+            while the file is decompressed
+
+    Yields:
+        pd.DataFrame: Chunks of the parsed columns in file order
+    """
+    if resolve_engine(engine) == "pandas":
+        with pd.read_csv(data_path, compression="gzip", chunksize=chunksize, usecols=usecols,
+                         dtype=pandas_dtypes(column_types, usecols)) as reader:
+            yield from reader
+        return
+
+    num_rows = 0
+    for batch in open_arrow_csv(data_path, column_types, usecols):
+        chunk = arrow_to_pandas(batch, column_types)
+        chunk.index = pd.RangeIndex(num_rows, num_rows + len(chunk))
+        num_rows += len(chunk)
+        yield chunk
+
+def open_arrow_csv(data_path: Path, column_types: Dict[str, str],
+                   usecols: List[str] = None) -> "pa_csv.CSVStreamingReader":
+    """
+    Open a raw gzip csv as a stream of arrow record batches of ARROW_BLOCK_SIZE bytes of csv,
+    parsed on every core with the column types of the schema
+
+    Args:
+        data_path (Path): File path to the raw gzip csv
+        column_types (Dict[str, str]): Type of every column of the file in file order
+        usecols (List[str]): Columns to parse, every column if None
+
+    Returns:
+        pa_csv.CSVStreamingReader: Reader of the record batches
+    """
+    return pa_csv.open_csv(data_path,
+                           read_options=pa_csv.ReadOptions(use_threads=True, block_size=ARROW_BLOCK_SIZE),
+                           convert_options=arrow_convert_options(column_types, usecols))
+
+def empty_frame(column_types: Dict[str, str], usecols: List[str] = None) -> pd.DataFrame:
+    """
+    Return the DataFrame read_csv gives for a file without rows, the columns are in file
+    order with the types of the schema
+
+    Args:
+        column_types (Dict[str, str]): Type of every column of the file in file order
+        usecols (List[str]): Columns to parse, every column if None
+
+    Returns:
+        pd.DataFrame: Empty DataFrame
+    """
+    return pd.DataFrame({column: pd.Series(dtype=object if column_type == "str" else column_type)
+                         for column, column_type in column_types.items()
+                         if usecols is None or column in usecols})
+
+def pandas_dtypes(column_types: Dict[str, str], usecols: List[str] = None) -> Dict[str, str]:
+    """
+    Return the dtypes pandas parses the columns with. Integer columns are left to pandas, as it
+    reads the ones with missing values as float64 like arrow does
+
+    Args:
+        column_types (Dict[str, str]): Type of every column of the file
+        usecols (List[str]): Columns to parse, every column if None
+
+    Returns:
+        Dict[str, str]: dtype of the string and float columns
+    """
+    return {column: column_type for column, column_type in column_types.items()
+            if column_type != "int64" and (usecols is None or column in usecols)}
+
+def arrow_convert_options(column_types: Dict[str, str], usecols: List[str] = None) -> "pa_csv.ConvertOptions":
+    """
+    Build the arrow convert options, every column gets its type from the schema and the missing
+    values of pandas are missing values
+
+    Args:
+        column_types (Dict[str, str]): Type of every column of the file in file order
+        usecols (List[str]): Columns to parse, every column if None
+
+    Returns:
+        pa_csv.ConvertOptions: The convert options
+    """
+    columns = [column for column in column_types if usecols is None or column in usecols]
+
+    return pa_csv.ConvertOptions(column_types={column: pa.type_for_alias("string" if column_types[column] == "str"
+                                                                         else column_types[column])
+                                               for column in columns},
+                                 include_columns=columns if usecols is not None else None,
+                                 null_values=sorted(STR_NA_VALUES), strings_can_be_null=True)
+
+def arrow_to_pandas(data: "pa.Table", column_types: Dict[str, str]) -> pd.DataFrame:
+    """
+    Convert an arrow table or record batch into the DataFrame pandas would have parsed, the
+    missing strings become NaN instead of None
+
+    Args:
+        data (pa.Table): Parsed arrow table or record batch
+        column_types (Dict[str, str]): Type of every column of the file
+
+    Returns:
+        pd.DataFrame: The DataFrame
+    """
+    df = data.to_pandas()
+    for column in df.columns:
+        if column_types.get(column) == "str" and df[column].hasnans:
+            df[column] = df[column].fillna(np.nan)
+
+    return df
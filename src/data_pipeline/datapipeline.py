@@ -1,87 +1,359 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Any, Tuple
 import logging
 
 from src.data_pipeline.utils import train_val_test_split
-from src.data_pipeline.feature_engineering import *
-from src.data_pipeline.preprocess_data import *
+from src.data_pipeline.preprocess_data import (COLUMNS_TO_DROP, STATE_CODE, load_data, plan_columns,
+                                               preprocess_data, preprocess_state, rush_hour_volume_columns)
 from src.data_pipeline.encoding import encode_categorical
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from src.data_pipeline.cache import cache_key, has_entry, load_arrays, load_objects, save_arrays
+from src.data_pipeline.incremental import update_pipeline
+from src.data_pipeline.preprocessor import GROUP_COLUMNS, Preprocessor, TARGET_COLUMN, group_labels
+from src.data_pipeline.schema import RUSH_HOUR_TARGET_COLUMNS
+from src.instrumentation import run_stage
+from scipy import sparse
 import numpy as np
+import pandas as pd
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("Data Pipeline")
 
 RAW_STATION_DATA_PATH = Path("data/raw/dot_traffic_stations_2015.txt.gz")
 RAW_TRAFFIC_DATA_PATH = Path("data/raw/dot_traffic_2015.txt.gz")
 
-def run_pipeline(traffic_data_path: Path, station_data_path: Path):
-    TRAIN_FILE_PATH = "data/processed/train.csv"
-    VAL_FILE_PATH = "data/processed/val.csv"
-    TEST_FILE_PATH = "data/processed/test.csv"
+DEFAULT_PIPELINE_CONF = {
+    "state_code": STATE_CODE,
+    "rush_hour_type": "pm",
+    "split_ratios": {"train": 0.8, "val": 0.1, "test": 0.1},
+    "columns_to_drop": COLUMNS_TO_DROP,
+    "output": "combined",
+    "incremental": False,
+    "incremental_refit": True,
+    "lag_features": False,
+    "csv_engine": "pandas",
+    "dataset_dir": None,
+    "n_jobs": None,
+    "cache_dir": "data/processed"
+}
+# Settings that do not change the content of the processed matrices
+UNCACHED_CONF_KEYS = ["n_jobs", "cache_dir", "csv_engine", "dataset_dir"]
 
-    if not os.path.isfile(TRAIN_FILE_PATH):
+def run_pipeline(traffic_data_path: Path, station_data_path: Path,
+                 pipeline_conf: Dict[str, Any] = None) -> Dict[Any, Any]:
+    """
+    Run the data pipeline and return the encoded train, val and test matrices.
 
+    The matrices are cached under a key derived from the raw input files, the pipeline
+    parameters and the pipeline's code version, so a stale cache is never reused and a
+    warm run skips csv parsing and encoder fitting entirely by memory-mapping the arrays.
+
+    When state_code is a list of state codes or "all", the raw files are read once and
+    every state is processed in its own worker process. With output set to combined the
+    states are stacked into one dataset with a state column, with output set to per_state
+    every state gets its own matrices.
+
+    With incremental set, only the months that are not in the processed store yet are read
+    and appended to it and the split rolls forward with the months, see update_pipeline
+
+    With rush_hour_type set to both, the am and pm targets are built from one pass over the
+    raw data and share one feature matrix, the am model gets the columns of it counted
+    before the am rush hour, see select_rush_hour
+
+    Args:
+        traffic_data_path (Path): Filepath to the raw traffic data
+        station_data_path (Path): Filepath to the raw station data
+        pipeline_conf (Dict[str, Any]): Pipeline parameters, see conf/pipeline.yaml
+
+    Returns:
+        Dict[Any, Any]: Features (sparse CSR) and targets for each of train, val and test, the
+            month of every row keyed as months, the group labels of every row keyed as groups
+            and the fitted preprocessor, keyed by state code first when output is per_state
+            and by am and pm first when rush_hour_type is both
+    """
+    pipeline_conf = {**DEFAULT_PIPELINE_CONF, **(pipeline_conf or {})}
+    if is_per_target(pipeline_conf) and is_per_state(pipeline_conf):
+        raise ValueError("Both rush hours are only built for combined output")
+    if pipeline_conf["incremental"]:
+        return to_splits(*update_pipeline(traffic_data_path, station_data_path, pipeline_conf))
+
+    cache_dir = Path(pipeline_conf["cache_dir"])
+    params = {key: value for key, value in pipeline_conf.items() if key not in UNCACHED_CONF_KEYS}
+
+    key = cache_key([traffic_data_path, station_data_path], params, cache_dir)
+    entry_dir = cache_dir / key
+
+    if has_entry(entry_dir):
+        logger.info(f"Cached matrices found for key {key}, memory-mapping them")
+        arrays = run_stage("cache_load", load_arrays, entry_dir)
+        preprocessors = load_objects(entry_dir)
+
+    elif isinstance(pipeline_conf["state_code"], int):
         logger.info("Preprocessing Data")
-        combined_df = preprocess_data(RAW_TRAFFIC_DATA_PATH, RAW_STATION_DATA_PATH)
+        combined_df = preprocess_data(traffic_data_path, station_data_path,
+                                      state_code=pipeline_conf["state_code"],
+                                      rush_hour_type=pipeline_conf["rush_hour_type"],
+                                      columns_to_drop=pipeline_conf["columns_to_drop"],
+                                      lag_features=pipeline_conf["lag_features"],
+                                      csv_engine=pipeline_conf["csv_engine"],
+                                      dataset_dir=pipeline_conf["dataset_dir"])
 
         logger.info("Encoding data")
-        combined_df = encode_categorical(combined_df)
+        combined_df = run_stage("encode_categorical", encode_categorical, combined_df)
 
         logger.info("Splitting data")
-        train, val, test = train_val_test_split(combined_df, 0.8, 0.1, 0.1)
+        split_ratios = pipeline_conf["split_ratios"]
+        train, val, test = run_stage("split", train_val_test_split, combined_df, split_ratios["train"],
+                                     split_ratios["val"], split_ratios["test"])
+
+        logger.info("Encoding and scaling data")
+        arrays, preprocessor = encode_and_scale(train, val, test, pipeline_conf["rush_hour_type"])
+        preprocessors = {"preprocessor": preprocessor}
+
+        logger.info(f"Caching matrices under key {key}")
+        save_arrays(entry_dir, arrays, preprocessors)
 
-        train.to_csv(TRAIN_FILE_PATH, index=False)
-        val.to_csv(VAL_FILE_PATH, index=False)
-        test.to_csv(TEST_FILE_PATH, index=False)
-    
     else:
-        logger.info("Train, val, test csv found, reading them")
-        train = pd.read_csv(TRAIN_FILE_PATH)
-        val = pd.read_csv(VAL_FILE_PATH)
-        test = pd.read_csv(TEST_FILE_PATH)
+        state_splits = split_states(traffic_data_path, station_data_path, pipeline_conf)
+
+        logger.info("Encoding and scaling data")
+        if pipeline_conf["output"] == "per_state":
+            arrays, preprocessors = {}, {}
+            for state_code, (train, val, test) in state_splits.items():
+                state_arrays, preprocessor = encode_and_scale(train, val, test, pipeline_conf["rush_hour_type"])
+                arrays.update({f"state_{state_code}_{name}": array for name, array in state_arrays.items()})
+                preprocessors[f"state_{state_code}_preprocessor"] = preprocessor
+        else:
+            arrays, preprocessor = encode_and_scale(*combine_state_splits(state_splits),
+                                                    rush_hour_type=pipeline_conf["rush_hour_type"])
+            preprocessors = {"preprocessor": preprocessor}
+
+        logger.info(f"Caching matrices under key {key}")
+        save_arrays(entry_dir, arrays, preprocessors)
+
+    if is_per_state(pipeline_conf):
+        state_codes = sorted({int(name.split("_")[1]) for name in arrays})
+        return {state_code: to_splits(arrays, preprocessors, prefix=f"state_{state_code}_")
+                for state_code in state_codes}
+
+    if is_per_target(pipeline_conf):
+        return {rush_hour_type: select_rush_hour(to_splits(arrays, preprocessors, target=rush_hour_type),
+                                                 rush_hour_type)
+                for rush_hour_type in RUSH_HOUR_TARGET_COLUMNS}
+
+    return to_splits(arrays, preprocessors)
+
+def is_per_state(pipeline_conf: Dict[str, Any]) -> bool:
+    """
+    Check whether the pipeline returns separate matrices for every state
+
+    Args:
+        pipeline_conf (Dict[str, Any]): Pipeline parameters, see conf/pipeline.yaml
+
+    Returns:
+        bool: True if the output is keyed by state code
+    """
+    return pipeline_conf.get("output") == "per_state" and not isinstance(pipeline_conf["state_code"], int)
+
+def is_per_target(pipeline_conf: Dict[str, Any]) -> bool:
+    """
+    Check whether the pipeline returns the splits of both rush hours
+
+    Args:
+        pipeline_conf (Dict[str, Any]): Pipeline parameters, see conf/pipeline.yaml
+
+    Returns:
+        bool: True if the output is keyed by am and pm
+    """
+    return pipeline_conf.get("rush_hour_type") == "both"
+
+def select_rush_hour(splits: Dict[str, Any], rush_hour_type: str) -> Dict[str, Any]:
+    """
+    Drop the volume columns counted from the start of the rush hour on from the shared
+    feature matrices, which hold every column the pm rush hour may see. The matrices and the
+    preprocessor keep the other columns so that the saved model transforms inference records
+    into the same features
+
+    Args:
+        splits (Dict[str, Any]): Output of to_splits on the shared matrices
+        rush_hour_type (str): Either am or pm
+
+    Returns:
+        Dict[str, Any]: The splits with the features of the rush hour
+    """
+    preprocessor = splits["preprocessor"]
+    leaking_columns = rush_hour_volume_columns(preprocessor.num_columns, rush_hour_type)
+    if not leaking_columns:
+        return splits
+
+    preprocessor, feature_columns = preprocessor.select([column for column in preprocessor.num_columns
+                                                         if column not in leaking_columns])
+    for split in ["train", "val", "test"]:
+        splits[split] = [splits[split][0][:, feature_columns], splits[split][1]]
+    splits["preprocessor"] = preprocessor
+
+    return splits
+
+def to_splits(arrays: Dict[str, Any], preprocessors: Dict[str, Preprocessor],
+              prefix: str = "", target: str = None) -> Dict[str, Any]:
+    """
+    Group the cached arrays into [features, target] pairs for each of train, val and test,
+    along with the month and group labels of every row and the preprocessor that produced
+    the features
+
+    Args:
+        arrays (Dict[str, Any]): Arrays keyed as {prefix}{split}_X, {prefix}{split}_y,
+            {prefix}{split}_month and {prefix}{split}_{group column}
+        preprocessors (Dict[str, Preprocessor]): Fitted preprocessors keyed as {prefix}preprocessor
+        prefix (str): Prefix of the array names
+        target (str): Rush hour of the targets, am or pm, when both were built and the targets
+            are keyed as {prefix}{split}_y_{target}
+
+    Returns:
+        Dict[str, Any]: Features and targets for each of train, val and test, the months and
+            group labels of every split and the preprocessor
+    """
+    target_suffix = f"_{target}" if target is not None else ""
+    splits = {split: [arrays[f"{prefix}{split}_X"], arrays[f"{prefix}{split}_y{target_suffix}"]]
+              for split in ["train", "val", "test"]}
+    splits["months"] = {split: arrays[f"{prefix}{split}_month"] for split in ["train", "val", "test"]}
+    # Group columns dropped by the preprocessing have no labels
+    splits["groups"] = {split: {column: arrays[f"{prefix}{split}_{column}"] for column in GROUP_COLUMNS
+                                if f"{prefix}{split}_{column}" in arrays}
+                        for split in ["train", "val", "test"]}
+    splits["preprocessor"] = preprocessors[f"{prefix}preprocessor"]
+
+    return splits
+
+def split_states(traffic_data_path: Path, station_data_path: Path,
+                 pipeline_conf: Dict[str, Any]) -> Dict[int, Tuple[pd.DataFrame]]:
+    """
+    Read the raw files once for all the requested states and fan the merge, feature
+    engineering and split stages out per state across a process pool
+
+    Args:
+        traffic_data_path (Path): Filepath to the raw traffic data
+        station_data_path (Path): Filepath to the raw station data
+        pipeline_conf (Dict[str, Any]): Pipeline parameters, see conf/pipeline.yaml
+
+    Returns:
+        Dict[int, Tuple[pd.DataFrame]]: Train, val and test set of every state
+    """
+    logger.info(f"Loading data of states: {pipeline_conf['state_code']}")
+    usecols = plan_columns(pipeline_conf["rush_hour_type"], pipeline_conf["columns_to_drop"])
+    traffic_df, station_df = run_stage("load", load_data, traffic_data_path, station_data_path,
+                                       state_code=pipeline_conf["state_code"], usecols=usecols,
+                                       csv_engine=pipeline_conf["csv_engine"],
+                                       dataset_dir=pipeline_conf["dataset_dir"])
 
+    station_groups = dict(tuple(station_df.groupby("fips_state_code")))
 
-    train_X = train.drop("peak_hour_traffic_volume", axis=1).copy()
-    train_y = train["peak_hour_traffic_volume"].copy()
+    logger.info(f"Preprocessing {len(station_groups)} states in parallel")
+    return run_stage("preprocess_states", preprocess_states, traffic_df.groupby("fips_state_code"),
+                     station_groups, pipeline_conf)
 
-    val_X = val.drop("peak_hour_traffic_volume", axis=1).copy()
-    val_y = val["peak_hour_traffic_volume"].copy()
+def preprocess_states(traffic_groups: Any, station_groups: Dict[int, pd.DataFrame],
+                      pipeline_conf: Dict[str, Any]) -> Dict[int, Tuple[pd.DataFrame]]:
+    """
+    Run split_state for every state with station data across a process pool. The stages
+    inside the workers are not instrumented, only the pool as a whole
 
-    test_X = test.drop("peak_hour_traffic_volume", axis=1)
-    test_y = test["peak_hour_traffic_volume"].copy()
+    Args:
+        traffic_groups (Any): Traffic data grouped by fips_state_code
+        station_groups (Dict[int, pd.DataFrame]): Station data of every state
+        pipeline_conf (Dict[str, Any]): Pipeline parameters, see conf/pipeline.yaml
 
-    logger.info("Encoding and scaling data")
-    scaler = StandardScaler()
-    encoder = OneHotEncoder(handle_unknown="ignore", sparse=False)
+    Returns:
+        Dict[int, Tuple[pd.DataFrame]]: Train, val and test set of every state
+    """
+    state_splits = {}
+    with ProcessPoolExecutor(max_workers=pipeline_conf["n_jobs"]) as executor:
+        futures = {}
+        for state_code, state_traffic_df in traffic_groups:
+            if state_code not in station_groups:
+                continue
 
-    num_columns = train_X.select_dtypes(include=np.number).columns.tolist()
-    cat_columns = train_X.select_dtypes(include="object").columns.tolist()
+            futures[state_code] = executor.submit(split_state, state_traffic_df, station_groups[state_code],
+                                                  pipeline_conf["rush_hour_type"],
+                                                  pipeline_conf["columns_to_drop"],
+                                                  pipeline_conf["split_ratios"],
+                                                  pipeline_conf["lag_features"])
+        for state_code, future in futures.items():
+            state_splits[int(state_code)] = future.result()
 
-    train_scaled_columns = scaler.fit_transform(train[num_columns])
-    train_encoded_columns = encoder.fit_transform(train[cat_columns])
-    train_processed = np.concatenate([train_scaled_columns, train_encoded_columns], axis=1)
+    return state_splits
 
-    val_scaled_columns = scaler.transform(val[num_columns])
-    val_encoded_columns = encoder.transform(val[cat_columns])
-    val_processed = np.concatenate([val_scaled_columns, val_encoded_columns], axis=1)
+def split_state(traffic_df: pd.DataFrame, station_df: pd.DataFrame, rush_hour_type: str,
+                columns_to_drop: List[str], split_ratios: Dict[str, float],
+                lag_features: bool = False) -> Tuple[pd.DataFrame]:
+    """
+    Preprocess and split the data of a single state, run inside a worker process
 
-    test_scaled_columns = scaler.transform(test[num_columns])
-    test_encoded_columns = encoder.transform(test[cat_columns])
-    test_processed = np.concatenate([test_scaled_columns, test_encoded_columns], axis=1)
+    Args:
+        traffic_df (pd.DataFrame): Traffic data of the state
+        station_df (pd.DataFrame): Station data of the state
+        rush_hour_type (str): Whether to predict am or pm rush hour or both (Only am, pm or both)
+        columns_to_drop (List[str]): Columns to drop before encoding features
+        split_ratios (Dict[str, float]): Train, val and test ratios
+        lag_features (bool): Whether to create the per station lag and rolling window features
 
-    return {
-        "train": [train_processed, train_y],
-        "val": [val_processed, val_y],
-        "test": [test_processed, test_y]
-    }
+    Returns:
+        Tuple[pd.DataFrame]: Tuple of train/validation/test
+    """
+    combined_df = preprocess_state(traffic_df, station_df, rush_hour_type, columns_to_drop, lag_features)
+    combined_df = encode_categorical(combined_df)
 
+    return train_val_test_split(combined_df, split_ratios["train"],
+                                split_ratios["val"], split_ratios["test"])
 
+def combine_state_splits(state_splits: Dict[int, Tuple[pd.DataFrame]]) -> Tuple[pd.DataFrame]:
+    """
+    Stack the splits of every state into one dataset with a state column. Only the columns
+    that survived the preprocessing of every state are kept
 
+    Args:
+        state_splits (Dict[int, Tuple[pd.DataFrame]]): Train, val and test set of every state
 
+    Returns:
+        Tuple[pd.DataFrame]: Tuple of train/validation/test
+    """
+    combined_splits = []
+    for split_index in range(3):
+        split_dfs = [splits[split_index].assign(state=str(state_code))
+                     for state_code, splits in state_splits.items()]
+        combined_splits.append(pd.concat(split_dfs, join="inner", ignore_index=True))
 
+    return tuple(combined_splits)
 
+def encode_and_scale(train: pd.DataFrame, val: pd.DataFrame, test: pd.DataFrame,
+                     rush_hour_type: str = "pm") -> Tuple[Dict[str, sparse.csr_matrix], Preprocessor]:
+    """
+    Scale the numerical columns and one hot encode the categorical columns into sparse CSR
+    matrices, the preprocessor is fitted on the train set only
 
+    Args:
+        train (pd.DataFrame): Train set
+        val (pd.DataFrame): Validation set
+        test (pd.DataFrame): Test set
+        rush_hour_type (str): Whether to predict am or pm rush hour or both, the targets of
+            both are keyed as {split}_y_am and {split}_y_pm
 
+    Returns:
+        Tuple: Features, targets, month and group labels of every row of each set keyed as
+            {split}_X, {split}_y, {split}_month and {split}_{group column}, and the fitted
+            preprocessor
+    """
+    preprocessor = run_stage("encode_fit", Preprocessor().fit, train)
 
+    arrays = {}
+    for split, df in [("train", train), ("val", val), ("test", test)]:
+        arrays[f"{split}_X"] = run_stage("encode_transform", preprocessor.transform, df)
+        if rush_hour_type == "both":
+            arrays.update({f"{split}_y_{target}": df[column].to_numpy()
+                           for target, column in RUSH_HOUR_TARGET_COLUMNS.items()})
+        else:
+            arrays[f"{split}_y"] = df[TARGET_COLUMN].to_numpy()
+        arrays[f"{split}_month"] = df["month_of_data"].to_numpy()
+        arrays.update(group_labels(df, prefix=f"{split}_"))
 
+    return arrays, preprocessor
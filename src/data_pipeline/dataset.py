@@ -0,0 +1,184 @@
+from src.data_pipeline.cache import hash_file
+from src.data_pipeline.csv_reader import arrow_to_pandas, open_arrow_csv
+from src.data_pipeline.schema import STATION_COLUMN_TYPES, TRAFFIC_COLUMN_TYPES
+
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = ds = None
+
+DATASET_DIR = Path("data/interim/dataset")
+MANIFEST_NAME = "manifest.json"
+# Hive partitions of every table of the dataset, the year comes first so that the dumps of
+# other years are added next to the existing ones
+PARTITION_COLUMNS = {
+    "traffic": ["year_of_data", "fips_state_code", "month_of_data"],
+    "stations": ["year_of_data", "fips_state_code"]
+}
+COLUMN_TYPES = {"traffic": TRAFFIC_COLUMN_TYPES, "stations": STATION_COLUMN_TYPES}
+# Row number of every record in its raw file, the records are read back in file order
+ROW_COLUMN = "row_number"
+# Rows buffered per partition before a row group is written, the raw files are not sorted
+# by partition so every block of the csv only holds a few rows of each
+MIN_ROWS_PER_GROUP = 1 << 14
+
+logger = logging.getLogger("Dataset")
+
+def ingest_raw_data(traffic_data_path: Path, station_data_path: Path, dataset_dir: Path = DATASET_DIR):
+    """
+    Convert the raw traffic and station dumps into partitioned parquet tables once, so that the
+    pipeline reads only the partitions and columns it needs instead of parsing the csv files.
+    The partitions of the years in the dumps are replaced and the other years are kept
+
+    Args:
+        traffic_data_path (Path): File path to the raw traffic data
+        station_data_path (Path): File path to the raw station data
+        dataset_dir (Path): Folder of the dataset
+    """
+    if ds is None:
+        raise ImportError("Building the dataset needs pyarrow, pip install pyarrow")
+
+    manifest = load_manifest(dataset_dir)
+    for table, data_path in [("traffic", traffic_data_path), ("stations", station_data_path)]:
+        years = write_partitions(data_path, Path(dataset_dir) / table, table)
+        digest = hash_file(data_path, dataset_dir)
+
+        # Dumps whose years were replaced are not in the dataset anymore
+        manifest[table] = {source: entry for source, entry in manifest[table].items()
+                           if source != digest and not set(entry["years"]) & set(years)}
+        manifest[table][digest] = {"file": Path(data_path).name, "years": years}
+        logger.info(f"Ingested {data_path} into {table}, years {years}")
+
+    with open(Path(dataset_dir) / MANIFEST_NAME, "w") as file:
+        json.dump(manifest, file, indent=2)
+
+def write_partitions(data_path: Path, table_dir: Path, table: str) -> List[int]:
+    """
+    Stream a raw gzip csv into hive partitioned parquet files. The partitions are written into
+    a staging folder first and every year folder then replaces the one in the table
+
+    Args:
+        data_path (Path): File path to the raw gzip csv
+        table_dir (Path): Folder of the table
+        table (str): Either traffic or stations
+
+    Returns:
+        List[int]: Years held by the csv
+    """
+    column_types = COLUMN_TYPES[table]
+    staging_dir = table_dir / ".staging"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    reader = open_arrow_csv(data_path, column_types)
+    schema = reader.schema.append(pa.field(ROW_COLUMN, pa.int64()))
+
+    def numbered_batches():
+        num_rows = 0
+        for batch in reader:
+            row_numbers = pa.array(range(num_rows, num_rows + batch.num_rows), pa.int64())
+            num_rows += batch.num_rows
+            yield pa.RecordBatch.from_arrays([*batch.columns, row_numbers], schema=schema)
+
+    ds.write_dataset(numbered_batches(), staging_dir, schema=schema, format="parquet",
+                     partitioning=partitioning(table), min_rows_per_group=MIN_ROWS_PER_GROUP,
+                     basename_template=f"{Path(data_path).name.split('.')[0]}-{{i}}.parquet")
+
+    years = []
+    for year_dir in sorted(staging_dir.iterdir()):
+        shutil.rmtree(table_dir / year_dir.name, ignore_errors=True)
+        os.replace(year_dir, table_dir / year_dir.name)
+        years.append(int(year_dir.name.split("=")[1]))
+    staging_dir.rmdir()
+
+    return years
+
+def partitioning(table: str) -> "ds.Partitioning":
+    """
+    Return the hive partitioning of a table, the partition values are integers
+    """
+    return ds.partitioning(pa.schema([(column, pa.int64()) for column in PARTITION_COLUMNS[table]]),
+                           flavor="hive")
+
+def load_manifest(dataset_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Load the manifest of the dataset, the years of every ingested dump keyed by table and the
+    sha256 digest of the dump
+
+    Args:
+        dataset_dir (Path): Folder of the dataset
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The manifest, empty tables if nothing was ingested
+    """
+    manifest_path = Path(dataset_dir) / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return {table: {} for table in PARTITION_COLUMNS}
+
+    with open(manifest_path, "r") as file:
+        return json.load(file)
+
+def ingested_years(dataset_dir: Path, table: str, data_path: Path) -> List[int]:
+    """
+    Return the years of the dataset that were ingested from the raw file
+
+    Args:
+        dataset_dir (Path): Folder of the dataset
+        table (str): Either traffic or stations
+        data_path (Path): File path to the raw gzip csv
+
+    Returns:
+        List[int]: Years of the raw file, None if the dataset does not hold its current content
+    """
+    if ds is None or not (Path(dataset_dir) / MANIFEST_NAME).is_file():
+        return None
+
+    entry = load_manifest(dataset_dir)[table].get(hash_file(data_path, dataset_dir))
+
+    return entry["years"] if entry is not None else None
+
+def read_partitions(dataset_dir: Path, table: str, years: List[int], usecols: List[str] = None,
+                    state_code: Union[int, List[int], str] = "all",
+                    skip_periods: List[int] = None) -> pd.DataFrame:
+    """
+    Read the rows of some years, states and months of a table. The filters prune the partitions
+    before any file is opened and only the columns in usecols are read from the files. The rows
+    come back in the order and with the row numbers of the raw file, like read_csv_chunks gives
+    them
+
+    Args:
+        dataset_dir (Path): Folder of the dataset
+        table (str): Either traffic or stations
+        years (List[int]): Years to read, see ingested_years
+        usecols (List[str]): Columns to read, every column if None
+        state_code (Union[int, List[int], str]): State code or list of state codes to keep,
+            "all" keeps every state
+        skip_periods (List[int]): Periods (yymm integers, see period_of) of the rows to drop
+
+    Returns:
+        pd.DataFrame: The rows indexed by their row number in the raw file
+    """
+    expression = ds.field("year_of_data").isin(years)
+    if state_code != "all":
+        expression &= ds.field("fips_state_code").isin([state_code] if isinstance(state_code, int) else state_code)
+    for period in skip_periods or []:
+        expression &= ~((ds.field("year_of_data") == period // 100) & (ds.field("month_of_data") == period % 100))
+
+    column_types = COLUMN_TYPES[table]
+    columns = [column for column in column_types if usecols is None or column in usecols]
+    dataset = ds.dataset(Path(dataset_dir) / table, format="parquet", partitioning=partitioning(table))
+    arrow_table = dataset.to_table(columns=[*columns, ROW_COLUMN], filter=expression).sort_by(ROW_COLUMN)
+
+    df = arrow_to_pandas(arrow_table.select(columns), column_types)
+    df.index = pd.Index(arrow_table.column(ROW_COLUMN).to_numpy())
+
+    return df
@@ -32,6 +32,6 @@ def encode_categorical(df: pd.DataFrame) -> pd.DataFrame:
         if df[column].dtype == "object":
             object_list.append(column)
         
-    df[object_list].astype("category")
+    df[object_list] = df[object_list].astype("category")
 
     return df
\ No newline at end of file
@@ -1,8 +1,25 @@
+import numpy as np
 import pandas as pd
 
+from src.data_pipeline.schema import RUSH_HOUR_TARGET_COLUMNS
+
 import datetime as datetime
 from dateutil.relativedelta import relativedelta
 
+# Volume columns summed into the target of every rush hour
+PEAK_HOUR_COLUMNS = {
+    "am": ["traffic_volume_counted_after_0600_to_0700", "traffic_volume_counted_after_0700_to_0800",
+           "traffic_volume_counted_after_0800_to_0900", "traffic_volume_counted_after_0900_to_1000"],
+    "pm": ["traffic_volume_counted_after_1500_to_1600", "traffic_volume_counted_after_1600_to_1700",
+           "traffic_volume_counted_after_1700_to_1800", "traffic_volume_counted_after_1800_to_1900"]
+}
+# Every station, direction and lane has its own series of daily peak hour volumes
+LAG_SERIES_COLUMNS = ["station", "direction_of_travel_name", "lane_of_travel"]
+# Lag features and their offset in days
+LAG_DAYS = {"peak_volume_previous_day": 1, "peak_volume_same_weekday_last_week": 7}
+# Rolling mean features and their window in days
+ROLLING_WINDOWS = {"peak_volume_rolling_7_day_mean": 7, "peak_volume_rolling_28_day_mean": 28}
+
 def create_max_volume_column(traffic_df: pd.DataFrame) -> pd.DataFrame:
     """
     Create the max_volume_column for the traffic dataframe which keep tracks of the total
@@ -39,26 +56,103 @@ def create_peak_hour_traffic_volume_column(df: pd.DataFrame, rush_hour_type: str
     """
     Create a column called peak_hour_traffic_volume that consolidates the hours that comprises a peak hour
 
+    With rush_hour_type both, the am and pm targets are created as the columns of
+    RUSH_HOUR_TARGET_COLUMNS instead. The am peak hours are counted before the pm rush hour
+    so they are kept as features of the pm target
+
     Args:
         df (pd.DataFrame): Dataframe to create the new column
-        rush_hour_type (str): Whether to predict am or pm rush hour (Only am or pm)
+        rush_hour_type (str): Whether to predict am or pm rush hour or both (Only am, pm or both)
 
     Returns:
         pd.DataFrame: Modified dataframe with the new peak_hour_traffic_volume column
     """
-    if rush_hour_type == "pm":
-        peak_hour_columns = [
-            "traffic_volume_counted_after_1500_to_1600", "traffic_volume_counted_after_1600_to_1700",
-            "traffic_volume_counted_after_1700_to_1800", "traffic_volume_counted_after_1800_to_1900"
-            ]
-        
-    elif rush_hour_type == "am":
-        peak_hour_columns = [
-            "traffic_volume_counted_after_0600_to_0700", "traffic_volume_counted_after_0700_to_0800",
-            "traffic_volume_counted_after_0800_to_0900", "traffic_volume_counted_after_0900_to_1000"
-        ]
-        
+    if rush_hour_type == "both":
+        df[RUSH_HOUR_TARGET_COLUMNS["am"]] = df[PEAK_HOUR_COLUMNS["am"]].sum(axis=1)
+        df[RUSH_HOUR_TARGET_COLUMNS["pm"]] = df[PEAK_HOUR_COLUMNS["pm"]].sum(axis=1)
+        df.drop(PEAK_HOUR_COLUMNS["pm"], inplace=True, axis=1)
+
+        return df
+
+    peak_hour_columns = PEAK_HOUR_COLUMNS[rush_hour_type]
     df["peak_hour_traffic_volume"] = df[peak_hour_columns].sum(axis=1)
     df.drop(peak_hour_columns, inplace=True, axis=1)
 
     return df
+
+def create_station_column(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Create a station column labelling every row with its state and station id, station ids
+    are only unique within a state. It is used to break the scores down by station and is
+    never a feature
+
+    Args:
+        df (pd.DataFrame): Combined DataFrame of traffic and station data
+
+    Returns:
+        pd.DataFrame: DataFrame with the newly created station column
+    """
+    state_column = "fips_state_code" if "fips_state_code" in df.columns else "fips_state_code_x"
+    df["station"] = df[state_column].astype(str) + "_" + df["station_id"].astype(str)
+
+    return df
+
+def create_lag_features(df: pd.DataFrame, target_column: str = "peak_hour_traffic_volume",
+                        prefix: str = "") -> pd.DataFrame:
+    """
+    Create the peak hour volume of the previous day and of the same weekday last week, and the
+    mean peak hour volume over the last 7 and 28 days, of every station, direction and lane.
+
+    The rows are laid out on a dense series x day grid with bincount, which orders them by
+    station and date in one O(n) pass. The lags are gathered from shifted positions of the
+    grid and the rolling means are differences of its cumulative sums along the days. Only
+    days strictly before the row's day are used, so no row sees its own or a later target and
+    the train months of train_val_test_split never see the val or test months. Lags of days
+    without a count are 0
+
+    Args:
+        df (pd.DataFrame): Combined DataFrame with the target, date and station columns
+        target_column (str): Column the lags and rolling means are computed from
+        prefix (str): Prefix of the created columns
+
+    Returns:
+        pd.DataFrame: DataFrame with the lag and rolling window columns
+    """
+    if len(df) == 0:
+        return df.assign(**{f"{prefix}{column}": 0.0 for column in [*LAG_DAYS, *ROLLING_WINDOWS]})
+
+    series = df.groupby(LAG_SERIES_COLUMNS, sort=False, observed=True).ngroup().to_numpy()
+    # Only the distinct dates are parsed
+    date_codes, distinct_dates = pd.factorize(df["date"])
+    distinct_dates = pd.to_datetime(np.asarray(distinct_dates))
+    days = ((distinct_dates - distinct_dates.min()).days.to_numpy())[date_codes]
+    num_series, num_days = series.max() + 1, days.max() + 1
+    # Rows with a missing series column have no history
+    valid = series >= 0
+    cells = series * num_days + days
+
+    # Daily target of every series, the mean if a day has several rows
+    day_totals = np.bincount(cells[valid], weights=df[target_column].to_numpy(dtype=np.float64)[valid],
+                             minlength=num_series * num_days)
+    day_counts = np.bincount(cells[valid], minlength=num_series * num_days)
+    day_values = np.divide(day_totals, day_counts, out=np.zeros_like(day_totals), where=day_counts > 0)
+
+    for column, lag in LAG_DAYS.items():
+        lagged = valid & (days >= lag)
+        df[f"{prefix}{column}"] = np.where(lagged, day_values[np.where(lagged, cells - lag, 0)], 0.0)
+
+    # Cumulative sums over the days before every day, with a leading 0 per series
+    observed = (day_counts > 0).reshape(num_series, num_days)
+    value_sums = np.zeros((num_series, num_days + 1))
+    value_sums[:, 1:] = np.cumsum(day_values.reshape(num_series, num_days), axis=1)
+    day_sums = np.zeros((num_series, num_days + 1), dtype=np.int64)
+    day_sums[:, 1:] = np.cumsum(observed, axis=1)
+
+    end = np.where(valid, series * (num_days + 1) + days, 0)
+    for column, window in ROLLING_WINDOWS.items():
+        start = np.where(valid, end - np.minimum(days, window), 0)
+        window_days = day_sums.ravel()[end] - day_sums.ravel()[start]
+        window_total = value_sums.ravel()[end] - value_sums.ravel()[start]
+        df[f"{prefix}{column}"] = np.where(valid & (window_days > 0), window_total / np.maximum(window_days, 1), 0.0)
+
+    return df
@@ -0,0 +1,309 @@
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.data_pipeline.cache import cache_key, has_entry, load_arrays, load_objects, save_arrays
+from src.data_pipeline.encoding import encode_categorical
+from src.data_pipeline.preprocess_data import (drop_na_columns, engineer_features, load_data, period_of,
+                                               plan_columns, remove_redundant_column)
+from src.data_pipeline.preprocessor import GROUP_COLUMNS, Preprocessor, TARGET_COLUMN, group_labels
+from src.data_pipeline.utils import assign_rolling_splits
+from src.instrumentation import run_stage
+
+logger = logging.getLogger("Incremental Pipeline")
+
+STATE_ENTRY_NAME = "state"
+
+def update_pipeline(traffic_data_path: Path, station_data_path: Path,
+                    pipeline_conf: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Preprocessor]]:
+    """
+    Process only the months of traffic data that are not in the processed store yet and
+    append them to it, then assemble the rolling train, val and test matrices.
+
+    Every month is stored on its own with its engineered features, its unscaled numerical
+    columns, one hot encoded columns and target. The first run applies the data dependent
+    column drops and fits the preprocessor on the train months, later runs reuse it and only
+    update the scaler statistics with the months that rolled into the train set. When the
+    stored months change the columns the drops keep, or a month rolling into the train set
+    holds categories the encoder does not know, the drops and the preprocessor are fitted
+    again on every stored month with incremental_refit set, which gives the features of a
+    full run over the same months. Without it they stay as fitted and a warning is logged. A
+    month is processed once, so it should only be added when it is complete
+
+    Args:
+        traffic_data_path (Path): Filepath to the raw traffic data, may hold only the new months
+        station_data_path (Path): Filepath to the raw station data
+        pipeline_conf (Dict[str, Any]): Pipeline parameters, see conf/pipeline.yaml
+
+    Returns:
+        Tuple[Dict[str, Any], Dict[str, Preprocessor]]: Features, targets, the period and
+            group labels of every row keyed as {split}_X, {split}_y, {split}_month and
+            {split}_{group column}, and the preprocessor keyed as preprocessor
+    """
+    if not isinstance(pipeline_conf["state_code"], int):
+        raise ValueError("Incremental updates only support a single state code")
+    if pipeline_conf["rush_hour_type"] == "both":
+        raise ValueError("Incremental updates build a single rush hour, set rush_hour_type to am or pm")
+    if pipeline_conf["lag_features"]:
+        raise ValueError("Incremental updates do not support lag features as the months already in "
+                         "the store are not read again")
+
+    store_dir = store_path(pipeline_conf)
+    preprocessor, store = load_store(store_dir)
+    logger.info(f"Processed store holds {len(store['periods'])} months")
+
+    traffic_df, station_df = run_stage("load", load_data, traffic_data_path, station_data_path,
+                                       state_code=pipeline_conf["state_code"],
+                                       usecols=plan_columns(pipeline_conf["rush_hour_type"],
+                                                            pipeline_conf["columns_to_drop"]),
+                                       skip_periods=store["periods"], csv_engine=pipeline_conf["csv_engine"],
+                                       dataset_dir=pipeline_conf["dataset_dir"])
+
+    new_periods = []
+    if len(traffic_df) > 0:
+        traffic_df["period"] = period_of(traffic_df)
+        combined_df = engineer_features(traffic_df, station_df, pipeline_conf["rush_hour_type"],
+                                        pipeline_conf["columns_to_drop"])
+        periods = combined_df.pop("period").to_numpy()
+        new_periods = sorted(int(period) for period in np.unique(periods))
+        logger.info(f"Processing new months: {new_periods}")
+
+        # The engineered features are kept so that the store can be fitted again later
+        for period in new_periods:
+            save_arrays(store_dir / f"frame_{period}", {}, {"frame": combined_df[periods == period]})
+        update_column_stats(store["column_stats"], combined_df)
+        store["periods"] = sorted(store["periods"] + new_periods)
+    else:
+        logger.info("No new months to process")
+
+    if not store["periods"]:
+        raise ValueError(f"No traffic data found in {traffic_data_path} for the processed store")
+
+    split_ratios = pipeline_conf["split_ratios"]
+    split_periods = assign_rolling_splits(store["periods"], split_ratios["val"], split_ratios["test"])
+    reasons = refit_reasons(store_dir, store, preprocessor, split_periods["train"])
+
+    if preprocessor is None or (reasons and pipeline_conf["incremental_refit"]):
+        for reason in reasons:
+            logger.info(f"{reason}, fitting the preprocessor again on every stored month")
+        preprocessor = run_stage("refit", refit_store, store_dir, store, split_periods["train"])
+    else:
+        for reason in reasons:
+            logger.warning(f"{reason}, they are ignored as the preprocessor stays as fitted. Set "
+                           f"incremental_refit to fit it again on every stored month")
+
+        if new_periods:
+            combined_df = run_stage("encode_categorical", encode_categorical, combined_df)
+            for period in new_periods:
+                encode_period(store_dir, period, combined_df[periods == period], preprocessor)
+
+        for period in split_periods["train"]:
+            if period not in store["scaled_periods"]:
+                logger.info(f"Adding month {period} to the scaler statistics")
+                preprocessor.partial_fit(load_arrays(store_dir / f"period_{period}")["numeric"])
+                store["scaled_periods"].append(period)
+
+    save_arrays(store_dir / STATE_ENTRY_NAME, {}, {"preprocessor": preprocessor, "store": store})
+    logger.info(f"Rolling split: {split_periods}")
+
+    arrays = {}
+    for split, split_period_list in split_periods.items():
+        arrays[f"{split}_X"], arrays[f"{split}_y"], arrays[f"{split}_month"], split_groups = run_stage(
+            "stack", stack_periods, store_dir, split_period_list, preprocessor)
+        arrays.update({f"{split}_{column}": labels for column, labels in split_groups.items()})
+
+    return arrays, {"preprocessor": preprocessor}
+
+def store_path(pipeline_conf: Dict[str, Any]) -> Path:
+    """
+    Return the folder of the processed store, keyed on the pipeline parameters and code
+    version but not on the raw files as those grow every month
+
+    Args:
+        pipeline_conf (Dict[str, Any]): Pipeline parameters, see conf/pipeline.yaml
+
+    Returns:
+        Path: Folder of the processed store
+    """
+    cache_dir = Path(pipeline_conf["cache_dir"])
+    params = {key: pipeline_conf[key] for key in ["state_code", "rush_hour_type", "split_ratios",
+                                                  "columns_to_drop"]}
+
+    return cache_dir / f"incremental_{cache_key([], params, cache_dir)}"
+
+def load_store(store_dir: Path) -> Tuple[Preprocessor, Dict[str, Any]]:
+    """
+    Load the preprocessor and the state of the store
+
+    Args:
+        store_dir (Path): Folder of the processed store
+
+    Returns:
+        Tuple[Preprocessor, Dict[str, Any]]: Preprocessor, None for an empty store, and the
+            processed and scaled months, the columns kept by the column drops of the last fit
+            and the column statistics of the store keyed as periods, scaled_periods, columns
+            and column_stats
+    """
+    if not has_entry(store_dir / STATE_ENTRY_NAME):
+        return None, {"periods": [], "scaled_periods": [], "columns": [],
+                      "column_stats": {"rows": 0, "distinct": {}, "non_null": {}}}
+
+    objects = load_objects(store_dir / STATE_ENTRY_NAME)
+
+    return objects["preprocessor"], objects["store"]
+
+def update_column_stats(column_stats: Dict[str, Any], df: pd.DataFrame):
+    """
+    Add the rows of new months to the statistics the data dependent column drops are decided
+    on: the number of rows, up to two distinct values and the number of non missing values of
+    every column
+
+    Args:
+        column_stats (Dict[str, Any]): Column statistics of the store, updated in place
+        df (pd.DataFrame): Engineered features of the new months
+    """
+    column_stats["rows"] += len(df)
+    for column in df.columns:
+        # Missing values count as one value, as in remove_redundant_column
+        values = [None if pd.isna(value) else value for value in df[column].unique()]
+        distinct = column_stats["distinct"].get(column, []) + values
+        column_stats["distinct"][column] = list(dict.fromkeys(distinct))[:2]
+        column_stats["non_null"][column] = column_stats["non_null"].get(column, 0) + int(df[column].notna().sum())
+
+def kept_columns(column_stats: Dict[str, Any], threshold: float = 0.5) -> List[str]:
+    """
+    Return the columns that remove_redundant_column and drop_na_columns keep on every month of
+    the store, from its column statistics
+
+    Args:
+        column_stats (Dict[str, Any]): Column statistics of the store
+        threshold (float): Share of missing values before a column is dropped, as in drop_na_columns
+
+    Returns:
+        List[str]: Kept columns
+    """
+    return [column for column, distinct in column_stats["distinct"].items()
+            if len(distinct) > 1 and column_stats["non_null"][column] >= column_stats["rows"] * threshold]
+
+def refit_reasons(store_dir: Path, store: Dict[str, Any], preprocessor: Preprocessor,
+                  train_periods: List[int]) -> List[str]:
+    """
+    Compare the fitted preprocessor with the months of the store: the columns kept by the data
+    dependent column drops and the categories of the months rolling into the train set
+
+    Args:
+        store_dir (Path): Folder of the processed store
+        store (Dict[str, Any]): State of the store
+        preprocessor (Preprocessor): Fitted preprocessor, None for an empty store
+        train_periods (List[int]): Months of the train set
+
+    Returns:
+        List[str]: Every way the preprocessor differs from one fitted on the stored months,
+            empty when it does not
+    """
+    if preprocessor is None:
+        return []
+
+    reasons = []
+    columns = kept_columns(store["column_stats"])
+    if set(columns) != set(store["columns"]):
+        reasons.append(f"The column drops of the stored months keep {sorted(set(columns) - set(store['columns']))} "
+                       f"and drop {sorted(set(store['columns']) - set(columns))} compared to the last fit")
+
+    for period in train_periods:
+        if period in store["scaled_periods"]:
+            continue
+        frame = load_objects(store_dir / f"frame_{period}")["frame"]
+        for column, categories in zip(preprocessor.cat_columns, preprocessor.encoder.categories_):
+            unseen = frame[column].notna() & ~frame[column].isin(categories)
+            if unseen.any():
+                reasons.append(f"Month {period} has {int(unseen.sum())} rows with {column} categories "
+                               f"unknown to the encoder: {sorted(frame.loc[unseen, column].astype(str).unique())}")
+
+    return reasons
+
+def refit_store(store_dir: Path, store: Dict[str, Any], train_periods: List[int]) -> Preprocessor:
+    """
+    Apply the data dependent column drops to every stored month and fit the preprocessor on
+    the train months, then encode every stored month again. This fixes the feature columns of
+    the store
+
+    Args:
+        store_dir (Path): Folder of the processed store
+        store (Dict[str, Any]): State of the store, its columns and scaled months are updated
+        train_periods (List[int]): Months of the train set
+
+    Returns:
+        Preprocessor: The fitted preprocessor
+    """
+    if not train_periods:
+        raise ValueError("The incremental store needs more months than the val and test sets hold")
+
+    frames = [load_objects(store_dir / f"frame_{period}")["frame"] for period in store["periods"]]
+    periods = np.concatenate([np.full(len(frame), period, dtype=np.int64)
+                              for period, frame in zip(store["periods"], frames)])
+    combined_df = pd.concat(frames, ignore_index=True)
+
+    combined_df = run_stage("remove_redundant_column", remove_redundant_column, combined_df)
+    combined_df = run_stage("drop_na_columns", drop_na_columns, combined_df)
+    combined_df = run_stage("encode_categorical", encode_categorical, combined_df)
+
+    preprocessor = run_stage("encode_fit", Preprocessor().fit, combined_df[np.isin(periods, train_periods)])
+    for period in store["periods"]:
+        encode_period(store_dir, period, combined_df[periods == period], preprocessor)
+
+    store["columns"] = combined_df.columns.tolist()
+    store["scaled_periods"] = list(train_periods)
+
+    return preprocessor
+
+def encode_period(store_dir: Path, period: int, period_df: pd.DataFrame, preprocessor: Preprocessor):
+    """
+    Encode the rows of one month and store its unscaled numerical columns, one hot encoded
+    columns, target and group labels
+
+    Args:
+        store_dir (Path): Folder of the processed store
+        period (int): Month of the rows
+        period_df (pd.DataFrame): Encoded DataFrame of the month
+        preprocessor (Preprocessor): Fitted preprocessor
+    """
+    numeric, encoded = run_stage("encode_transform", preprocessor.encode, period_df)
+    save_arrays(store_dir / f"period_{period}",
+                {"numeric": numeric, "encoded": encoded, "y": period_df[TARGET_COLUMN].to_numpy(),
+                 **group_labels(period_df)})
+
+def stack_periods(store_dir: Path, periods: List[int],
+                  preprocessor: Preprocessor) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray,
+                                                       Dict[str, np.ndarray]]:
+    """
+    Scale and stack the stored months of one split
+
+    Args:
+        store_dir (Path): Folder of the processed store
+        periods (List[int]): Months of the split
+        preprocessor (Preprocessor): Preprocessor with the current scaler statistics
+
+    Returns:
+        Tuple[sparse.csr_matrix, np.ndarray, np.ndarray, Dict[str, np.ndarray]]: Features,
+            target, period and the group labels of every row of the split
+    """
+    period_arrays = [load_arrays(store_dir / f"period_{period}") for period in periods]
+    if not period_arrays:
+        num_features = len(preprocessor.feature_names)
+        return sparse.csr_matrix((0, num_features)), np.zeros(0), np.zeros(0, dtype=np.int64), {}
+
+    numeric = np.concatenate([arrays["numeric"] for arrays in period_arrays])
+    encoded = sparse.vstack([arrays["encoded"] for arrays in period_arrays], format="csr")
+    target = np.concatenate([arrays["y"] for arrays in period_arrays])
+    row_periods = np.concatenate([np.full(len(arrays["y"]), period, dtype=np.int64)
+                                  for period, arrays in zip(periods, period_arrays)])
+
+    groups = {column: np.concatenate([arrays[column] for arrays in period_arrays]) for column in GROUP_COLUMNS
+              if all(column in arrays for arrays in period_arrays)}
+
+    return preprocessor.stack(numeric, encoded), target, row_periods, groups
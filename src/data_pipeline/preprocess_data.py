@@ -1,91 +1,410 @@
 import pandas as pd
-from src.data_pipeline.feature_engineering import *
+from src.data_pipeline.csv_reader import empty_frame, read_csv, read_csv_chunks
+from src.data_pipeline.dataset import ingested_years, read_partitions
+from src.data_pipeline.feature_engineering import (create_lag_features, create_peak_hour_traffic_volume_column,
+                                                   create_station_column, create_years_of_operation_column)
+from src.data_pipeline.schema import (MERGE_KEYS, RUSH_HOUR_TARGET_COLUMNS, RUSH_HOURS, STATION_COLUMN_TYPES,
+                                      STATION_COLUMNS, TRAFFIC_COLUMN_TYPES, TRAFFIC_COLUMNS,
+                                      TRAFFIC_VOLUME_COLUMNS)
+from src.data_pipeline.station_store import STATION_STORE_DIR, STORE_KEYS, StationStore
+from src.instrumentation import run_stage
 
 from dateutil.relativedelta import relativedelta
+import logging
 from pathlib import Path
-from typing import Tuple, List
+from typing import Dict, Tuple, List, Union
 
 RAW_STATION_DATA_PATH = Path("data/raw/dot_traffic_stations_2015.txt.gz")
 RAW_TRAFFIC_DATA_PATH = Path("data/raw/dot_traffic_2015.txt.gz")
 STATE_CODE = 36
-
-def preprocess_data(traffic_data_path: Path, station_data_path: Path) -> pd.DataFrame:
+CHUNK_SIZE = 500_000
+
+TRAFFIC_COLUMNS_TO_DROP = ["restrictions"]
+STATION_COLUMNS_TO_DROP = ["algorithm_of_vehicle_classification_name", "calibration_of_weighing_system_name",
+                           "direction_of_travel", "functional_classification", "lane_of_travel_name",
+                           "method_of_data_retrieval_name", "method_of_traffic_volume_counting_name",
+                           "method_of_truck_weighing", "method_of_vehicle_classification_name",
+                           "sample_type_for_traffic_volume", "sample_type_for_truck_weight_name",
+                           "sample_type_for_vehicle_classification_name", "type_of_sensor"]
+COLUMNS_TO_DROP = ["year_station_established", "station_location",
+                   "previous_station_id", "latitude", "longitude",
+                   "method_of_truck_weighing_name", "fips_county_code",
+                   "direction_of_travel", "station_id", "hpms_sample_identifier",
+                   "algorithm_of_vehicle_classification", "functional_classification_name"]
+# Columns used by the merge and feature engineering even when they are dropped afterwards
+REQUIRED_COLUMNS = [*MERGE_KEYS, "fips_state_code", "year_station_established"]
+# String columns that stay object, the column cleaned by string replacement
+OBJECT_COLUMNS = ["sample_type_for_vehicle_classification"]
+
+logger = logging.getLogger("Preprocess Data")
+
+def preprocess_data(traffic_data_path: Path, station_data_path: Path, state_code: int = STATE_CODE,
+                    rush_hour_type: str = "pm", columns_to_drop: List[str] = COLUMNS_TO_DROP,
+                    lag_features: bool = False, csv_engine: str = "pandas",
+                    dataset_dir: Path = None) -> pd.DataFrame:
     """
     Preprocess the data to be used for encoding, first step of the data pipeline
 
     Args:
         traffic_data_path (Path): Filepath to the traffic csv
         station_data_path (Path): Filepath to the station csv
+        state_code (int): State code of the state to predict the traffic volume
+        rush_hour_type (str): Whether to predict am or pm rush hour or both (Only am, pm or both)
+        columns_to_drop (List[str]): Columns to drop before encoding features
+        lag_features (bool): Whether to create the per station lag and rolling window features
+        csv_engine (str): Engine the raw files are parsed with, pandas or arrow
+        dataset_dir (Path): Folder of the partitioned dataset the raw files were ingested into,
+            see src/data_pipeline/dataset.py
 
     Returns:
         pd.DataFrame:
     """
-    traffic_df, station_df = load_data(traffic_data_path, station_data_path)
+    # Only the planned columns are parsed and other states are dropped chunk by chunk while reading
+    traffic_df, station_df = run_stage("load", load_data, traffic_data_path, station_data_path,
+                                       state_code=state_code, usecols=plan_columns(rush_hour_type, columns_to_drop),
+                                       csv_engine=csv_engine, dataset_dir=dataset_dir)
+    combined_df = preprocess_state(traffic_df, station_df, rush_hour_type, columns_to_drop, lag_features)
+
+    combined_df.to_csv("data/interim/cleaned_data.csv", index=False)
+
+    return combined_df
+
+def preprocess_state(traffic_df: pd.DataFrame, station_df: pd.DataFrame, rush_hour_type: str = "pm",
+                     columns_to_drop: List[str] = COLUMNS_TO_DROP, lag_features: bool = False) -> pd.DataFrame:
+    """
+    Clean, merge and feature engineer the traffic and station data of a single state
 
-    traffic_df, station_df = drop_remapped_column(traffic_df, station_df)
-    traffic_df, station_df = filter_by_state_code(traffic_df, station_df, state_code=STATE_CODE)
-    station_df = clean_sample_type_for_vehicle_classification_column(station_df)
+    Args:
+        traffic_df (pd.DataFrame): Traffic data of the state, remapped columns already dropped
+        station_df (pd.DataFrame): Station data of the state, remapped columns already dropped
+        rush_hour_type (str): Whether to predict am or pm rush hour or both (Only am, pm or both)
+        columns_to_drop (List[str]): Columns to drop before encoding features
+        lag_features (bool): Whether to create the per station lag and rolling window features
+
+    Returns:
+        pd.DataFrame: Combined DataFrame ready for encoding
+    """
+    combined_df = engineer_features(traffic_df, station_df, rush_hour_type, columns_to_drop, lag_features)
+
+    # Data dependent column drops
+    combined_df = run_stage("remove_redundant_column", remove_redundant_column, combined_df)
+    combined_df = run_stage("drop_na_columns", drop_na_columns, combined_df)
+
+    return combined_df
+
+def engineer_features(traffic_df: pd.DataFrame, station_df: pd.DataFrame, rush_hour_type: str = "pm",
+                      columns_to_drop: List[str] = COLUMNS_TO_DROP, lag_features: bool = False) -> pd.DataFrame:
+    """
+    Clean, merge and feature engineer the traffic and station data, only the row-wise steps
+    and fixed column drops that do not depend on the rest of the data are applied
+
+    Args:
+        traffic_df (pd.DataFrame): Traffic data, remapped columns already dropped
+        station_df (pd.DataFrame): Station data, remapped columns already dropped
+        rush_hour_type (str): Whether to predict am or pm rush hour or both (Only am, pm or both)
+        columns_to_drop (List[str]): Columns to drop before encoding features
+        lag_features (bool): Whether to create the per station lag and rolling window features
+
+    Returns:
+        pd.DataFrame: Combined DataFrame with the engineered features
+    """
+    station_df = run_stage("clean_sample_type", clean_sample_type_for_vehicle_classification_column, station_df)
 
     # Combine dataframe
-    combined_df = combine_data(traffic_df, station_df)
+    combined_df = run_stage("merge", combine_data, traffic_df, station_df)
 
     # Feature engineering
-    combined_df = convert_established_year_to_actual_year(combined_df)
-    combined_df = create_years_of_operation_column(combined_df)
-    combined_df = create_peak_hour_traffic_volume_column(combined_df, rush_hour_type="pm")
+    combined_df = run_stage("convert_established_year", convert_established_year_to_actual_year, combined_df)
+    combined_df = run_stage("create_years_of_operation", create_years_of_operation_column, combined_df)
+    combined_df = run_stage("create_peak_hour_traffic_volume", create_peak_hour_traffic_volume_column,
+                            combined_df, rush_hour_type=rush_hour_type)
+
+    combined_df = run_stage("create_station", create_station_column, combined_df)
+    if lag_features and rush_hour_type == "both":
+        for target_type, target_column in RUSH_HOUR_TARGET_COLUMNS.items():
+            combined_df = run_stage("create_lag_features", create_lag_features, combined_df,
+                                    target_column, prefix=f"{target_type}_")
+    elif lag_features:
+        combined_df = run_stage("create_lag_features", create_lag_features, combined_df)
 
     # Final column drop before encoding features
-    combined_df = remove_redundant_column(combined_df)
-    combined_df = drop_future_volume_information(combined_df, "pm")
+    combined_df = run_stage("drop_future_volume_information", drop_future_volume_information,
+                            combined_df, rush_hour_type)
+    combined_df = run_stage("drop_columns", drop_columns, columns_to_drop, combined_df)
 
-    columns_to_drop = ["year_station_established", "station_location",
-                       "previous_station_id", "latitude", "longitude",
-                       "method_of_truck_weighing_name", "fips_county_code",
-                       "direction_of_travel", "station_id", "hpms_sample_identifier",
-                       "algorithm_of_vehicle_classification", "functional_classification_name"]
+    return combined_df
+
+def prepare_inference_data(traffic_df: pd.DataFrame, station_df: pd.DataFrame = None,
+                           station_store: StationStore = None) -> pd.DataFrame:
+    """
+    Apply the row-wise cleaning, merge and feature engineering steps to raw traffic and station
+    records for inference. The data dependent column drops are skipped as the fitted
+    preprocessor only picks the columns it was fitted on
 
-    combined_df = drop_columns(columns_to_drop, combined_df)
-    combined_df = drop_na_columns(combined_df)
+    Traffic records are joined with the station records sent along with them first, the ones
+    without a matching station record are looked up in the prebuilt station store
 
-    combined_df.to_csv("data/interim/cleaned_data.csv", index=False)
+    Args:
+        traffic_df (pd.DataFrame): Raw traffic records
+        station_df (pd.DataFrame): Raw station records
+        station_store (StationStore): Prebuilt store of cleaned station records, see
+            build_station_store
+
+    Returns:
+        pd.DataFrame: Combined DataFrame ready for the fitted preprocessor
+    """
+    traffic_df = traffic_df.drop(TRAFFIC_COLUMNS_TO_DROP, axis=1, errors="ignore")
+
+    stores = []
+    if station_df is not None and len(station_df) > 0:
+        station_df = station_df.drop(STATION_COLUMNS_TO_DROP, axis=1, errors="ignore")
+        stores.append(StationStore(clean_sample_type_for_vehicle_classification_column(station_df)))
+    if station_store is not None:
+        stores.append(station_store)
+    if not stores:
+        raise ValueError("Traffic records need station records or a station store to be joined with")
+
+    combined_dfs = []
+    for store in stores:
+        combined_dfs.append(combine_data(traffic_df, store))
+        traffic_df = traffic_df[~store.contains(traffic_df)]
+
+    combined_df = pd.concat(combined_dfs, ignore_index=True) if len(combined_dfs) > 1 else combined_dfs[0]
+    combined_df = convert_established_year_to_actual_year(combined_df)
+    combined_df = create_years_of_operation_column(combined_df)
 
     return combined_df
 
-def load_data(traffic_data_path: Path, station_data_path: Path) -> Tuple[pd.DataFrame]:
+def load_data(traffic_data_path: Path, station_data_path: Path,
+              state_code: Union[int, List[int], str] = None, chunksize: int = CHUNK_SIZE,
+              usecols: Tuple[List[str]] = None, skip_periods: List[int] = None,
+              csv_engine: str = "pandas", dataset_dir: Path = None) -> Tuple[pd.DataFrame]:
     """
     Load the data from the traffic and station data path and return them as dataframe
-    for further data cleaning
+    for further data cleaning.
+
+    When a state code is given, the raw files are streamed in chunks, only the columns in
+    usecols are parsed and the rows of other states are dropped per chunk, so peak memory
+    scales with the size of the kept states instead of the whole country. The kept rows are
+    stored with compact dtypes (see compact_dtypes). Every column is parsed as its type in
+    the schema, with either csv engine (see src/data_pipeline/csv_reader.py).
+
+    When the raw files were ingested into the partitioned dataset in dataset_dir, only the
+    partitions of the state codes and the columns in usecols are read from it instead, giving
+    the same DataFrames.
 
     Args:
         traffic_data_path (Path): File path to the raw traffic data
         station_data_path (Path): File path to the raw station data
+        state_code (Union[int, List[int], str]): State code or list of state codes to keep,
+            "all" keeps every state. Reads the full files without dropping any column if None
+        chunksize (int): Number of rows parsed per chunk when filtering by state code
+        usecols (Tuple[List[str]]): Columns to parse of the (traffic, station) files, see
+            plan_columns. Defaults to every column except the remapped ones
+        skip_periods (List[int]): Periods (see period_of) of the traffic rows to drop per chunk,
+            used by incremental updates to read only the newly arrived months
+        csv_engine (str): Engine the raw files are parsed with, pandas or arrow, arrow parses
+            on every core and falls back to pandas when pyarrow is not installed
+        dataset_dir (Path): Folder of the partitioned dataset, the csv files are parsed when
+            None or when the dataset does not hold the current content of both raw files
 
     Returns:
         Tuple (DataFrame): Tuple containing (traffic_df, station_df)
     """
-    traffic_df = pd.read_csv(traffic_data_path, compression="gzip")
-    station_df = pd.read_csv(station_data_path, compression="gzip")
+    if state_code is None:
+        traffic_df = read_csv(traffic_data_path, TRAFFIC_COLUMN_TYPES, engine=csv_engine)
+        station_df = read_csv(station_data_path, STATION_COLUMN_TYPES, engine=csv_engine)
+
+        return (traffic_df, station_df)
+
+    traffic_columns, station_columns = usecols or plan_columns()
+    if dataset_dir is not None:
+        traffic_years = ingested_years(dataset_dir, "traffic", traffic_data_path)
+        station_years = ingested_years(dataset_dir, "stations", station_data_path)
+        if traffic_years is not None and station_years is not None:
+            traffic_df = read_partitions(dataset_dir, "traffic", traffic_years, traffic_columns, state_code, skip_periods)
+            station_df = read_partitions(dataset_dir, "stations", station_years, station_columns, state_code)
+
+            return (compact_dtypes(traffic_df), compact_dtypes(station_df))
+
+        logger.warning(f"{dataset_dir} does not hold the raw files, run python -m src ingest. Parsing them")
+
+    traffic_df = read_state_filtered_csv(traffic_data_path, state_code, traffic_columns, chunksize, skip_periods,
+                                         column_types=TRAFFIC_COLUMN_TYPES, csv_engine=csv_engine)
+    station_df = read_state_filtered_csv(station_data_path, state_code, station_columns, chunksize,
+                                         column_types=STATION_COLUMN_TYPES, csv_engine=csv_engine)
 
     return (traffic_df, station_df)
 
-def combine_data(traffic_df: pd.DataFrame, station_df: pd.DataFrame) -> pd.DataFrame:
+def plan_columns(rush_hour_type: str = None, columns_to_drop: List[str] = None) -> Tuple[List[str]]:
+    """
+    Work out the columns of the raw traffic and station files that survive the column drops
+    of the pipeline, so that the others are never parsed. The remapped columns, the columns
+    in columns_to_drop and the future volume columns of the rush hour are skipped, unless
+    they are needed for the merge or feature engineering or are in both files, as those get
+    suffixed by the merge instead of dropped. The data dependent drops of
+    remove_redundant_column and drop_na_columns still run on the combined data
+
+    Args:
+        rush_hour_type (str): Whether to predict am or pm rush hour or both (Only am, pm or both), None
+            keeps every volume column
+        columns_to_drop (List[str]): Columns to drop before encoding features
+
+    Returns:
+        Tuple[List[str]]: Columns to parse of the (traffic, station) files, in file order
+    """
+    traffic_columns = [column for column in TRAFFIC_COLUMNS if column not in TRAFFIC_COLUMNS_TO_DROP]
+    station_columns = [column for column in STATION_COLUMNS if column not in STATION_COLUMNS_TO_DROP]
+    shared_columns = set(traffic_columns) & set(station_columns)
+
+    skipped_columns = set(columns_to_drop or []) | set(future_volume_columns(traffic_columns, rush_hour_type))
+    skipped_columns -= shared_columns | set(REQUIRED_COLUMNS)
+
+    return ([column for column in traffic_columns if column not in skipped_columns],
+            [column for column in station_columns if column not in skipped_columns])
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcast the hourly volume columns to the smallest integer type that holds their values
+    and store the other string columns as category, apart from OBJECT_COLUMNS. Volume
+    columns with missing values are left as they are
+
+    Args:
+        df (pd.DataFrame): Raw traffic or station data
+
+    Returns:
+        pd.DataFrame: DataFrame with compact dtypes
+    """
+    for column in df.columns:
+        if column in TRAFFIC_VOLUME_COLUMNS and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+        elif df[column].dtype == "object" and column not in OBJECT_COLUMNS:
+            df[column] = df[column].astype("category")
+
+    return df
+
+def read_state_filtered_csv(data_path: Path, state_code: Union[int, List[int], str],
+                            usecols: List[str], chunksize: int = CHUNK_SIZE,
+                            skip_periods: List[int] = None, column_types: Dict[str, str] = TRAFFIC_COLUMN_TYPES,
+                            csv_engine: str = "pandas") -> pd.DataFrame:
+    """
+    Stream a raw gzip csv in chunks, parsing only the specified columns and dropping the rows
+    that do not belong to the state codes before the chunk is kept. Only the surviving rows
+    are concatenated and compacted, the original row index is preserved.
+
+    Args:
+        data_path (Path): File path to the raw gzip csv
+        state_code (Union[int, List[int], str]): State code or list of state codes of the rows
+            to keep, "all" keeps every row
+        usecols (List[str]): Columns to parse
+        chunksize (int): Number of rows parsed per chunk
+        skip_periods (List[int]): Periods (see period_of) of the rows to drop
+        column_types (Dict[str, str]): Type of every column of the file, see schema.py
+        csv_engine (str): Engine the file is parsed with, pandas or arrow
+
+    Returns:
+        pd.DataFrame: Rows of the specified state
+    """
+    state_codes = [state_code] if isinstance(state_code, int) else state_code
+
+    filtered_chunks = []
+    for chunk in read_csv_chunks(data_path, column_types, usecols, chunksize, csv_engine):
+        if state_codes != "all":
+            chunk = run_stage("filter", filter_chunk_by_state_code, chunk, state_codes)
+        if skip_periods:
+            chunk = run_stage("filter", filter_chunk_by_period, chunk, skip_periods)
+        filtered_chunks.append(chunk)
+
+    # Empty chunks are skipped so they do not affect the concatenated dtypes, a file without
+    # rows or without rows of the states gives an empty frame with the types of the schema
+    non_empty_chunks = [chunk for chunk in filtered_chunks if len(chunk) > 0]
+    if not non_empty_chunks:
+        return compact_dtypes(empty_frame(column_types, usecols))
+
+    return compact_dtypes(pd.concat(non_empty_chunks))
+
+def filter_chunk_by_state_code(chunk: pd.DataFrame, state_codes: List[int]) -> pd.DataFrame:
     """
-    Combine the traffic and station dataframe on their common column
+    Keep the rows of a raw chunk that belong to the state codes
+
+    Args:
+        chunk (pd.DataFrame): Chunk of a raw csv
+        state_codes (List[int]): State codes of the rows to keep
+
+    Returns:
+        pd.DataFrame: Rows of the specified states
+    """
+    return chunk[chunk["fips_state_code"].isin(state_codes)]
+
+def filter_chunk_by_period(chunk: pd.DataFrame, skip_periods: List[int]) -> pd.DataFrame:
+    """
+    Drop the rows of a raw traffic chunk that belong to the skipped periods
+
+    Args:
+        chunk (pd.DataFrame): Chunk of the raw traffic csv
+        skip_periods (List[int]): Periods (see period_of) of the rows to drop
+
+    Returns:
+        pd.DataFrame: Rows of the other periods
+    """
+    return chunk[~period_of(chunk).isin(skip_periods)]
+
+def period_of(traffic_df: pd.DataFrame) -> pd.Series:
+    """
+    Return the month every raw traffic record was counted in as a yymm integer. Eg. 1503 for
+    March 2015
+
+    Args:
+        traffic_df (pd.DataFrame): Raw traffic data with year_of_data and month_of_data
+
+    Returns:
+        pd.Series: Period of every row
+    """
+    return traffic_df["year_of_data"] * 100 + traffic_df["month_of_data"]
+
+def combine_data(traffic_df: pd.DataFrame, station_df: Union[pd.DataFrame, StationStore]) -> pd.DataFrame:
+    """
+    Combine the traffic and station dataframe on their common column. The stations are
+    indexed in a StationStore and the traffic rows are joined by an array gather, giving the
+    rows of an inner merge on MERGE_KEYS in the order of the traffic rows
 
     Args:
         traffic_df (pd.DataFrame): DataFrame with traffic volume information
-        station_df (pd.DataFrame): DataFrame with station information
+        station_df (Union[pd.DataFrame, StationStore]): DataFrame with station information or
+            a store built from it
 
     Returns:
         pd.DataFrame
     """
-    combined_df = traffic_df.merge(station_df,
-                                   on=["station_id", "direction_of_travel_name",
-                                       "functional_classification_name", "lane_of_travel",
-                                       "year_of_data"])
+    station_store = station_df if isinstance(station_df, StationStore) else StationStore(station_df, MERGE_KEYS)
+    combined_df = station_store.join(traffic_df)
 
     return combined_df
 
+def build_station_store(station_data_path: Path, store_dir: Path = STATION_STORE_DIR,
+                        csv_engine: str = "pandas") -> StationStore:
+    """
+    Build the station store used to join inference traffic records with their stations from
+    the raw station file, once for every state. The stations are cleaned like in the
+    pipeline and keyed on the state code as well, as station ids are only unique within a
+    state
+
+    Args:
+        station_data_path (Path): Filepath to the raw station data
+        store_dir (Path): Folder to save the store into
+        csv_engine (str): Engine the raw file is parsed with, pandas or arrow
+
+    Returns:
+        StationStore: The saved station store
+    """
+    station_df = read_csv(station_data_path, STATION_COLUMN_TYPES, plan_columns()[1], csv_engine)
+    station_df = clean_sample_type_for_vehicle_classification_column(compact_dtypes(station_df))
+
+    station_store = StationStore(station_df, STORE_KEYS)
+    station_store.save(store_dir)
+
+    return station_store
+
 def drop_remapped_column(traffic_df: pd.DataFrame, station_df: pd.DataFrame) -> Tuple[pd.DataFrame]:
     """
     Drop remapped columns that have been identified in the Data_Cleaning.ipynb before the state code filter
@@ -98,15 +417,8 @@ def drop_remapped_column(traffic_df: pd.DataFrame, station_df: pd.DataFrame) ->
     Returns:
         Tuple (DataFrame): Tuple containing (traffic_df, station_df)
     """
-    station_columns_to_drop = ["algorithm_of_vehicle_classification_name", "calibration_of_weighing_system_name",
-                               "direction_of_travel", "functional_classification", "lane_of_travel_name",
-                               "method_of_data_retrieval_name", "method_of_traffic_volume_counting_name",
-                               "method_of_truck_weighing", "method_of_vehicle_classification_name",
-                               "sample_type_for_traffic_volume", "sample_type_for_truck_weight_name",
-                               "sample_type_for_vehicle_classification_name", "type_of_sensor"]
-
-    traffic_df.drop("restrictions", inplace=True, axis=1)
-    station_df.drop(station_columns_to_drop, axis=1, inplace=True)
+    traffic_df.drop(TRAFFIC_COLUMNS_TO_DROP, inplace=True, axis=1)
+    station_df.drop(STATION_COLUMNS_TO_DROP, axis=1, inplace=True)
 
     return (traffic_df, station_df)
 
@@ -165,7 +477,8 @@ def remove_redundant_column(df: pd.DataFrame) -> pd.DataFrame:
 
 def drop_columns(columns_to_drop: List[str], df: pd.DataFrame) -> pd.DataFrame:
     """
-    Drop columns specified in columns_to_drop list
+    Drop columns specified in columns_to_drop list, columns that were never read because of
+    plan_columns are skipped
 
     Args:
         columns_to_drop (List[str]): List of columns to drop
@@ -174,7 +487,7 @@ def drop_columns(columns_to_drop: List[str], df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: [description]
     """
-    df.drop(columns_to_drop, inplace=True, axis=1)
+    df.drop(columns_to_drop, inplace=True, axis=1, errors="ignore")
 
     return df
 
@@ -182,28 +495,66 @@ def drop_future_volume_information(df: pd.DataFrame, rush_hour_type: str) -> pd.
     """
     Drop columns that will result in data leakage if not dropped as the model will have access to future data that it otherwise
     will not have access to
-    Eg. Dropping any data after 7pm if predicting evening rush hour
+    Eg. Dropping any data after 7pm if predicting evening rush hour, or after 10am if predicting morning rush hour
 
     Args:
         df (pd.DataFrame): [description]
-        rush_hour_type (str): Only two strings is accepted: am or pm
+        rush_hour_type (str): Only three strings are accepted: am, pm or both
 
     Returns:
         pd.DataFrame: [description]
     """
-    time_column_to_drop = []
-    if rush_hour_type == "pm":
-        for column in df.columns:
-            if column.startswith("traffic_volume"):
-                hour = column.split("_")[-1]
-                if int(hour) > 1900:
-                    time_column_to_drop.append(column)
-
-    for column in time_column_to_drop:
+    for column in future_volume_columns(df.columns, rush_hour_type):
         df.drop(column, inplace=True, axis=1)
 
     return df
 
+def future_volume_columns(columns: List[str], rush_hour_type: str) -> List[str]:
+    """
+    Return the volume columns counted after the rush hour that the model must not see. Both
+    rush hours keep the columns of the pm rush hour, the am model only gets the columns
+    counted before its rush hour, see rush_hour_volume_columns
+
+    Args:
+        columns (List[str]): Columns to pick from
+        rush_hour_type (str): Only three strings are accepted: am, pm or both, None keeps
+            every column
+
+    Returns:
+        List[str]: Future volume columns
+    """
+    if rush_hour_type is None:
+        return []
+
+    return volume_columns_after(columns, RUSH_HOURS["pm" if rush_hour_type == "both" else rush_hour_type][1])
+
+def rush_hour_volume_columns(columns: List[str], rush_hour_type: str) -> List[str]:
+    """
+    Return the volume columns counted from the start of the rush hour on, which leak its target
+
+    Args:
+        columns (List[str]): Columns to pick from
+        rush_hour_type (str): Either am or pm
+
+    Returns:
+        List[str]: Volume columns counted during or after the rush hour
+    """
+    return volume_columns_after(columns, RUSH_HOURS[rush_hour_type][0])
+
+def volume_columns_after(columns: List[str], hour: int) -> List[str]:
+    """
+    Return the volume columns whose counting ends after the hour
+
+    Args:
+        columns (List[str]): Columns to pick from
+        hour (int): Hour as HHMM integer, Eg. 1900
+
+    Returns:
+        List[str]: Volume columns counted after the hour
+    """
+    return [column for column in columns
+            if column.startswith("traffic_volume") and int(column.split("_")[-1]) > hour]
+
 def drop_na_columns(df: pd.DataFrame, threshold: float=0.5) -> pd.DataFrame:
     """
     Drop columns with more than 50% missing values
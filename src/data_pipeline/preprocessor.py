@@ -0,0 +1,203 @@
+import copy
+from pathlib import Path
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+import pandas as pd
+from joblib import dump, load
+from scipy import sparse
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from src.data_pipeline.schema import RUSH_HOUR_TARGET_COLUMNS
+
+TARGET_COLUMN = "peak_hour_traffic_volume"
+# Every target column, the am and pm targets are built together when rush_hour_type is both
+TARGET_COLUMNS = [TARGET_COLUMN, *RUSH_HOUR_TARGET_COLUMNS.values()]
+# Columns the scores are broken down by, see src/scoring.py
+GROUP_COLUMNS = ["functional_classification", "station"]
+# Columns that only label the rows and are never features
+LABEL_COLUMNS = ["station"]
+
+def group_labels(df: pd.DataFrame, prefix: str = "") -> Dict[str, np.ndarray]:
+    """
+    Return the labels of the group columns that survived the preprocessing as fixed width
+    string arrays, which are saved and memory-mapped like the other arrays
+
+    Args:
+        df (pd.DataFrame): Preprocessed DataFrame
+        prefix (str): Prefix of the array names
+
+    Returns:
+        Dict[str, np.ndarray]: Label of every row keyed as {prefix}{group column}
+    """
+    return {f"{prefix}{column}": df[column].astype(str).to_numpy(dtype=str)
+            for column in GROUP_COLUMNS if column in df.columns}
+
+class Preprocessor:
+    """
+    Scale the numerical columns and one hot encode the categorical columns into a single
+    sparse CSR feature matrix. The fitted preprocessor is saved along with the model so that
+    inference reuses it without refitting
+    """
+    def __init__(self):
+        self.scaler = StandardScaler()
+        self.encoder = OneHotEncoder(handle_unknown="ignore")
+        self.num_columns = []
+        self.cat_columns = []
+
+    def fit(self, df: pd.DataFrame) -> "Preprocessor":
+        """
+        Fit the scaler and encoder, the columns are picked by dtype. Object and category
+        columns are one hot encoded
+
+        Args:
+            df (pd.DataFrame): Train set, the target and label columns are ignored
+
+        Returns:
+            Preprocessor: The fitted preprocessor
+        """
+        features_df = df.drop([*TARGET_COLUMNS, *LABEL_COLUMNS], axis=1, errors="ignore")
+        self.num_columns = features_df.select_dtypes(include=np.number).columns.tolist()
+        self.cat_columns = features_df.select_dtypes(include=["object", "category"]).columns.tolist()
+
+        self.scaler.fit(df[self.num_columns])
+        self.encoder.fit(df[self.cat_columns])
+
+        return self
+
+    def transform(self, df: pd.DataFrame) -> sparse.csr_matrix:
+        """
+        Transform the DataFrame into the sparse feature matrix, scaled columns first followed
+        by the one hot encoded columns
+
+        Args:
+            df (pd.DataFrame): DataFrame with the columns seen during fit
+
+        Returns:
+            sparse.csr_matrix: Feature matrix
+        """
+        return self.stack(*self.encode(df))
+
+    def partial_fit(self, numeric: np.ndarray) -> "Preprocessor":
+        """
+        Update the scaler statistics with more rows, the encoder keeps its fitted categories
+
+        Args:
+            numeric (np.ndarray): Unscaled numerical columns as returned by encode
+
+        Returns:
+            Preprocessor: The updated preprocessor
+        """
+        self.scaler.partial_fit(pd.DataFrame(numeric, columns=self.num_columns))
+
+        return self
+
+    def encode(self, df: pd.DataFrame) -> Tuple[np.ndarray, sparse.csr_matrix]:
+        """
+        Pick the unscaled numerical columns and one hot encode the categorical columns. Kept
+        apart so that stored rows can be rescaled after the scaler statistics change
+
+        Args:
+            df (pd.DataFrame): DataFrame with the columns seen during fit
+
+        Returns:
+            Tuple[np.ndarray, sparse.csr_matrix]: Unscaled numerical columns and one hot
+                encoded columns
+        """
+        numeric = df[self.num_columns].to_numpy(dtype=np.float64)
+        encoded = sparse.csr_matrix(self.encoder.transform(df[self.cat_columns]))
+
+        return numeric, encoded
+
+    def stack(self, numeric: np.ndarray, encoded: sparse.csr_matrix) -> sparse.csr_matrix:
+        """
+        Scale the numerical columns and stack them with the one hot encoded columns
+
+        Args:
+            numeric (np.ndarray): Unscaled numerical columns as returned by encode
+            encoded (sparse.csr_matrix): One hot encoded columns as returned by encode
+
+        Returns:
+            sparse.csr_matrix: Feature matrix
+        """
+        scaled_columns = sparse.csr_matrix(self.scaler.transform(pd.DataFrame(numeric, columns=self.num_columns)))
+
+        return sparse.hstack([scaled_columns, encoded], format="csr")
+
+    def to_spec(self) -> Dict[str, Any]:
+        """
+        Export the columns, scaler statistics and one hot categories as plain lists for the
+        model manifest, see ArrayPreprocessor
+
+        Returns:
+            Dict[str, Any]: JSON serializable description of the fitted preprocessor
+        """
+        return {
+            "num_columns": self.num_columns,
+            "cat_columns": self.cat_columns,
+            "mean": self.scaler.mean_.tolist(),
+            "scale": self.scaler.scale_.tolist(),
+            "categories": [categories.tolist() for categories in self.encoder.categories_]
+        }
+
+    def select(self, num_columns: List[str]) -> Tuple["Preprocessor", np.ndarray]:
+        """
+        Return a copy of the fitted preprocessor that only keeps some of the numerical columns,
+        along with the positions of the columns it keeps in the feature matrix. Selecting these
+        positions of a matrix built by this preprocessor gives the matrix of the copy, so
+        models on a subset of the features share the matrix instead of encoding again
+
+        Args:
+            num_columns (List[str]): Numerical columns to keep, in their fitted order
+
+        Returns:
+            Tuple[Preprocessor, np.ndarray]: The reduced preprocessor and its feature columns
+        """
+        positions = np.array([self.num_columns.index(column) for column in num_columns], dtype=np.int64)
+        preprocessor = copy.deepcopy(self)
+        preprocessor.num_columns = list(num_columns)
+
+        scaler = preprocessor.scaler
+        for attribute in ["mean_", "var_", "scale_", "feature_names_in_", "n_samples_seen_"]:
+            value = getattr(scaler, attribute, None)
+            if isinstance(value, np.ndarray) and value.ndim == 1:
+                setattr(scaler, attribute, value[positions])
+        scaler.n_features_in_ = len(positions)
+
+        num_encoded = sum(len(categories) for categories in self.encoder.categories_)
+        feature_columns = np.concatenate([positions, len(self.num_columns) + np.arange(num_encoded)])
+
+        return preprocessor, feature_columns
+
+    @property
+    def feature_names(self) -> List[str]:
+        """
+        Names of the columns of the feature matrix
+        """
+        encoded_names = [f"{column}={category}"
+                         for column, categories in zip(self.cat_columns, self.encoder.categories_)
+                         for category in categories]
+
+        return self.num_columns + encoded_names
+
+    def save(self, file_path: Path):
+        """
+        Save the fitted preprocessor
+
+        Args:
+            file_path (Path): Filepath of the joblib file
+        """
+        dump(self, file_path)
+
+    @staticmethod
+    def load(file_path: Path) -> "Preprocessor":
+        """
+        Load a fitted preprocessor
+
+        Args:
+            file_path (Path): Filepath of the joblib file
+
+        Returns:
+            Preprocessor: The fitted preprocessor
+        """
+        return load(file_path)
@@ -0,0 +1,63 @@
+HOURS = [f"{hour:02d}00" for hour in range(25)]
+TRAFFIC_VOLUME_COLUMNS = [f"traffic_volume_counted_after_{start}_to_{end}" for start, end in zip(HOURS[:-1], HOURS[1:])]
+
+# Columns of data/raw/dot_traffic_2015.txt.gz in file order
+TRAFFIC_COLUMNS = ["date", "day_of_data", "day_of_week", "direction_of_travel", "direction_of_travel_name",
+                   "fips_state_code", "functional_classification", "functional_classification_name",
+                   "lane_of_travel", "month_of_data", "record_type", "restrictions", "station_id",
+                   *TRAFFIC_VOLUME_COLUMNS, "year_of_data"]
+
+# Columns of data/raw/dot_traffic_stations_2015.txt.gz in file order
+STATION_COLUMNS = ["algorithm_of_vehicle_classification", "algorithm_of_vehicle_classification_name",
+                   "calibration_of_weighing_system", "calibration_of_weighing_system_name",
+                   "classification_system_for_vehicle_classification", "concurrent_route_signing",
+                   "concurrent_signed_route_number", "direction_of_travel", "direction_of_travel_name",
+                   "fips_county_code", "fips_state_code", "functional_classification",
+                   "functional_classification_name", "hpms_sample_identifier", "hpms_sample_type",
+                   "lane_of_travel", "lane_of_travel_name", "latitude", "longitude", "lrs_identification",
+                   "lrs_location_point", "method_of_data_retrieval", "method_of_data_retrieval_name",
+                   "method_of_traffic_volume_counting", "method_of_traffic_volume_counting_name",
+                   "method_of_truck_weighing", "method_of_truck_weighing_name",
+                   "method_of_vehicle_classification", "method_of_vehicle_classification_name",
+                   "number_of_lanes_in_direction_indicated", "number_of_lanes_monitored_for_traffic_volume",
+                   "number_of_lanes_monitored_for_truck_weight", "number_of_lanes_monitored_for_vehicle_class",
+                   "posted_route_signing", "posted_signed_route_number", "previous_station_id",
+                   "primary_purpose", "primary_purpose_name", "record_type", "sample_type_for_traffic_volume",
+                   "sample_type_for_traffic_volume_name", "sample_type_for_truck_weight",
+                   "sample_type_for_truck_weight_name", "sample_type_for_vehicle_classification",
+                   "sample_type_for_vehicle_classification_name", "shrp_site_identification", "station_id",
+                   "station_location", "type_of_sensor", "type_of_sensor_name", "year_of_data",
+                   "year_station_discontinued", "year_station_established"]
+
+# Columns the traffic and station data are merged on
+MERGE_KEYS = ["station_id", "direction_of_travel_name", "functional_classification_name",
+              "lane_of_travel", "year_of_data"]
+
+# Hours of the am and pm rush hours, the target is the volume counted between them
+RUSH_HOURS = {"am": (600, 1000), "pm": (1500, 1900)}
+# Targets of the am and pm rush hours when both are built from one pass, see rush_hour_type
+RUSH_HOUR_TARGET_COLUMNS = {"am": "peak_hour_traffic_volume_am", "pm": "peak_hour_traffic_volume_pm"}
+
+# Types of the raw columns, every column is parsed as its type instead of inferring it from
+# the values. Integer columns with missing values are read as float64 by both csv engines.
+# Codes that mix digits and letters are strings, so that they do not change type between
+# chunks, and so are station ids, which keep their leading zeros
+STRING_COLUMNS = ["date", "direction_of_travel_name", "functional_classification",
+                  "functional_classification_name", "station_id", "algorithm_of_vehicle_classification",
+                  "algorithm_of_vehicle_classification_name", "calibration_of_weighing_system",
+                  "calibration_of_weighing_system_name", "concurrent_signed_route_number", "hpms_sample_type",
+                  "lane_of_travel_name", "lrs_identification", "method_of_data_retrieval_name",
+                  "method_of_traffic_volume_counting_name", "method_of_truck_weighing_name",
+                  "method_of_vehicle_classification_name", "posted_signed_route_number", "previous_station_id",
+                  "primary_purpose", "primary_purpose_name", "sample_type_for_traffic_volume",
+                  "sample_type_for_traffic_volume_name", "sample_type_for_truck_weight",
+                  "sample_type_for_truck_weight_name", "sample_type_for_vehicle_classification",
+                  "sample_type_for_vehicle_classification_name", "shrp_site_identification", "station_location",
+                  "type_of_sensor", "type_of_sensor_name"]
+FLOAT_COLUMNS = ["restrictions", "latitude", "longitude"]
+TRAFFIC_COLUMN_TYPES = {column: "str" if column in STRING_COLUMNS else "float64" if column in FLOAT_COLUMNS
+                        else "int64" for column in TRAFFIC_COLUMNS}
+STATION_COLUMN_TYPES = {column: "str" if column in STRING_COLUMNS else "float64" if column in FLOAT_COLUMNS
+                        else "int64" for column in STATION_COLUMNS}
+# Station records have the record type S, traffic records 3
+STATION_COLUMN_TYPES["record_type"] = "str"
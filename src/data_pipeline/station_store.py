@@ -0,0 +1,206 @@
+from src.data_pipeline.cache import has_entry, load_arrays, load_objects, save_arrays
+from src.data_pipeline.schema import MERGE_KEYS
+
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+STATION_STORE_DIR = Path("data/processed/station_store")
+# Key columns of a store built from the stations of every state, station ids are only
+# unique within a state
+STORE_KEYS = [*MERGE_KEYS, "fips_state_code"]
+
+class StationStore:
+    """
+    Station attributes indexed on the merge keys packed into a single integer. Every key
+    column is mapped to the codes of its distinct station values and the codes are packed
+    side by side into a uint64, the packed keys of the stations are kept sorted so that a
+    batch of traffic records is joined with their stations by a vectorized binary search and
+    an array gather instead of a pandas hash merge
+    """
+    def __init__(self, station_df: pd.DataFrame, keys: List[str] = MERGE_KEYS):
+        """
+        Args:
+            station_df (pd.DataFrame): Station records
+            keys (List[str]): Columns the traffic records are joined on
+        """
+        self.keys = list(keys)
+        # Distinct station values of every key column, a value's position is its code
+        self.vocabularies = {key: pd.Index(pd.unique(station_df[key].to_numpy())) for key in self.keys}
+        self.offsets = pack_offsets([len(vocabulary) for vocabulary in self.vocabularies.values()])
+        self.attributes = station_df.drop(self.keys, axis=1).reset_index(drop=True)
+
+        packed_keys, _ = self.pack(station_df)
+        # Stable so that stations with the same keys stay in their original order
+        self.order = np.argsort(packed_keys, kind="stable")
+        self.sorted_keys = packed_keys[self.order]
+        # End of the run of stations with the same key, for every position of sorted_keys
+        self.run_ends = np.searchsorted(self.sorted_keys, self.sorted_keys, side="right")
+
+    def pack(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pack the key columns of every row into one integer
+
+        Args:
+            df (pd.DataFrame): Records with the key columns
+
+        Returns:
+            Tuple[np.ndarray]: Packed key of every row and whether all of its key values
+                are known to the store
+        """
+        packed_keys = np.zeros(len(df), dtype=np.uint64)
+        known = np.ones(len(df), dtype=bool)
+        for key, offset in zip(self.keys, self.offsets):
+            codes = key_codes(df[key], self.vocabularies[key])
+            known &= codes >= 0
+            packed_keys |= codes.clip(0).astype(np.uint64) << np.uint64(offset)
+
+        return packed_keys, known
+
+    def lookup(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the stations of every record, records are repeated once per matching station
+
+        Args:
+            df (pd.DataFrame): Records with the key columns
+
+        Returns:
+            Tuple[np.ndarray]: Row positions of the matched records, in record order, and of
+                their stations
+        """
+        starts, counts = self.find(df)
+        record_rows = np.repeat(np.arange(len(df)), counts)
+        offsets = np.arange(len(record_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        return record_rows, self.order[np.repeat(starts, counts) + offsets]
+
+    def find(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Binary search the packed keys of the records in the sorted station keys
+
+        Args:
+            df (pd.DataFrame): Records with the key columns
+
+        Returns:
+            Tuple[np.ndarray]: Position of the first matching station in sorted_keys and the
+                number of matching stations of every record
+        """
+        packed_keys, known = self.pack(df)
+        starts = np.searchsorted(self.sorted_keys, packed_keys)
+        in_bounds = starts < len(self.sorted_keys)
+        found = known & in_bounds
+        found[in_bounds] &= self.sorted_keys[starts[in_bounds]] == packed_keys[in_bounds]
+
+        counts = np.zeros(len(df), dtype=np.int64)
+        counts[found] = self.run_ends[starts[found]] - starts[found]
+
+        return starts, counts
+
+    def contains(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Return whether the store has a station for every record
+        """
+        return self.find(df)[1] > 0
+
+    def join(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Join the records with the attributes of their stations, giving the rows and columns
+        of an inner merge on the keys with the records kept in their own order. Columns in
+        both that are not keys get the _x and _y suffixes
+
+        Args:
+            df (pd.DataFrame): Records with the key columns
+
+        Returns:
+            pd.DataFrame: Joined records
+        """
+        record_rows, station_rows = self.lookup(df)
+        # Records that all have exactly one station are not gathered at all
+        records = df if len(record_rows) == len(df) and (record_rows == np.arange(len(df))).all() else df.iloc[record_rows]
+        attributes = self.attributes.iloc[station_rows]
+        attributes.index = records.index
+
+        shared_columns = set(records.columns) & set(attributes.columns)
+        if shared_columns:
+            records = records.rename(columns={column: f"{column}_x" for column in shared_columns}, copy=False)
+            attributes = attributes.rename(columns={column: f"{column}_y" for column in shared_columns}, copy=False)
+
+        combined_df = pd.concat([records, attributes], axis=1)
+        combined_df.index = pd.RangeIndex(len(combined_df))
+
+        return combined_df
+
+    def save(self, store_dir: Path = STATION_STORE_DIR):
+        """
+        Save the store, the sorted keys are memory-mapped when it is loaded
+
+        Args:
+            store_dir (Path): Folder of the store
+        """
+        save_arrays(store_dir, {"sorted_keys": self.sorted_keys, "order": self.order, "run_ends": self.run_ends},
+                    {"attributes": self.attributes, "index": {"keys": self.keys, "offsets": self.offsets,
+                                                              "vocabularies": self.vocabularies}})
+
+    @staticmethod
+    def load(store_dir: Path = STATION_STORE_DIR) -> "StationStore":
+        """
+        Load a saved store
+
+        Args:
+            store_dir (Path): Folder of the store
+
+        Returns:
+            StationStore: The station store
+        """
+        if not has_entry(store_dir):
+            raise FileNotFoundError(f"No station store found in {store_dir}")
+
+        objects = load_objects(store_dir)
+        store = StationStore.__new__(StationStore)
+        store.__dict__.update(load_arrays(store_dir))
+        store.__dict__.update(objects["index"])
+        store.attributes = objects["attributes"]
+
+        return store
+
+def pack_offsets(vocabulary_sizes: List[int]) -> List[int]:
+    """
+    Work out the bit offset of every key column in the packed key, every column gets the
+    bits needed for the codes of its vocabulary
+
+    Args:
+        vocabulary_sizes (List[int]): Number of distinct values of every key column
+
+    Returns:
+        List[int]: Bit offset of every key column
+    """
+    offsets, offset = [], 0
+    for size in vocabulary_sizes:
+        offsets.append(offset)
+        offset += max(int(size - 1).bit_length(), 1)
+
+    if offset > 64:
+        raise ValueError(f"The keys need {offset} bits, more than the 64 bits of a packed key")
+
+    return offsets
+
+def key_codes(values: pd.Series, vocabulary: pd.Index) -> np.ndarray:
+    """
+    Return the position of every value in the vocabulary, -1 for unknown values. Category
+    columns only look their categories up and gather the codes
+
+    Args:
+        values (pd.Series): Values of a key column
+        vocabulary (pd.Index): Distinct station values of the key column
+
+    Returns:
+        np.ndarray: Code of every value
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # The code -1 of missing values picks the last entry, the code of a missing value
+        category_codes = np.append(vocabulary.get_indexer(values.cat.categories), vocabulary.get_indexer([np.nan]))
+        return category_codes[values.cat.codes.to_numpy()]
+
+    return vocabulary.get_indexer(values)
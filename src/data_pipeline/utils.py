@@ -1,6 +1,6 @@
 import pandas as pd
 
-from typing import Tuple
+from typing import Dict, List, Tuple
 
 def convert_and_sort_datetime(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -44,4 +44,34 @@ def train_val_test_split(df: pd.DataFrame, train_ratio: float,
 
     return train_set, val_set, test_set
 
+def assign_rolling_splits(periods: List[int], validation_ratio: float,
+                          test_ratio: float) -> Dict[str, List[int]]:
+    """
+    Assign monthly periods to a rolling time-based split. The latest months go to the test
+    set, the months before them to the val set and every earlier month to the train set, the
+    number of val and test months follows the ratios of a 12 month year like
+    train_val_test_split. Every new month pushes the oldest test month into val and the
+    oldest val month into train
+
+    Args:
+        periods (List[int]): Monthly periods in any order
+        validation_ratio (float): Share of a year used as the val set
+        test_ratio (float): Share of a year used as the test set
+
+    Returns:
+        Dict[str, List[int]]: Sorted periods of each of train, val and test
+    """
+    NUM_MONTHS = 12
+
+    val_month = round(NUM_MONTHS * validation_ratio)
+    test_month = round(NUM_MONTHS * test_ratio)
+    periods = sorted(periods)
+    num_train = max(len(periods) - val_month - test_month, 0)
+
+    return {
+        "train": periods[:num_train],
+        "val": periods[num_train:num_train + val_month],
+        "test": periods[num_train + val_month:]
+    }
+
 
@@ -0,0 +1,161 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+class Instrumentation:
+    """
+    Opt-in instrumentation of the pipeline and training stages. Every stage records its wall
+    time, CPU time, peak traced memory above the memory in use when it started, and the
+    rows/columns of its first tabular input and output. Stages that run more than once, such as
+    the per chunk stages of the raw data reader, are accumulated under the same name.
+    When disabled, run simply calls the stage
+    """
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self.stages = {}
+        self.profilers = {}
+        self.stack = []
+
+    def enable(self, profile: bool = False):
+        """
+        Start recording stages, this also starts tracemalloc which slows down allocations
+
+        Args:
+            profile (bool): Also run every top level stage under cProfile
+        """
+        self.enabled = True
+        self.profile = profile
+        self.stages = {}
+        self.profilers = {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        """
+        Stop recording stages, the recorded stages are kept until the next enable
+        """
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def run(self, name: str, function: Callable, *args, **kwargs) -> Any:
+        """
+        Run one stage and record its measurements under name
+
+        Args:
+            name (str): Name of the stage
+            function (Callable): Stage to run
+
+        Returns:
+            Any: Output of the stage
+        """
+        if not self.enabled:
+            return function(*args, **kwargs)
+
+        # A nested stage resets the traced peak, so the parent keeps the peak seen so far
+        if self.stack:
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        frame = {"start_memory": tracemalloc.get_traced_memory()[0], "peak": 0}
+        self.stack.append(frame)
+
+        # cProfile cannot nest, nested stages show up in the profile of their parent
+        profiler = None
+        if self.profile and len(self.stack) == 1:
+            profiler = self.profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+
+        start_time, start_cpu_time = time.perf_counter(), time.process_time()
+        try:
+            output = function(*args, **kwargs)
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - start_time, time.process_time() - start_cpu_time
+            if profiler is not None:
+                profiler.disable()
+
+            self.stack.pop()
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            if self.stack:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+
+        self.record(name, seconds, cpu_seconds, (peak - frame["start_memory"]) / 2 ** 20,
+                    first_shape(list(args) + list(kwargs.values())), first_shape([output]))
+
+        return output
+
+    def record(self, name: str, seconds: float, cpu_seconds: float, peak_memory_mb: float,
+               shape_in: tuple, shape_out: tuple):
+        """
+        Add the measurements of one run of a stage
+        """
+        stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "cpu_seconds": 0.0,
+                                              "peak_memory_mb": 0.0})
+        stage["calls"] += 1
+        stage["seconds"] += seconds
+        stage["cpu_seconds"] += cpu_seconds
+        stage["peak_memory_mb"] = max(stage["peak_memory_mb"], peak_memory_mb)
+
+        for prefix, shape in [("in", shape_in), ("out", shape_out)]:
+            if shape is not None:
+                stage[f"rows_{prefix}"] = stage.get(f"rows_{prefix}", 0) + shape[0]
+                stage[f"columns_{prefix}"] = shape[1]
+
+    def save(self, save_dir: str, file_name: str = "instrumentation.json"):
+        """
+        Write the recorded stages as json into save_dir, along with one cProfile dump per
+        top level stage under save_dir/profiles when profiling is enabled
+
+        Args:
+            save_dir (str): Folder to write into, usually the model's SAVE_DIR
+            file_name (str): Name of the json report
+        """
+        with open(os.path.join(save_dir, file_name), "w") as file:
+            json.dump({"stages": self.stages}, file, indent=2)
+
+        if self.profilers:
+            profile_dir = Path(save_dir) / "profiles"
+            os.makedirs(profile_dir, exist_ok=True)
+            for name, profiler in self.profilers.items():
+                profiler.dump_stats(profile_dir / f"{name}.prof")
+
+def first_shape(values: list) -> tuple:
+    """
+    Return the (rows, columns) shape of the first DataFrame or 2-D array in values, unpacking
+    tuples of outputs
+
+    Args:
+        values (list): Inputs or outputs of a stage
+
+    Returns:
+        tuple: Shape of the first tabular value, None if there is none
+    """
+    for value in values:
+        if isinstance(value, tuple):
+            shape = first_shape(list(value))
+            if shape is not None:
+                return shape
+        elif hasattr(value, "shape") and len(value.shape) == 2:
+            return tuple(int(size) for size in value.shape)
+
+    return None
+
+# Shared by the data pipeline and training, disabled unless enabled in conf/model.yaml
+INSTRUMENTATION = Instrumentation()
+
+def run_stage(name: str, function: Callable, *args, **kwargs) -> Any:
+    """
+    Run a stage through the shared instrumentation
+
+    Args:
+        name (str): Name of the stage
+        function (Callable): Stage to run
+
+    Returns:
+        Any: Output of the stage
+    """
+    return INSTRUMENTATION.run(name, function, *args, **kwargs)
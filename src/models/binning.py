@@ -0,0 +1,110 @@
+import numpy as np
+from scipy import sparse
+
+from src.data_pipeline.preprocessor import Preprocessor
+
+# Codes of a uint8 feature, also the default max_bins of HistGradientBoostingRegressor
+MAX_BINS = 255
+
+class FeatureBinner:
+    """
+    Bin the sparse feature matrix of the Preprocessor into a dense uint8 matrix with one column
+    per original column. Numerical columns are cut at quantiles of the train set. One hot
+    encoded columns are collapsed back into one column of category codes, where the last code
+    stands for categories unseen during fit, and flagged as categorical so that the model
+    splits on them natively. Columns with too many categories for a uint8 code are binned
+    like numerical columns on their category codes
+    """
+    def __init__(self):
+        # (kind, start, stop) of every output column over the columns of the feature matrix
+        self.columns = []
+        self.bin_edges = []
+        self.categorical_mask = np.zeros(0, dtype=bool)
+
+    def fit(self, data_X, preprocessor: Preprocessor = None) -> "FeatureBinner":
+        """
+        Work out the columns from the preprocessor and fit the bin edges on the train set
+
+        Args:
+            data_X: Train features, dense or sparse CSR as returned by Preprocessor.transform
+            preprocessor (Preprocessor): Preprocessor that produced the features, without it
+                every column is binned as numerical
+
+        Returns:
+            FeatureBinner: The fitted binner
+        """
+        if preprocessor is None:
+            self.columns = [("numerical", index, index + 1) for index in range(data_X.shape[1])]
+        else:
+            num_numerical = len(preprocessor.num_columns)
+            self.columns = [("numerical", index, index + 1) for index in range(num_numerical)]
+            start = num_numerical
+            for categories in preprocessor.encoder.categories_:
+                kind = "categorical" if len(categories) < MAX_BINS else "ordinal"
+                self.columns.append((kind, start, start + len(categories)))
+                start += len(categories)
+
+        data_X = sparse.csc_matrix(data_X)
+        self.bin_edges = []
+        for kind, start, stop in self.columns:
+            if kind == "categorical":
+                self.bin_edges.append(None)
+            else:
+                self.bin_edges.append(quantile_edges(self.column_values(data_X, kind, start, stop)))
+        self.categorical_mask = np.array([kind == "categorical" for kind, _, _ in self.columns], dtype=bool)
+
+        return self
+
+    def transform(self, data_X) -> np.ndarray:
+        """
+        Bin the features into uint8 codes
+
+        Args:
+            data_X: Features, dense or sparse CSR as returned by Preprocessor.transform
+
+        Returns:
+            np.ndarray: Dense uint8 matrix with one column per original column
+        """
+        data_X = sparse.csc_matrix(data_X)
+        binned_X = np.empty((data_X.shape[0], len(self.columns)), dtype=np.uint8)
+        for index, ((kind, start, stop), edges) in enumerate(zip(self.columns, self.bin_edges)):
+            values = self.column_values(data_X, kind, start, stop)
+            binned_X[:, index] = values if edges is None else np.searchsorted(edges, values)
+
+        return binned_X
+
+    @staticmethod
+    def column_values(data_X, kind: str, start: int, stop: int) -> np.ndarray:
+        """
+        Return the values of a numerical column or the category codes of a one hot block,
+        rows without any category get the code after the last category
+        """
+        block = data_X[:, start:stop]
+        if kind == "numerical":
+            return block.toarray().ravel() if sparse.issparse(block) else np.asarray(block).ravel()
+
+        rows, codes = sparse.csr_matrix(block).nonzero()
+        values = np.full(data_X.shape[0], stop - start, dtype=np.float64)
+        values[rows] = codes
+
+        return values
+
+def quantile_edges(values: np.ndarray, max_bins: int = MAX_BINS) -> np.ndarray:
+    """
+    Return up to max_bins - 1 edges cutting the values into bins, at the midpoints between the
+    distinct values when there are few enough of them and at quantiles otherwise. Missing
+    values fall into the last bin
+
+    Args:
+        values (np.ndarray): Train values of one column
+        max_bins (int): Maximum number of bins
+
+    Returns:
+        np.ndarray: Sorted bin edges
+    """
+    values = values[~np.isnan(values)]
+    distinct_values = np.unique(values)
+    if len(distinct_values) <= max_bins - 1:
+        return (distinct_values[:-1] + distinct_values[1:]) / 2
+
+    return np.unique(np.quantile(values, np.linspace(0, 1, max_bins)[1:-1]))
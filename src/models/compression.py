@@ -0,0 +1,378 @@
+from typing import Any, Dict, List, Tuple
+import copy
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from .tree_arrays import TREE_LEAF, leaf_nodes, to_dense_float32
+
+DEFAULT_COMPRESSION_CONF = {
+    "prune": True,
+    "rmse_tolerance": 0.01,
+    "threshold_dtype": "float32",
+    "value_dtype": "float32",
+    "keep_estimator": False,
+    "latency_rows": [1, 1000],
+    "latency_repeats": 5,
+    "revert_if_slower": True
+}
+THRESHOLD_DTYPES = ["float64", "float32"]
+VALUE_DTYPES = ["float64", "float32", "int32", "int16"]
+# Number of (row, tree) pairs walked at a time on the val split
+PAIRS_PER_BATCH = 1 << 20
+# Value of the feature and threshold of the leaves, as in sklearn.tree._tree.TREE_UNDEFINED
+TREE_UNDEFINED = -2
+
+logger = logging.getLogger("Compression")
+
+def compress_trees(trees: Dict[str, np.ndarray], val_X, val_y: np.ndarray,
+                   compression_conf: Dict[str, Any] = None) -> Tuple[Dict[str, np.ndarray], np.ndarray, Dict[str, Any]]:
+    """
+    Compress the node arrays of a forest on the val split in three steps. The val rows are
+    split in two interleaved halves, the prune rows decide the pruning and the check rows
+    decide what is kept, so that the compressed forest is judged on rows it was not pruned on.
+    Every step must also keep the RMSE of the full val split within rmse_tolerance of the
+    uncompressed forest's:
+
+    1. Every tree is pruned bottom-up: an internal node reached by prune rows becomes a leaf
+       when its own value gives them no more squared error than its pruned subtree does. The
+       pruning is dropped if it raises the RMSE of the check rows or of the full val split
+       beyond rmse_tolerance
+    2. The fewest leading trees whose check RMSE stays within rmse_tolerance of the
+       uncompressed forest's are picked, and more leading trees are added until the full val
+       RMSE does too
+    3. The nodes the kept trees no longer reach are dropped and the arrays are stored in the
+       smallest integer types and in threshold_dtype and value_dtype, float32 thresholds are
+       rounded down so that every float32 feature goes down the same branch as before. The
+       tolerance holds before this step, float32 and integer leaf values move the predictions
+       slightly, so the reported val RMSE after is measured on the stored arrays
+
+    Args:
+        trees (Dict[str, np.ndarray]): Node arrays as returned by export_trees
+        val_X: Features of the val split, dense or sparse CSR
+        val_y (np.ndarray): Target of the val split
+        compression_conf (Dict[str, Any]): Compression parameters, see conf/model.yaml
+
+    Returns:
+        Tuple: The compressed node arrays, the positions of the kept trees in the forest and
+            the node and tree counts and val RMSE before and after
+    """
+    conf = {**DEFAULT_COMPRESSION_CONF, **(compression_conf or {})}
+    if conf["threshold_dtype"] not in THRESHOLD_DTYPES or conf["value_dtype"] not in VALUE_DTYPES:
+        raise ValueError(f"Thresholds are stored as one of {THRESHOLD_DTYPES} and values as one of {VALUE_DTYPES}")
+
+    num_trees, num_nodes = len(trees["roots"]), len(trees["children_left"])
+    val_y = np.asarray(val_y, dtype=np.float64)
+    prune_rows, check_rows = slice(0, None, 2), slice(1, None, 2)
+    tree_predictions, leaves = val_predictions(trees, val_X)
+    val_rmse = rmse(tree_predictions.mean(axis=1), val_y)
+    max_val_rmse = val_rmse * (1 + conf["rmse_tolerance"])
+    max_check_rmse = rmse(tree_predictions[check_rows].mean(axis=1), val_y[check_rows]) * (1 + conf["rmse_tolerance"])
+
+    num_pruned = 0
+    if conf["prune"]:
+        pruned_trees, num_pruned = prune_trees(trees, leaves[prune_rows], val_y[prune_rows])
+        pruned_predictions, _ = val_predictions(pruned_trees, val_X)
+        if (rmse(pruned_predictions[check_rows].mean(axis=1), val_y[check_rows]) <= max_check_rmse
+                and rmse(pruned_predictions.mean(axis=1), val_y) <= max_val_rmse):
+            trees, tree_predictions = pruned_trees, pruned_predictions
+        else:
+            num_pruned = 0
+
+    selected = select_trees(tree_predictions[check_rows], val_y[check_rows], max_check_rmse)
+    selected = select_trees(tree_predictions, val_y, max_val_rmse, min_trees=len(selected))
+    compressed_trees = compact_trees(trees, selected, conf["threshold_dtype"], conf["value_dtype"])
+    compressed_predictions, _ = val_predictions(compressed_trees, val_X)
+
+    report = {
+        "trees_before": num_trees,
+        "trees_after": len(selected),
+        "nodes_before": num_nodes,
+        "nodes_after": len(compressed_trees["children_left"]),
+        "pruned_nodes": num_pruned,
+        "val_rmse_before": float(val_rmse),
+        "val_rmse_after": rmse(compressed_predictions.mean(axis=1), val_y),
+        "threshold_dtype": conf["threshold_dtype"],
+        "value_dtype": conf["value_dtype"]
+    }
+
+    return compressed_trees, selected, report
+
+def val_predictions(trees: Dict[str, np.ndarray], data_X) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Walk every row through every tree in batches of about PAIRS_PER_BATCH (row, tree) pairs
+
+    Args:
+        trees (Dict[str, np.ndarray]): Node arrays as returned by export_trees
+        data_X: Features, dense or sparse CSR
+
+    Returns:
+        Tuple[np.ndarray]: Prediction of every tree for every row (rows x trees) and the
+            leaf of every row in every tree
+    """
+    num_trees = len(trees["roots"])
+    batch_size = max(PAIRS_PER_BATCH // num_trees, 1)
+    leaves = np.empty((data_X.shape[0], num_trees), dtype=np.int64)
+    for start in range(0, data_X.shape[0], batch_size):
+        batch_X = to_dense_float32(data_X[start:start + batch_size])
+        leaves[start:start + batch_size] = leaf_nodes(trees, batch_X).reshape(-1, num_trees)
+
+    return np.asarray(trees["value"], dtype=np.float64)[leaves], leaves
+
+def node_depths(trees: Dict[str, np.ndarray]) -> List[np.ndarray]:
+    """
+    Return the internal nodes of every depth of the trees, from the roots down
+    """
+    children_left, children_right = trees["children_left"], trees["children_right"]
+
+    levels = []
+    level = np.asarray(trees["roots"], dtype=np.int64)
+    while level.size > 0:
+        internal = level[children_left[level] != TREE_LEAF]
+        levels.append(internal)
+        level = np.concatenate([children_left[internal], children_right[internal]])
+
+    return levels
+
+def prune_trees(trees: Dict[str, np.ndarray], leaves: np.ndarray, val_y: np.ndarray) -> Tuple[Dict[str, np.ndarray], int]:
+    """
+    Reduced error pruning of every tree on held out rows. The count, sum and sum of squares of
+    the targets of every leaf are added up into their parents level by level from the deepest
+    one, and on the way up a node reached by the rows becomes a leaf when predicting its value
+    gives them no more squared error than its pruned subtree. Nodes no row reaches are kept
+
+    Args:
+        trees (Dict[str, np.ndarray]): Node arrays as returned by export_trees
+        leaves (np.ndarray): Leaf of every row in every tree, see val_predictions
+        val_y (np.ndarray): Target of the rows
+
+    Returns:
+        Tuple: The pruned node arrays, with the nodes below the new leaves left unreachable,
+            and the number of internal nodes turned into leaves
+    """
+    num_nodes = len(trees["children_left"])
+    row_targets = np.repeat(val_y, leaves.shape[1])
+    counts = np.bincount(leaves.ravel(), minlength=num_nodes).astype(np.float64)
+    sums = np.bincount(leaves.ravel(), weights=row_targets, minlength=num_nodes)
+    squares = np.bincount(leaves.ravel(), weights=row_targets ** 2, minlength=num_nodes)
+
+    value = np.asarray(trees["value"], dtype=np.float64)
+    children_left, children_right = trees["children_left"].copy(), trees["children_right"].copy()
+    # Squared val error of every node predicting its own value, and of its pruned subtree
+    node_errors = squares - 2 * value * sums + counts * value ** 2
+    subtree_errors = node_errors.copy()
+
+    for level in reversed(node_depths(trees)):
+        left, right = children_left[level], children_right[level]
+        for stat in [counts, sums, squares]:
+            stat[level] = stat[left] + stat[right]
+        node_errors[level] = squares[level] - 2 * value[level] * sums[level] + counts[level] * value[level] ** 2
+
+        children_errors = subtree_errors[left] + subtree_errors[right]
+        collapse = (counts[level] > 0) & (node_errors[level] <= children_errors)
+        subtree_errors[level] = np.where(collapse, node_errors[level], children_errors)
+        children_left[level[collapse]] = TREE_LEAF
+        children_right[level[collapse]] = TREE_LEAF
+
+    collapsed = (children_left == TREE_LEAF) & (trees["children_left"] != TREE_LEAF)
+    pruned = {**trees, "children_left": children_left, "children_right": children_right,
+              "feature": np.where(collapsed, TREE_UNDEFINED, trees["feature"]),
+              "threshold": np.where(collapsed, TREE_UNDEFINED, trees["threshold"])}
+
+    return pruned, int(collapsed.sum())
+
+def select_trees(tree_predictions: np.ndarray, val_y: np.ndarray, max_rmse: float,
+                 min_trees: int = 1) -> np.ndarray:
+    """
+    Keep the fewest leading trees of the forest, at least min_trees, whose mean prediction has
+    an RMSE of at most max_rmse, or every tree if none do. The trees of a random forest are exchangeable, so the
+    leading trees are an unbiased subset while ranking the trees on the rows would favour the
+    ones that fit their noise
+
+    Args:
+        tree_predictions (np.ndarray): Prediction of every tree for every row
+        val_y (np.ndarray): Target of the rows
+        max_rmse (float): Largest RMSE of the kept trees
+        min_trees (int): Fewest trees to keep
+
+    Returns:
+        np.ndarray: Positions of the kept trees
+    """
+    num_trees = tree_predictions.shape[1]
+    running_sum = tree_predictions[:, :min_trees - 1].sum(axis=1)
+    for num_kept in range(min_trees, num_trees + 1):
+        running_sum += tree_predictions[:, num_kept - 1]
+        if rmse(running_sum / num_kept, val_y) <= max_rmse:
+            return np.arange(num_kept)
+
+    return np.arange(num_trees)
+
+def compact_trees(trees: Dict[str, np.ndarray], selected: np.ndarray, threshold_dtype: str = "float32",
+                  value_dtype: str = "float32") -> Dict[str, np.ndarray]:
+    """
+    Keep the nodes the selected trees reach and store them in compact types. Child indices,
+    features and roots get the smallest integer type that holds them, float32 thresholds are
+    rounded down to the float32 below the float64 threshold as the float32 features are
+    compared with <=, integer leaf values are rounded
+
+    Args:
+        trees (Dict[str, np.ndarray]): Node arrays as returned by export_trees
+        selected (np.ndarray): Positions of the trees to keep
+        threshold_dtype (str): float64 or float32
+        value_dtype (str): float64, float32, int32 or int16
+
+    Returns:
+        Dict[str, np.ndarray]: Node arrays of the kept trees
+    """
+    children_left, children_right = trees["children_left"], trees["children_right"]
+
+    reachable = np.zeros(len(children_left), dtype=bool)
+    level = np.asarray(trees["roots"])[selected].astype(np.int64)
+    while level.size > 0:
+        reachable[level] = True
+        internal = level[children_left[level] != TREE_LEAF]
+        level = np.concatenate([children_left[internal], children_right[internal]])
+
+    nodes = np.flatnonzero(reachable)
+    new_ids = np.full(len(children_left), TREE_LEAF, dtype=np.int64)
+    new_ids[nodes] = np.arange(len(nodes))
+    index_dtype = smallest_int_dtype(len(nodes))
+
+    def children(child_nodes):
+        return np.where(child_nodes == TREE_LEAF, TREE_LEAF, new_ids[child_nodes]).astype(index_dtype)
+
+    threshold = np.asarray(trees["threshold"])[nodes].astype(np.float64)
+    if threshold_dtype == "float32":
+        rounded = threshold.astype(np.float32)
+        above = rounded.astype(np.float64) > threshold
+        rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+        threshold = rounded
+
+    value = np.asarray(trees["value"])[nodes].astype(np.float64)
+    if value_dtype.startswith("int"):
+        value = np.round(value)
+        limits = np.iinfo(value_dtype)
+        if value.min(initial=0) < limits.min or value.max(initial=0) > limits.max:
+            raise ValueError(f"Leaf values from {value.min()} to {value.max()} do not fit in {value_dtype}")
+
+    feature = np.asarray(trees["feature"])[nodes]
+
+    return {
+        "roots": new_ids[np.asarray(trees["roots"])[selected]].astype(index_dtype),
+        "children_left": children(children_left[nodes]),
+        "children_right": children(children_right[nodes]),
+        "feature": feature.astype(smallest_int_dtype(max(int(feature.max(initial=0)), 2))),
+        "threshold": threshold,
+        "value": value.astype(value_dtype)
+    }
+
+def smallest_int_dtype(max_value: int) -> np.dtype:
+    """
+    Return the smallest signed integer type holding values up to max_value and -2
+    """
+    for dtype in [np.int16, np.int32, np.int64]:
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+def rmse(predictions: np.ndarray, targets: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((predictions - targets) ** 2)))
+
+def artifact_stats(model, data: Dict[str, Any], latency_rows: List[int] = (1, 1000),
+                   latency_repeats: int = 5) -> Dict[str, Any]:
+    """
+    Save the model into a temporary folder and measure its artifact: the size of the folder,
+    the time to load it with the estimator it holds, the median time to predict the first
+    rows of the test split and the RMSE of its predictions on the val and test splits
+
+    Args:
+        model (Model): Trained model
+        data (Dict[str, Any]): Output of the data pipeline
+        latency_rows (List[int]): Batch sizes the prediction latency is measured on
+        latency_repeats (int): Timed predictions per batch size
+
+    Returns:
+        Dict[str, Any]: Size in bytes, load seconds, latency seconds per batch size and the
+            val and test RMSE
+    """
+    from .model_factory import ModelFactory
+
+    model_dir, save_dir = model.MODEL_DIR, getattr(model, "SAVE_DIR", None)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model.MODEL_DIR = temp_dir
+        model.save_model()
+        size = sum(os.path.getsize(os.path.join(folder, file_name))
+                   for folder, _, file_names in os.walk(model.SAVE_DIR) for file_name in file_names)
+
+        start_time = time.perf_counter()
+        loaded = ModelFactory().load_model(model.SAVE_DIR)
+        # The estimator is only read when it is accessed
+        loaded.model
+        load_seconds = time.perf_counter() - start_time
+
+        latency = {}
+        for num_rows in latency_rows:
+            batch_X = data["test"][0][:num_rows]
+            timings = []
+            for _ in range(latency_repeats):
+                start_time = time.perf_counter()
+                loaded.predict(batch_X)
+                timings.append(time.perf_counter() - start_time)
+            latency[f"{num_rows}_rows"] = float(np.median(timings))
+
+        stats = {
+            "size_bytes": size,
+            "load_seconds": load_seconds,
+            "latency_seconds": latency,
+            "val_rmse": rmse(loaded.predict(data["val"][0]), np.asarray(data["val"][1], dtype=np.float64)),
+            "test_rmse": rmse(loaded.predict(data["test"][0]), np.asarray(data["test"][1], dtype=np.float64))
+        }
+        del loaded
+
+    model.MODEL_DIR = model_dir
+    model.SAVE_DIR = save_dir
+
+    return stats
+
+def compress_model(model, data: Dict[str, Any], compression_conf: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Compress a trained random forest on the val split and report its artifact before and after.
+    With revert_if_slower set, the uncompressed model is restored when the compressed one
+    predicts any of the latency_rows batches slower, the report is kept either way
+
+    Args:
+        model (RandomForest): Trained random forest, or sharded model of random forests
+        data (Dict[str, Any]): Output of the data pipeline
+        compression_conf (Dict[str, Any]): Compression parameters, see conf/model.yaml
+
+    Returns:
+        Dict[str, Any]: The compression report, also kept as model.compression_report and as
+            model.compression unless the compression was reverted
+    """
+    conf = {**DEFAULT_COMPRESSION_CONF, **(compression_conf or {})}
+    before = artifact_stats(model, data, conf["latency_rows"], conf["latency_repeats"])
+    # The preprocessor is not changed by the compression and is shared with the copy
+    uncompressed = copy.deepcopy(model, memo={id(model.preprocessor): model.preprocessor})
+    report = model.compress(data["val"][0], data["val"][1], conf)
+    after = artifact_stats(model, data, conf["latency_rows"], conf["latency_repeats"])
+
+    # Ratio of the latency after to the latency before of every batch size predicted slower
+    latency_regression = {batch: after["latency_seconds"][batch] / seconds
+                          for batch, seconds in before["latency_seconds"].items()
+                          if after["latency_seconds"][batch] > seconds}
+    reverted = bool(latency_regression) and conf["revert_if_slower"]
+    report = {**report, "before": before, "after": after, "latency_regression": latency_regression,
+              "reverted": reverted}
+
+    if reverted:
+        logger.warning(f"The compressed model predicts {sorted(latency_regression)} slower than the "
+                       f"uncompressed one, keeping the uncompressed model")
+        vars(model).clear()
+        vars(model).update(vars(uncompressed))
+    else:
+        model.compression = report
+    model.compression_report = report
+
+    return report
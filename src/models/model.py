@@ -1,24 +1,114 @@
 from abc import ABC, abstractmethod
 from typing import Dict, Union, Literal
 from datetime import datetime
+import copy
+import hashlib
+import json
+import logging
 import os
+import uuid
 import yaml
 from pathlib import Path
 
-from ..data_pipeline.datapipeline import *
+from ..data_pipeline.cache import save_arrays
+from .tree_arrays import export_trees, predict_trees, to_dense_float32
 
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error
-from sklearn.tree import DecisionTreeRegressor
+import numpy as np
 from joblib import dump, load
+from scipy import sparse
+
+logger = logging.getLogger("Model")
 
 class Model(ABC):
 
     RAW_STATION_DATA_PATH = Path("data/raw/dot_traffic_stations_2015.txt.gz")
     RAW_TRAFFIC_DATA_PATH = Path("data/raw/dot_traffic_2015.txt.gz")
-    
-    def __init__(self, params):
-        return self.build_model(params)
+    MODEL_DIR = "models"
+    MANIFEST_FILE = "manifest.json"
+    TREES_DIR = "trees"
+    # Whether the fitted estimator can be exported with export_trees
+    TREE_ARRAYS = True
+    # Fitted attributes saved next to the estimator and restored when the model is loaded
+    ARTIFACT_OBJECTS = []
+    # Largest batch the auto predictor sends to the tree arrays, sklearn's compiled loop is
+    # faster on larger batches
+    ARRAY_PREDICTOR_MAX_ROWS = 256
+    # Whether the trained trees can be compressed on the val split, see compress
+    COMPRESSIBLE = False
+    # Parameters of the matrix the estimator is fitted on, not passed to the estimator
+    FIT_PARAMS = ["fit_dense"]
+
+    def __init__(self, params, estimator_path: str = None, build: bool = True):
+        """
+        Args:
+            params (Dict[str, Any]): Hyperparameters for the model
+            estimator_path (str): Estimator file of a loaded artifact, the estimator is only
+                read when it is accessed and build_model is skipped so that loading a model
+                does not import sklearn
+            build (bool): Whether to build the estimator, False for loaded artifacts saved
+                without one
+        """
+        # Fitted data preprocessor, saved along with the model when set
+        self._preprocessor = None
+        # Preprocessor file of a loaded artifact, only read when the preprocessor is accessed
+        self.preprocessor_path = None
+        # ArrayPreprocessor of a loaded artifact, transforms inference records without sklearn
+        self.array_preprocessor = None
+        # Flat node arrays of the trees, memory-mapped for a loaded artifact
+        self.trees = None
+        # auto, arrays or sklearn, see predict_estimator
+        self.predictor = "auto"
+        self.estimator_path = estimator_path
+        # Val RMSE after every step of a model trained incrementally, logged with the results
+        self.val_curve = None
+        # Metrics of every split, from score_splits or the run registry
+        self.metrics = None
+        # Report of compress, the compressed trees replace the estimator when set
+        self.compression = None
+        # Report of compress_model, also set when the compression was reverted
+        self.compression_report = None
+        self._model = None
+        if estimator_path is not None or not build:
+            self.params = params
+        else:
+            self.build_model(params)
+
+    @property
+    def model(self):
+        """
+        The sklearn estimator, loaded on first access for models loaded from an artifact
+        """
+        if self._model is None and self.estimator_path is not None:
+            self._model = load(self.estimator_path)
+
+        return self._model
+
+    @model.setter
+    def model(self, estimator):
+        self._model = estimator
+
+    @property
+    def preprocessor(self):
+        """
+        The fitted Preprocessor, loaded on first access for models loaded from an artifact
+        """
+        if self._preprocessor is None and self.preprocessor_path is not None:
+            from ..data_pipeline.preprocessor import Preprocessor
+            self._preprocessor = Preprocessor.load(self.preprocessor_path)
+
+        return self._preprocessor
+
+    @preprocessor.setter
+    def preprocessor(self, preprocessor):
+        self._preprocessor = preprocessor
+
+    @property
+    def inference_preprocessor(self):
+        """
+        Preprocessor for inference records, the ArrayPreprocessor of a loaded artifact when
+        its manifest has one so that predicting does not import sklearn
+        """
+        return self.array_preprocessor if self.array_preprocessor is not None else self.preprocessor
 
     def evaluate(self, y_true: np.array, y_pred: np.array,
                  metrics: Literal["mse", "rmse"] = "rmse"):
@@ -30,6 +120,8 @@ class Model(ABC):
             y_pred (np.array): Predicted value
             metrics (Literal[str]): Either mse or rmse (defaults rmse)
         """
+        from sklearn.metrics import mean_squared_error
+
         if metrics == "mse":
             return mean_squared_error(y_true, y_pred, squared=True)
         elif metrics == "rmse":
@@ -49,13 +141,15 @@ class Model(ABC):
         pass
     
     @abstractmethod
-    def train(self, train_X, train_y):
+    def train(self, train_X, train_y, val_X=None, val_y=None):
         """
         Train the model
 
         Args:
-            train_X (np.array): Features to be used for training
+            train_X (np.array): Features to be used for training, dense or sparse CSR
             train_y (np.array): Target label to be used for training
+            val_X (np.array): Features of the val split, used by models that stop early
+            val_y (np.array): Target label of the val split
 
         """
         pass
@@ -73,14 +167,122 @@ class Model(ABC):
         Use model for prediction
 
         Args:
-            data_X (np.array): Data to be used for prediction
+            data_X (np.array): Data to be used for prediction, dense or sparse CSR
 
         Returns:
             predictions (np.array): Prediction of the model 
         """
         pass
 
-    def log_results(self, train_score: float, val_score: float, test_score: float):
+    def fit_matrix(self, data_X):
+        """
+        Return the features the estimator is fitted on. With fit_dense, sparse CSR features
+        are fitted as a dense float32 copy: sklearn's trees search the splits of dense
+        features about twice as fast, for a copy of rows x features x 4 bytes. The pipeline
+        and the cache keep the CSR matrices either way
+
+        Args:
+            data_X (np.array): Features, dense or sparse CSR
+
+        Returns:
+            np.array: Features to fit on
+        """
+        if self.params.get("fit_dense") and sparse.issparse(data_X):
+            return to_dense_float32(data_X)
+
+        return data_X
+
+    def save_artifact(self, prefix: str):
+        """
+        Save the model into a new folder under MODEL_DIR named after the prefix, the time and
+        a random suffix so that runs never collide. Along with the joblib estimator, the tree
+        node arrays are saved uncompressed so that loading memory-maps them and processes
+        serving the same model share one physical copy. A compressed model saves its
+        compressed arrays, and the estimator only if it was kept. A manifest lists the model,
+        preprocessor and feature schema
+
+        Args:
+            prefix (str): Prefix of the folder name
+        """
+        cur = datetime.now()
+        self.SAVE_DIR = f"{self.MODEL_DIR}/{prefix}_{cur:%Y_%m_%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.SAVE_DIR)
+
+        if self.model is not None:
+            dump(self.model, os.path.join(self.SAVE_DIR, self.MODEL_FILE))
+        if self.TREE_ARRAYS:
+            trees = self.trees if self.compression is not None else export_trees(self.model)
+            save_arrays(os.path.join(self.SAVE_DIR, self.TREES_DIR), trees)
+        for name in self.ARTIFACT_OBJECTS:
+            dump(getattr(self, name), os.path.join(self.SAVE_DIR, f"{name}.joblib"))
+        self.save_preprocessor()
+        components = self.save_components()
+
+        manifest = {
+            "model_class": type(self).__name__,
+            "estimator": self.MODEL_FILE if self.model is not None else None,
+            "params": self.params,
+            "trees": self.TREES_DIR if self.TREE_ARRAYS else None,
+            "objects": {name: f"{name}.joblib" for name in self.ARTIFACT_OBJECTS},
+            "preprocessor": "preprocessor.joblib" if self.preprocessor is not None else None,
+            "preprocessor_spec": self.preprocessor.to_spec() if self.preprocessor is not None else None,
+            "feature_schema": None,
+            "compression": self.compression,
+            **components,
+            "created_at": cur.isoformat(timespec="seconds")
+        }
+        if self.preprocessor is not None:
+            manifest["feature_schema"] = {
+                "num_columns": self.preprocessor.num_columns,
+                "cat_columns": self.preprocessor.cat_columns,
+                "feature_names": self.preprocessor.feature_names
+            }
+
+        with open(os.path.join(self.SAVE_DIR, self.MANIFEST_FILE), "w") as file:
+            json.dump(manifest, file, indent=2, default=str)
+
+    def predict_estimator(self, data_X) -> np.array:
+        """
+        Predict with the flat tree arrays or with the sklearn estimator, both give identical
+        predictions. The arrays predictor skips sklearn's per-estimator overhead and is used
+        for every batch when predictor is arrays, which loaded artifacts default to, and for
+        batches of up to ARRAY_PREDICTOR_MAX_ROWS rows when predictor is auto. Compressed
+        models always predict with their compressed arrays
+
+        Args:
+            data_X (np.array): Data to be used for prediction, dense or sparse CSR
+
+        Returns:
+            np.array: Raw prediction of the estimator
+        """
+        if self.compression is not None or self.predictor == "arrays" or (self.predictor == "auto" and
+                                          data_X.shape[0] <= self.ARRAY_PREDICTOR_MAX_ROWS):
+            if self.trees is None:
+                self.trees = export_trees(self.model)
+            return predict_trees(self.trees, data_X)
+
+        return self.model.predict(data_X)
+
+    def save_components(self) -> Dict:
+        """
+        Save the parts of the model that the estimator, tree arrays and objects do not cover
+        into SAVE_DIR
+
+        Returns:
+            Dict: Entries added to the manifest
+        """
+        return {}
+
+    def save_preprocessor(self):
+        """
+        Save the fitted preprocessor next to the model so that inference can reuse it
+        without refitting
+        """
+        if self.preprocessor is not None:
+            self.preprocessor.save(os.path.join(self.SAVE_DIR, "preprocessor.joblib"))
+
+    def log_results(self, train_score: float, val_score: float, test_score: float,
+                    cv_results: Dict = None, metrics: Dict = None):
         """
         Log the model's evaluation results in a yaml file.
 
@@ -88,13 +290,30 @@ class Model(ABC):
             train_score (float): Train score result
             val_score (float): Val score result
             test_score (float): Test score result
+            cv_results (Dict): Per fold and aggregate results of cross_validate, if it ran
+            metrics (Dict): Metrics of every split as returned by score_splits, the per station
+                metrics are written to station_metrics.yaml
         """
         results = {
-            "Model": str(type(self.model)),
+            "Model": str(type(self.model)) if self.model is not None else type(self).__name__,
             "Train": float(train_score),
             "Val": float(val_score),
             "Test": float(test_score)
         }
+        if cv_results is not None:
+            results["CV"] = cv_results
+        if self.val_curve is not None:
+            results["Val curve"] = self.val_curve
+        compression_report = self.compression_report if self.compression_report is not None else self.compression
+        if compression_report is not None:
+            results["Compression"] = compression_report
+        if metrics is not None:
+            results["Metrics"] = {split: {name: value for name, value in split_metrics.items() if name != "by_station"}
+                                  for split, split_metrics in metrics.items()}
+            station_metrics = {split: split_metrics["by_station"] for split, split_metrics in metrics.items()
+                               if "by_station" in split_metrics}
+            with open(os.path.join(self.SAVE_DIR, "station_metrics.yaml"), "w") as file:
+                yaml.dump(station_metrics, file)
 
         to_log = {**results, **self.params}
         with open(os.path.join(self.SAVE_DIR, "results.yaml"), "w") as file:
@@ -102,41 +321,265 @@ class Model(ABC):
 
 
 class RandomForest(Model):
+    MODEL_FILE = "rf.joblib"
+    COMPRESSIBLE = True
+    # Parameters of the incremental training, not passed to the estimator
+    GROWTH_PARAMS = ["warm_start_step", "n_iter_no_change", "tol", "checkpoint"]
+    CHECKPOINT_DIR = "checkpoints"
+
     def build_model(self, params: Dict[str, Union[int, str]]):
+        from sklearn.ensemble import RandomForestRegressor
+
         self.params = params            
-        self.model = RandomForestRegressor(**params)
+        self.model = RandomForestRegressor(**{key: value for key, value in params.items()
+                                              if key not in self.GROWTH_PARAMS + self.FIT_PARAMS})
 
-    def train(self, train_X, train_y):
-        self.model.fit(train_X, train_y)
+    def train(self, train_X, train_y, val_X=None, val_y=None):
+        self.trees = None
+        train_X = self.fit_matrix(train_X)
+        if val_X is None or self.params.get("warm_start_step") is None:
+            self.model.fit(train_X, train_y)
+            return
+
+        self.grow(train_X, train_y, val_X, val_y)
+
+    def grow(self, train_X, train_y, val_X, val_y):
+        """
+        Grow the forest warm_start_step trees at a time up to n_estimators and stop once the
+        val RMSE has not improved by more than tol for n_iter_no_change steps. The forest is
+        then cut back to the number of trees with the best val RMSE, the trees of a random
+        forest are independent so no refit is needed. With checkpoint set, the partial forest
+        is saved after every step and a run with the same parameters and train data resumes
+        from it
+
+        Args:
+            train_X (np.array): Features to be used for training, dense or sparse CSR
+            train_y (np.array): Target label to be used for training
+            val_X (np.array): Features of the val split
+            val_y (np.array): Target label of the val split
+        """
+        max_estimators = self.params.get("n_estimators", 100)
+        patience = self.params.get("n_iter_no_change") or 1
+        tol = self.params.get("tol") or 0.0
+        checkpoint_path = self.checkpoint_path(train_X, train_y) if self.params.get("checkpoint") else None
+
+        # Cast once instead of in the predict of every tree
+        val_X = val_X.astype(np.float32)
+        if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+            state = load(checkpoint_path)
+            self.model = state.pop("model")
+            logger.info(f"Resuming from a checkpoint with {len(self.model.estimators_)} trees")
+        else:
+            # Sum of the val predictions of every tree, new trees are added to it so that
+            # every step only predicts with the trees it added
+            state = {"val_sum": np.zeros(val_X.shape[0]), "val_curve": [], "best_rmse": np.inf,
+                     "best_estimators": 0, "stale_steps": 0}
+
+        self.model.set_params(warm_start=True)
+        num_estimators = len(getattr(self.model, "estimators_", []))
+        while num_estimators < max_estimators and state["stale_steps"] < patience:
+            self.model.set_params(n_estimators=min(num_estimators + self.params["warm_start_step"], max_estimators))
+            self.model.fit(train_X, train_y)
+
+            for estimator in self.model.estimators_[num_estimators:]:
+                state["val_sum"] += estimator.predict(val_X)
+            num_estimators = len(self.model.estimators_)
+
+            val_rmse = float(self.evaluate(val_y, state["val_sum"] / num_estimators, metrics="rmse"))
+            state["val_curve"].append({"n_estimators": num_estimators, "val_rmse": val_rmse})
+            logger.info(f"{num_estimators} trees: val RMSE {val_rmse:.4f}")
+            if val_rmse < state["best_rmse"] - tol:
+                state.update(best_rmse=val_rmse, best_estimators=num_estimators, stale_steps=0)
+            else:
+                state["stale_steps"] += 1
+
+            if checkpoint_path is not None:
+                self.save_checkpoint(checkpoint_path, state)
+
+        if state["best_estimators"] < num_estimators:
+            logger.info(f"Keeping the first {state['best_estimators']} trees")
+            self.model.estimators_ = self.model.estimators_[:state["best_estimators"]]
+        self.model.set_params(n_estimators=len(self.model.estimators_), warm_start=False)
+        self.val_curve = state["val_curve"]
+
+        if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    def checkpoint_path(self, train_X, train_y) -> str:
+        """
+        Return the checkpoint file of the forest, keyed on the parameters and a fingerprint of
+        the train data so that a checkpoint is only resumed by the same run
+
+        Args:
+            train_X (np.array): Features to be used for training, dense or sparse CSR
+            train_y (np.array): Target label to be used for training
+
+        Returns:
+            str: Filepath to the checkpoint
+        """
+        key = hashlib.sha256(json.dumps(self.params, sort_keys=True, default=str).encode())
+        key.update(str((train_X.shape, getattr(train_X, "nnz", None))).encode())
+        key.update(np.ascontiguousarray(train_y).tobytes())
+
+        return os.path.join(self.MODEL_DIR, self.CHECKPOINT_DIR, f"RF_{key.hexdigest()[:16]}.joblib")
+
+    def save_checkpoint(self, checkpoint_path: str, state: Dict):
+        """
+        Save the partial forest and the early stopping state, written to a temporary file
+        first so that an interrupted save never leaves a broken checkpoint behind
+        """
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+        dump({**state, "model": self.model}, f"{checkpoint_path}.tmp")
+        os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+    def compress(self, val_X, val_y, compression_conf: Dict = None) -> Dict:
+        """
+        Replace the trees with their compression on the val split, see compress_trees. The
+        estimator is dropped unless keep_estimator is set, in which case it keeps the selected
+        trees unpruned. Predictions always go through the compressed arrays
+
+        Args:
+            val_X (np.array): Features of the val split, dense or sparse CSR
+            val_y (np.array): Target label of the val split
+            compression_conf (Dict): Compression parameters, see conf/model.yaml
+
+        Returns:
+            Dict: Node and tree counts and val RMSE before and after the compression
+        """
+        from .compression import compress_trees
+
+        compression_conf = compression_conf or {}
+        trees, selected, report = compress_trees(export_trees(self.model), val_X, val_y, compression_conf)
+        logger.info(f"Compressed {report['trees_before']} trees of {report['nodes_before']} nodes into "
+                    f"{report['trees_after']} trees of {report['nodes_after']} nodes, val RMSE "
+                    f"{report['val_rmse_before']:.4f} -> {report['val_rmse_after']:.4f}")
+
+        if compression_conf.get("keep_estimator"):
+            self.model.estimators_ = [self.model.estimators_[index] for index in selected]
+            self.model.set_params(n_estimators=len(selected))
+        else:
+            self.model = None
+            self.estimator_path = None
+        self.trees = trees
+        self.compression = report
+
+        return report
 
     def predict(self, data_X) -> np.array: 
-        return np.round(self.model.predict(data_X))
+        return np.round(self.predict_estimator(data_X))
 
     def save_model(self):
-        cur = datetime.datetime.now()
-        year, month, day, hour, minute = cur.year, cur.month, cur.day, cur.hour, cur.minute
-        self.SAVE_DIR = f"models/RF_{year}_{month}_{day}_{hour}_{minute}"
-        os.mkdir(self.SAVE_DIR)
-        dump(self.model, os.path.join(self.SAVE_DIR, "rf.joblib"))
+        self.save_artifact("RF")
 
 class DecisionTree(Model):
+    MODEL_FILE = "dt.joblib"
+
     def build_model(self, params: Dict[str, Union[int, str]]):
+        from sklearn.tree import DecisionTreeRegressor
+
         self.params = params        
-        self.model = DecisionTreeRegressor(**params)
+        self.model = DecisionTreeRegressor(**{key: value for key, value in params.items()
+                                              if key not in self.FIT_PARAMS})
 
-    def train(self, train_X, train_y):
-        self.model.fit(train_X, train_y)
+    def train(self, train_X, train_y, val_X=None, val_y=None):
+        self.model.fit(self.fit_matrix(train_X), train_y)
+        self.trees = None
 
     def predict(self, data_X) -> np.array:
-        return np.round(self.model.predict(data_X))
+        return np.round(self.predict_estimator(data_X))
 
     def save_model(self):
-        cur = datetime.datetime.now()
-        year, month, day, hour, minute = cur.year, cur.month, cur.day, cur.hour, cur.minute
-        self.SAVE_DIR = f"models/DT_{year}_{month}_{day}_{hour}_{minute}"
-        os.mkdir(self.SAVE_DIR)
-        dump(self.model, os.path.join(self.SAVE_DIR, "dt.joblib"))
+        self.save_artifact("DT")
 
+class HistGradientBoosting(Model):
+    MODEL_FILE = "hgb.joblib"
+    TREE_ARRAYS = False
+    ARTIFACT_OBJECTS = ["binner"]
+    # Boosting iterations added between two evaluations of the val split
+    EARLY_STOPPING_STEP = 10
+    binner = None
+    # Binned matrices seen during training, reused when predicting on them
+    binned = None
+
+    def build_model(self, params: Dict[str, Union[int, str]]):
+        # Needed by scikit-learn 0.24, where histogram-based gradient boosting is still experimental
+        from sklearn.experimental import enable_hist_gradient_boosting
+        from sklearn.ensemble import HistGradientBoostingRegressor
 
+        self.params = params
+        # Early stopping runs on the val split in train, not on a random share of the train set
+        estimator_params = {key: value for key, value in params.items()
+                            if not (key == "n_iter_no_change" and value is None)}
+        self.model = HistGradientBoostingRegressor(**{**estimator_params, "early_stopping": False})
 
+    def train(self, train_X, train_y, val_X=None, val_y=None):
+        from .binning import FeatureBinner
 
+        self.binner = FeatureBinner().fit(train_X, self.preprocessor)
+        self.binned = {}
+        binned_train_X = self.bin(train_X)
+        self.model.set_params(categorical_features=self.binner.categorical_mask)
+
+        if val_X is None or self.params.get("n_iter_no_change") is None:
+            self.model.fit(binned_train_X, train_y)
+            return
+
+        self.model = self.fit_with_early_stopping(binned_train_X, train_y, self.bin(val_X), val_y)
+
+    def fit_with_early_stopping(self, binned_train_X: np.array, train_y: np.array,
+                                binned_val_X: np.array, val_y: np.array):
+        """
+        Add boosting iterations EARLY_STOPPING_STEP at a time until the val RMSE has not
+        improved by more than tol for n_iter_no_change iterations or max_iter is reached. A
+        copy of the estimator is taken at every improvement, so the best iterations are kept
+        without fitting again
+
+        Returns:
+            HistGradientBoostingRegressor: Estimator with the best val RMSE, its max_iter is
+                the number of iterations it was fitted with
+        """
+        max_iter = self.params.get("max_iter", 100)
+        patience = max(self.params["n_iter_no_change"] // self.EARLY_STOPPING_STEP, 1)
+        tol = self.params.get("tol", 1e-7)
+
+        best_rmse, best_model, stale_steps = np.inf, None, 0
+        self.model.set_params(warm_start=True)
+        for num_iter in range(self.EARLY_STOPPING_STEP, max_iter + self.EARLY_STOPPING_STEP, self.EARLY_STOPPING_STEP):
+            self.model.set_params(max_iter=min(num_iter, max_iter))
+            self.model.fit(binned_train_X, train_y)
+
+            val_rmse = self.evaluate(val_y, self.model.predict(binned_val_X), metrics="rmse")
+            if val_rmse < best_rmse - tol:
+                best_rmse, best_model, stale_steps = val_rmse, copy.deepcopy(self.model), 0
+            else:
+                stale_steps += 1
+            if stale_steps >= patience or self.model.n_iter_ >= max_iter:
+                break
+
+        best_model.set_params(warm_start=False, max_iter=best_model.n_iter_)
+
+        return best_model
+
+    def bin(self, data_X) -> np.array:
+        """
+        Bin the features with the fitted binner, matrices binned during training are reused
+        """
+        cached = self.binned.get(id(data_X)) if self.binned is not None else None
+        if cached is not None and cached[0] is data_X:
+            return cached[1]
+
+        binned_X = self.binner.transform(data_X)
+        if self.binned is not None and len(self.binned) < 2:
+            self.binned[id(data_X)] = (data_X, binned_X)
+
+        return binned_X
+
+    def predict(self, data_X) -> np.array:
+        return np.round(self.model.predict(self.bin(data_X)))
+
+    def __getstate__(self):
+        # The binned train and val matrices are not sent to scoring worker processes
+        return {**self.__dict__, "binned": None}
+
+    def save_model(self):
+        self.save_artifact("HGB")
@@ -1,13 +1,97 @@
-from typing import Dict, Union
-import yaml
+from typing import Any, Dict, Union
+import json
+import os
 
-from src.models.model import *
+from joblib import load
+
+from src.models.model import DecisionTree, HistGradientBoosting, Model, RandomForest
+from src.models.sharded import ShardedModel
+from src.data_pipeline.array_preprocessor import ArrayPreprocessor
+from src.data_pipeline.cache import load_arrays
 
 class ModelFactory:
 
-    def create_model(self, model_type: str, params: Dict[str, Union[int, str]]):
+    MODEL_CLASSES = [RandomForest, DecisionTree, HistGradientBoosting]
+
+    def create_model(self, model_type: str, params: Dict[str, Union[int, str]],
+                     sharding_conf: Dict[str, Any] = None):
+        if sharding_conf is not None:
+            return ShardedModel({**sharding_conf, "model_type": model_type, "params": params})
+
         if model_type == "random_forest":
             return RandomForest(params)
 
         elif model_type == "decision_tree":
-            return DecisionTree(params)
\ No newline at end of file
+            return DecisionTree(params)
+
+        elif model_type == "hist_gradient_boosting":
+            return HistGradientBoosting(params)
+
+    def load_model(self, save_dir: str) -> Model:
+        """
+        Load a saved model along with its preprocessor from the model folder. Folders with a
+        manifest are loaded lazily: the tree arrays are memory-mapped and used for
+        predictions, the sklearn estimator and preprocessor are only read when they are
+        accessed
+
+        Args:
+            save_dir (str): Model folder created by save_model
+
+        Returns:
+            Model: The trained model
+        """
+        manifest_path = os.path.join(save_dir, Model.MANIFEST_FILE)
+        if os.path.isfile(manifest_path):
+            return self.load_artifact(save_dir, manifest_path)
+
+        for model_class in self.MODEL_CLASSES:
+            model_path = os.path.join(save_dir, model_class.MODEL_FILE)
+            if os.path.isfile(model_path):
+                estimator = load(model_path)
+                model = model_class(estimator.get_params())
+                model.model = estimator
+                model.SAVE_DIR = save_dir
+
+                preprocessor_path = os.path.join(save_dir, "preprocessor.joblib")
+                if os.path.isfile(preprocessor_path):
+                    model.preprocessor_path = preprocessor_path
+
+                return model
+
+        raise FileNotFoundError(f"No saved model found in {save_dir}")
+
+    def load_artifact(self, save_dir: str, manifest_path: str) -> Model:
+        """
+        Load a model folder written by Model.save_artifact
+
+        Args:
+            save_dir (str): Model folder created by save_model
+            manifest_path (str): Filepath to the manifest of the folder
+
+        Returns:
+            Model: The trained model, with memory-mapped tree arrays for tree ensembles
+        """
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+
+        model_classes = {model_class.__name__: model_class for model_class in [*self.MODEL_CLASSES, ShardedModel]}
+        # Compressed models are saved without an estimator unless it was kept
+        estimator_path = os.path.join(save_dir, manifest["estimator"]) if manifest["estimator"] is not None else None
+        model = model_classes[manifest["model_class"]](manifest["params"], estimator_path=estimator_path, build=False)
+        model.SAVE_DIR = save_dir
+        model.compression = manifest.get("compression")
+        if manifest["trees"] is not None:
+            model.trees = load_arrays(os.path.join(save_dir, manifest["trees"]), mmap_mode="r")
+            model.predictor = "arrays"
+        for name, file_name in manifest.get("objects", {}).items():
+            setattr(model, name, load(os.path.join(save_dir, file_name)))
+        if manifest.get("shards") is not None:
+            model.routing = manifest["routing"]
+            model.shards = [self.load_model(os.path.join(save_dir, shard_dir)) for shard_dir in manifest["shards"]]
+
+        if manifest["preprocessor"] is not None:
+            model.preprocessor_path = os.path.join(save_dir, manifest["preprocessor"])
+        if manifest.get("preprocessor_spec") is not None:
+            model.array_preprocessor = ArrayPreprocessor(manifest["preprocessor_spec"])
+
+        return model
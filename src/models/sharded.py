@@ -0,0 +1,266 @@
+from typing import Any, Dict, List, Union
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+from ..data_pipeline.cache import load_arrays, load_objects, save_arrays
+from .model import Model
+
+DEFAULT_SHARDING_CONF = {
+    "key": "functional_classification",
+    "min_rows": 10_000,
+    "n_jobs": None
+}
+# Label of the shard of the categories with fewer than min_rows train rows
+OTHER_SHARD = "other"
+
+# Shared train and val matrices memory-mapped by every worker process, set by init_worker
+SHARED_DATA = {}
+
+logger = logging.getLogger("Sharded Model")
+
+class ShardedModel(Model):
+    """
+    One model per category of a categorical feature, such as functional_classification. The
+    shard of every row is read from the one hot encoded columns of the key in the feature
+    matrix, so inference records are routed without any column besides the features. The
+    categories with fewer than min_rows train rows and the categories unseen in training
+    share one shard, or go to the largest shard when every category has enough rows
+    """
+    MODEL_FILE = None
+    TREE_ARRAYS = False
+    SHARDS_DIR = "shards"
+
+    def __init__(self, params, estimator_path: str = None, build: bool = True):
+        # Model of every shard and the routing table, see fit_routing
+        self.shards = []
+        self.routing = None
+        super().__init__(params, estimator_path=estimator_path, build=build)
+
+    @property
+    def predictor(self) -> str:
+        return self._predictor
+
+    @predictor.setter
+    def predictor(self, predictor: str):
+        # Every shard predicts with the predictor of the sharded model
+        self._predictor = predictor
+        for shard in self.shards:
+            shard.predictor = predictor
+
+    @property
+    def COMPRESSIBLE(self) -> bool:
+        # Compressed shard by shard once they are trained, see compress
+        return bool(self.shards) and all(shard.COMPRESSIBLE for shard in self.shards)
+
+    def build_model(self, params: Dict[str, Any]):
+        """
+        Args:
+            params (Dict[str, Any]): model_type and params of the shards, along with the key,
+                min_rows and n_jobs of the sharding, see conf/model.yaml
+        """
+        self.params = {**DEFAULT_SHARDING_CONF, **params}
+        self.model = None
+
+    def fit_routing(self, train_X):
+        """
+        Build the routing table from the key categories of the train rows. The table maps the
+        code of every category of the key, with the categories unseen in training last, to the
+        index of its shard
+
+        Args:
+            train_X: Features to be used for training, dense or sparse CSR
+        """
+        preprocessor = self.preprocessor
+        if self.params["key"] not in preprocessor.cat_columns:
+            raise ValueError(f"Shard key {self.params['key']} is not one of the categorical columns "
+                             f"{preprocessor.cat_columns}")
+
+        key_index = preprocessor.cat_columns.index(self.params["key"])
+        start = len(preprocessor.num_columns) + sum(len(categories) for categories
+                                                    in preprocessor.encoder.categories_[:key_index])
+        categories = [str(category) for category in preprocessor.encoder.categories_[key_index]]
+        self.routing = {"key": self.params["key"], "columns": [start, start + len(categories)],
+                        "categories": categories}
+
+        codes = self.key_codes(train_X)
+        rows_per_code = np.bincount(codes, minlength=len(categories) + 1)
+        large_codes = [code for code in range(len(categories)) if rows_per_code[code] >= self.params["min_rows"]]
+        shard_of_code = np.full(len(categories) + 1, len(large_codes), dtype=np.int64)
+        shard_of_code[large_codes] = np.arange(len(large_codes))
+        shard_labels = [categories[code] for code in large_codes]
+        if rows_per_code[shard_of_code == len(large_codes)].sum() > 0:
+            shard_labels.append(OTHER_SHARD)
+        else:
+            shard_of_code[shard_of_code == len(large_codes)] = int(np.argmax(rows_per_code[large_codes]))
+
+        self.routing.update(shard_of_code=shard_of_code.tolist(), shards=shard_labels)
+
+    def key_codes(self, data_X) -> np.ndarray:
+        """
+        Return the code of the key category of every row, the number of categories for rows
+        without any, from the one hot encoded columns of the key
+
+        Args:
+            data_X: Features, dense or sparse CSR
+
+        Returns:
+            np.ndarray: Category code of every row
+        """
+        start, stop = self.routing["columns"]
+        key_X = data_X[:, start:stop]
+        codes = np.full(data_X.shape[0], stop - start, dtype=np.int64)
+        if sparse.issparse(key_X):
+            key_X = sparse.csr_matrix(key_X)
+            key_X.eliminate_zeros()
+            has_key = np.diff(key_X.indptr) > 0
+            codes[has_key] = key_X.indices[key_X.indptr[:-1][has_key]]
+        else:
+            key_X = np.asarray(key_X)
+            has_key = (key_X != 0).any(axis=1)
+            codes[has_key] = np.argmax(key_X[has_key] != 0, axis=1)
+
+        return codes
+
+    def route(self, data_X) -> List[np.ndarray]:
+        """
+        Group the rows by shard in one pass: the rows are sorted by shard and cut at the shard
+        boundaries
+
+        Args:
+            data_X: Features, dense or sparse CSR
+
+        Returns:
+            List[np.ndarray]: Row indices of every shard, in row order
+        """
+        shard_ids = np.asarray(self.routing["shard_of_code"])[self.key_codes(data_X)]
+        order = np.argsort(shard_ids, kind="stable")
+        boundaries = np.cumsum(np.bincount(shard_ids, minlength=len(self.routing["shards"])))
+
+        return np.split(order, boundaries[:-1])
+
+    def train(self, train_X, train_y, val_X=None, val_y=None):
+        """
+        Route the train and val rows to their shards and train the shards in parallel in
+        n_jobs worker processes. The train and val matrices are written once and memory-mapped
+        by every worker, which selects the rows of its shard with index arrays
+        """
+        self.fit_routing(train_X)
+        train_rows = self.route(train_X)
+        val_rows = self.route(val_X) if val_X is not None else [None] * len(train_rows)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shared_dir = Path(tmp_dir) / "shared"
+            arrays = {"train_X": train_X, "train_y": np.asarray(train_y)}
+            if val_X is not None:
+                arrays.update(val_X=val_X, val_y=np.asarray(val_y))
+            for shard_index, (shard_train_rows, shard_val_rows) in enumerate(zip(train_rows, val_rows)):
+                arrays[f"shard_{shard_index}_train"] = shard_train_rows
+                if shard_val_rows is not None:
+                    arrays[f"shard_{shard_index}_val"] = shard_val_rows
+            save_arrays(shared_dir, arrays, {"preprocessor": self.preprocessor})
+
+            with ProcessPoolExecutor(max_workers=self.params["n_jobs"], initializer=init_worker,
+                                     initargs=(shared_dir,)) as executor:
+                futures = [executor.submit(train_shard, self.params["model_type"], self.params["params"], shard_index)
+                           for shard_index in range(len(train_rows))]
+                results = [future.result() for future in futures]
+
+        self.shards = [shard for shard, _ in results]
+        # The shards were built in the workers with the default predictor
+        self.predictor = self.predictor
+        for label, shard_train_rows, (_, fit_seconds) in zip(self.routing["shards"], train_rows, results):
+            logger.info(f"Shard {label}: {len(shard_train_rows)} train rows, fit in {fit_seconds:.1f}s")
+
+    def compress(self, val_X, val_y, compression_conf: Dict = None) -> Dict:
+        """
+        Compress every shard on its own val rows, shards without val rows are left as they are
+
+        Returns:
+            Dict: Compression report of every shard
+        """
+        val_y = np.asarray(val_y)
+        report = {}
+        for label, shard, rows in zip(self.routing["shards"], self.shards, self.route(val_X)):
+            if len(rows) > 0:
+                report[label] = shard.compress(val_X[rows], val_y[rows], compression_conf)
+        self.compression = report
+
+        return report
+
+    def predict(self, data_X) -> np.array:
+        """
+        Predict every shard's rows with its model, one batch per shard
+        """
+        predictions = np.zeros(data_X.shape[0], dtype=np.float64)
+        for shard, rows in zip(self.shards, self.route(data_X)):
+            if len(rows) > 0:
+                predictions[rows] = shard.predict(data_X[rows])
+
+        return predictions
+
+    def save_components(self) -> Dict[str, Any]:
+        """
+        Save every shard into its own folder under the shards folder of the model, the shards
+        share the preprocessor of the sharded model
+
+        Returns:
+            Dict[str, Any]: The routing table with the folder of every shard
+        """
+        shard_dirs = []
+        for shard in self.shards:
+            shard.MODEL_DIR = os.path.join(self.SAVE_DIR, self.SHARDS_DIR)
+            shard.save_model()
+            shard_dirs.append(os.path.relpath(shard.SAVE_DIR, self.SAVE_DIR))
+
+        return {"routing": self.routing, "shards": shard_dirs}
+
+    def save_model(self):
+        self.save_artifact("SHARDED")
+
+def init_worker(shared_dir: Path):
+    """
+    Memory-map the shared train and val matrices once per worker process
+
+    Args:
+        shared_dir (Path): Folder written with save_arrays
+    """
+    SHARED_DATA.update(load_arrays(shared_dir))
+    SHARED_DATA.update(load_objects(shared_dir))
+
+def train_shard(model_type: str, params: Dict[str, Union[int, str]], shard_index: int):
+    """
+    Train the model of one shard on its train rows, with its val rows for the models that
+    stop early, run inside a worker process
+
+    Args:
+        model_type (str): Model type as specified in conf/model.yaml
+        params (Dict[str, Union[int, str]]): Hyperparameters of the model
+        shard_index (int): Index of the shard
+
+    Returns:
+        Tuple: The trained model and its fit time in seconds
+    """
+    from .model_factory import ModelFactory
+
+    train_rows = SHARED_DATA[f"shard_{shard_index}_train"]
+    val_rows = SHARED_DATA.get(f"shard_{shard_index}_val")
+    val_X = val_y = None
+    if val_rows is not None and len(val_rows) > 0:
+        val_X, val_y = SHARED_DATA["val_X"][val_rows], SHARED_DATA["val_y"][val_rows]
+
+    model = ModelFactory().create_model(model_type, params)
+    model.preprocessor = SHARED_DATA["preprocessor"]
+    start_time = time.perf_counter()
+    model.train(SHARED_DATA["train_X"][train_rows], SHARED_DATA["train_y"][train_rows], val_X, val_y)
+    fit_seconds = time.perf_counter() - start_time
+    # The sharded model holds the preprocessor, it is not sent back with every shard
+    model.preprocessor = None
+
+    return model, fit_seconds
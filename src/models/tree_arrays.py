@@ -0,0 +1,122 @@
+from typing import Dict
+
+import numpy as np
+from scipy import sparse
+
+# Child index of the leaves, as in sklearn.tree._tree.TREE_LEAF
+TREE_LEAF = -1
+# Number of (row, tree) pairs walked at a time, bounds the memory of a batch
+PAIRS_PER_BATCH = 1 << 16
+
+def export_trees(estimator) -> Dict[str, np.ndarray]:
+    """
+    Export the fitted trees of a decision tree or random forest regressor into flat node
+    arrays. The nodes of every tree are concatenated and the child indices point into the
+    concatenated arrays, so the arrays can be saved uncompressed and memory-mapped
+
+    Args:
+        estimator: Fitted DecisionTreeRegressor or RandomForestRegressor
+
+    Returns:
+        Dict[str, np.ndarray]: Root node of every tree and the children_left, children_right,
+            feature, threshold and value of every node
+    """
+    trees = [tree.tree_ for tree in getattr(estimator, "estimators_", [estimator])]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+    def children(child_nodes, offset):
+        return np.where(child_nodes == TREE_LEAF, TREE_LEAF, child_nodes + offset)
+
+    return {
+        "roots": offsets[:-1].astype(np.int64),
+        "children_left": np.concatenate([children(tree.children_left, offset)
+                                         for tree, offset in zip(trees, offsets)]).astype(np.int64),
+        "children_right": np.concatenate([children(tree.children_right, offset)
+                                          for tree, offset in zip(trees, offsets)]).astype(np.int64),
+        "feature": np.concatenate([tree.feature for tree in trees]).astype(np.int64),
+        "threshold": np.concatenate([tree.threshold for tree in trees]).astype(np.float64),
+        "value": np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64)
+    }
+
+def predict_trees(trees: Dict[str, np.ndarray], data_X) -> np.ndarray:
+    """
+    Predict with the exported trees, matching the predictions of sklearn exactly: the features
+    are compared as float32 against the float64 thresholds and the leaf values are summed in
+    tree order before averaging, as sklearn does. Rows are walked in batches of about
+    PAIRS_PER_BATCH (row, tree) pairs
+
+    Args:
+        trees (Dict[str, np.ndarray]): Node arrays as returned by export_trees
+        data_X: Features, dense or sparse CSR
+
+    Returns:
+        np.ndarray: Prediction of every row
+    """
+    batch_size = max(PAIRS_PER_BATCH // len(trees["roots"]), 1)
+    if data_X.shape[0] <= batch_size:
+        return predict_batch(trees, to_dense_float32(data_X))
+
+    predictions = np.empty(data_X.shape[0], dtype=np.float64)
+    for start in range(0, data_X.shape[0], batch_size):
+        predictions[start:start + batch_size] = predict_batch(trees, to_dense_float32(data_X[start:start + batch_size]))
+
+    return predictions
+
+def to_dense_float32(data_X) -> np.ndarray:
+    """
+    Convert dense or sparse CSR features to the dense float32 array sklearn predicts on
+    """
+    if sparse.issparse(data_X):
+        return data_X.astype(np.float32).toarray()
+
+    return np.asarray(data_X, dtype=np.float32)
+
+def predict_batch(trees: Dict[str, np.ndarray], batch_X: np.ndarray) -> np.ndarray:
+    """
+    Walk all trees for all rows of a dense batch at once. Every (row, tree) pair holds its
+    current node and all pairs that have not reached a leaf move one level per step, so the
+    number of NumPy calls grows with the depth of the trees instead of their number
+
+    Args:
+        trees (Dict[str, np.ndarray]): Node arrays as returned by export_trees
+        batch_X (np.ndarray): Dense float32 features
+
+    Returns:
+        np.ndarray: Prediction of every row
+    """
+    num_rows, num_trees = batch_X.shape[0], len(trees["roots"])
+    nodes = leaf_nodes(trees, batch_X)
+
+    # Summed tree by tree, a pairwise sum over the trees could differ from sklearn in the last bit
+    leaf_values = trees["value"][nodes].reshape(num_rows, num_trees)
+    predictions = np.zeros(num_rows, dtype=np.float64)
+    for tree_index in range(num_trees):
+        predictions += leaf_values[:, tree_index]
+
+    return predictions / num_trees
+
+def leaf_nodes(trees: Dict[str, np.ndarray], batch_X: np.ndarray) -> np.ndarray:
+    """
+    Return the leaf every (row, tree) pair of a dense batch ends in, the pairs are laid out
+    row by row so pair // num_trees is the row of the pair
+
+    Args:
+        trees (Dict[str, np.ndarray]): Node arrays as returned by export_trees
+        batch_X (np.ndarray): Dense float32 features
+
+    Returns:
+        np.ndarray: Leaf node of every pair
+    """
+    children_left, children_right = trees["children_left"], trees["children_right"]
+    feature, threshold = trees["feature"], trees["threshold"]
+    num_rows, num_trees = batch_X.shape[0], len(trees["roots"])
+
+    nodes = np.tile(np.asarray(trees["roots"]), num_rows)
+    active = np.flatnonzero(children_left[nodes] != TREE_LEAF)
+    while active.size > 0:
+        active_nodes = nodes[active]
+        go_left = batch_X[active // num_trees, feature[active_nodes]] <= threshold[active_nodes]
+        nodes[active] = np.where(go_left, children_left[active_nodes], children_right[active_nodes])
+        active = active[children_left[nodes[active]] != TREE_LEAF]
+
+    return nodes
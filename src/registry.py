@@ -0,0 +1,184 @@
+from src.data_pipeline.cache import code_version
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from scipy import sparse
+
+REGISTRY_PATH = Path("models/registry.sqlite")
+# The model code is part of the config hash, so a changed model never reuses old runs
+MODELS_CODE_DIR = Path(__file__).resolve().parent / "models"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    model_type TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    data_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    train_rmse REAL,
+    val_rmse REAL,
+    test_rmse REAL,
+    metrics TEXT NOT NULL,
+    cv_results TEXT,
+    timings TEXT NOT NULL,
+    artifact_path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_config ON runs (config_hash, data_hash);
+CREATE INDEX IF NOT EXISTS runs_by_model_type ON runs (model_type, val_rmse);
+"""
+
+class RunRegistry:
+    """
+    Local SQLite registry of the training runs. Every run is recorded with the hash of its
+    model config, the fingerprint of the matrices it was trained on, its metrics, stage
+    timings and the folder of its saved model, so that a run of the same config on the same
+    data is looked up instead of trained again
+    """
+    def __init__(self, db_path: Path = REGISTRY_PATH):
+        """
+        Args:
+            db_path (Path): SQLite file of the registry, created along with its folder
+        """
+        os.makedirs(Path(db_path).parent, exist_ok=True)
+        self.connection = sqlite3.connect(str(db_path))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def find(self, config_hash: str, data_hash: str) -> Dict[str, Any]:
+        """
+        Return the latest run of the config on the data whose model folder still exists
+
+        Args:
+            config_hash (str): Hash of the model config, see config_hash
+            data_hash (str): Fingerprint of the matrices, see data_fingerprint
+
+        Returns:
+            Dict[str, Any]: The run, None if there is none
+        """
+        rows = self.connection.execute("SELECT * FROM runs WHERE config_hash = ? AND data_hash = ? ORDER BY id DESC",
+                                       (config_hash, data_hash))
+        for row in rows:
+            if os.path.isdir(row["artifact_path"]):
+                return to_run(row)
+
+        return None
+
+    def record(self, model_type: str, params: Dict[str, Any], config_hash: str, data_hash: str,
+               metrics: Dict[str, Dict[str, Any]], timings: Dict[str, float], artifact_path: str,
+               cv_results: Dict[str, Any] = None) -> int:
+        """
+        Record a finished run
+
+        Args:
+            model_type (str): Model type as specified in conf/model.yaml
+            params (Dict[str, Any]): Hyperparameters of the model
+            config_hash (str): Hash of the model config, see config_hash
+            data_hash (str): Fingerprint of the matrices, see data_fingerprint
+            metrics (Dict[str, Dict[str, Any]]): Metrics of every split as returned by
+                score_splits, the per station metrics are left in the model folder
+            timings (Dict[str, float]): Seconds spent in every stage of the run
+            artifact_path (str): Folder of the saved model
+            cv_results (Dict[str, Any]): Results of cross_validate, if it ran
+
+        Returns:
+            int: Id of the run
+        """
+        metrics = {split: {name: value for name, value in split_metrics.items() if name != "by_station"}
+                   for split, split_metrics in metrics.items()}
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (created_at, model_type, config_hash, data_hash, params, train_rmse, val_rmse, "
+                "test_rmse, metrics, cv_results, timings, artifact_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (datetime.now().isoformat(timespec="seconds"), model_type, config_hash, data_hash,
+                 to_json(params), metrics["train"]["rmse"], metrics["val"]["rmse"], metrics["test"]["rmse"],
+                 to_json(metrics), to_json(cv_results) if cv_results is not None else None, to_json(timings),
+                 str(artifact_path)))
+
+        return cursor.lastrowid
+
+    def best_runs(self) -> List[Dict[str, Any]]:
+        """
+        Return the run with the lowest val RMSE of every model type, best first. The minimum
+        of every model type is read from the (model_type, val_rmse) index
+
+        Returns:
+            List[Dict[str, Any]]: Best run of every model type
+        """
+        # SQLite takes the other columns of a MIN aggregate from the row holding the minimum
+        rows = self.connection.execute("SELECT *, MIN(val_rmse) AS best_val_rmse FROM runs "
+                                       "WHERE val_rmse IS NOT NULL GROUP BY model_type ORDER BY best_val_rmse")
+
+        return [{key: value for key, value in to_run(row).items() if key != "best_val_rmse"} for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+def to_run(row: sqlite3.Row) -> Dict[str, Any]:
+    """
+    Convert a row of the runs table into a dict, the json columns are decoded
+    """
+    run = dict(row)
+    for column in ["params", "metrics", "cv_results", "timings"]:
+        if run[column] is not None:
+            run[column] = json.loads(run[column])
+
+    return run
+
+def to_json(value: Any) -> str:
+    """
+    Serialize a config or result, numpy scalars are stored as python numbers
+    """
+    return json.dumps(value, sort_keys=True, default=lambda item: item.item() if isinstance(item, np.generic) else str(item))
+
+def config_hash(model_type: str, params: Dict[str, Any], cv_conf: Dict[str, Any] = None,
+                compression_conf: Dict[str, Any] = None, sharding_conf: Dict[str, Any] = None) -> str:
+    """
+    Hash everything a run's results depend on apart from the data: the model type, its
+    hyperparameters, the cross validation, compression and sharding parameters and the model
+    code
+
+    Args:
+        model_type (str): Model type as specified in conf/model.yaml
+        params (Dict[str, Any]): Hyperparameters of the model
+        cv_conf (Dict[str, Any]): Cross validation parameters, None when it is skipped
+        compression_conf (Dict[str, Any]): Compression parameters, None when it is skipped
+        sharding_conf (Dict[str, Any]): Sharding parameters, None for a single model
+
+    Returns:
+        str: Hex digest of the config
+    """
+    config = {"model_type": model_type, "params": params, "cross_validation": cv_conf,
+              "compression": compression_conf, "sharding": sharding_conf,
+              "code_version": code_version(MODELS_CODE_DIR)}
+
+    return hashlib.sha256(to_json(config).encode()).hexdigest()[:16]
+
+def data_fingerprint(data: Dict[str, Any]) -> str:
+    """
+    Hash the features and targets of the train, val and test splits, the cached matrices of
+    a pipeline run give the same fingerprint as the freshly encoded ones
+
+    Args:
+        data (Dict[str, Any]): Output of the data pipeline
+
+    Returns:
+        str: Hex digest of the matrices
+    """
+    digest = hashlib.sha256()
+    for split in ["train", "val", "test"]:
+        X, y = data[split][0], data[split][1]
+        arrays = [X.data, X.indices, X.indptr] if sparse.issparse(X) else [X]
+        digest.update(f"{split}:{X.shape}".encode())
+        for array in [*arrays, y]:
+            array = np.ascontiguousarray(array)
+            digest.update(str(array.dtype).encode())
+            digest.update(memoryview(array).cast("B"))
+
+    return digest.hexdigest()[:16]
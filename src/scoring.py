@@ -0,0 +1,184 @@
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, Any
+
+import numpy as np
+
+logger = logging.getLogger("Scoring")
+
+DEFAULT_SCORING_CONF = {
+    "chunk_size": 65_536,
+    "n_jobs": None,
+    "executor": "thread"
+}
+SPLITS = ["train", "val", "test"]
+# Running sums kept per metric group: rows, squared errors, absolute errors, absolute
+# percentage errors and rows with a non zero target that the percentage errors cover
+NUM_SUMS = 5
+
+# Model scored inside the workers of a process pool, set by init_worker
+WORKER_MODEL = {}
+
+class StreamingMetrics:
+    """
+    Accumulate the error sums of chunks of predictions, overall and per label of every group
+    column, so that MSE, RMSE, MAE and MAPE are computed without holding all predictions.
+    Rows with a target of 0 are left out of the MAPE
+    """
+    def __init__(self):
+        self.sums = np.zeros(NUM_SUMS)
+        # Group column to label to the sums of its rows
+        self.group_sums = {}
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray,
+               groups: Dict[str, np.ndarray] = None) -> "StreamingMetrics":
+        """
+        Add a chunk of predictions
+
+        Args:
+            y_true (np.ndarray): Groundtruth values of the chunk
+            y_pred (np.ndarray): Predicted values of the chunk
+            groups (Dict[str, np.ndarray]): Label of every row of the chunk per group column
+
+        Returns:
+            StreamingMetrics: The updated metrics
+        """
+        y_true = np.asarray(y_true, dtype=np.float64)
+        errors = np.asarray(y_pred, dtype=np.float64) - y_true
+        nonzero = y_true != 0
+        percentage_errors = np.zeros_like(errors)
+        percentage_errors[nonzero] = np.abs(errors[nonzero] / y_true[nonzero])
+        row_sums = np.stack([np.ones_like(errors), errors ** 2, np.abs(errors), percentage_errors,
+                             nonzero.astype(np.float64)])
+
+        self.sums += row_sums.sum(axis=1)
+        for column, labels in (groups or {}).items():
+            unique_labels, inverse = np.unique(labels, return_inverse=True)
+            label_sums = np.stack([np.bincount(inverse, weights=values, minlength=len(unique_labels))
+                                   for values in row_sums], axis=1)
+            column_sums = self.group_sums.setdefault(column, {})
+            for label, sums in zip(unique_labels.tolist(), label_sums):
+                column_sums[label] = column_sums.get(label, 0) + sums
+
+        return self
+
+    def merge(self, other: "StreamingMetrics") -> "StreamingMetrics":
+        """
+        Add the sums of metrics accumulated on other chunks
+
+        Args:
+            other (StreamingMetrics): Metrics to add
+
+        Returns:
+            StreamingMetrics: The updated metrics
+        """
+        self.sums += other.sums
+        for column, other_sums in other.group_sums.items():
+            column_sums = self.group_sums.setdefault(column, {})
+            for label, sums in other_sums.items():
+                column_sums[label] = column_sums.get(label, 0) + sums
+
+        return self
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Return the metrics of every row and the metrics per label keyed as by_{group column}
+        """
+        result = metrics_from_sums(self.sums)
+        for column, column_sums in self.group_sums.items():
+            result[f"by_{column}"] = {label: metrics_from_sums(sums) for label, sums in sorted(column_sums.items())}
+
+        return result
+
+def metrics_from_sums(sums: np.ndarray) -> Dict[str, float]:
+    """
+    Compute the metrics from the running sums, MAPE is None when no target is non zero
+    """
+    num_rows, squared_error, absolute_error, percentage_error, percentage_rows = sums
+    mse = squared_error / num_rows if num_rows else float("nan")
+
+    return {
+        "rows": int(num_rows),
+        "mse": float(mse),
+        "rmse": float(np.sqrt(mse)),
+        "mae": float(absolute_error / num_rows) if num_rows else float("nan"),
+        "mape": float(percentage_error / percentage_rows) if percentage_rows else None
+    }
+
+def score_splits(model, data: Dict[str, Any], scoring_conf: Dict[str, Any] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Stream the train, val and test matrices through the model's predict in chunks of
+    chunk_size rows on a thread or process pool. The chunks of the three splits share the
+    pool so the splits are scored concurrently, at most two chunks per worker are in flight
+    and every chunk only returns its error sums
+
+    Args:
+        model (Model): Trained model
+        data (Dict[str, Any]): Output of the data pipeline
+        scoring_conf (Dict[str, Any]): Scoring parameters, see conf/model.yaml
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Metrics of every split, see StreamingMetrics.result
+    """
+    scoring_conf = {**DEFAULT_SCORING_CONF, **(scoring_conf or {})}
+    chunk_size = scoring_conf["chunk_size"]
+    num_workers = scoring_conf["n_jobs"] or os.cpu_count()
+
+    if scoring_conf["executor"] == "process":
+        # The model is sent once to every worker instead of with every chunk
+        executor = ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=(model,))
+        task_model = None
+    else:
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+        task_model = model
+
+    logger.info(f"Scoring in chunks of {chunk_size} rows on {num_workers} {scoring_conf['executor']} workers")
+    metrics = {split: StreamingMetrics() for split in SPLITS}
+    pending = {}
+    with executor:
+        for split in SPLITS:
+            data_X, y_true = data[split]
+            groups = data.get("groups", {}).get(split, {})
+            for start in range(0, data_X.shape[0], chunk_size):
+                if len(pending) >= 2 * num_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        metrics[pending.pop(future)].merge(future.result())
+
+                stop = start + chunk_size
+                future = executor.submit(score_chunk, task_model, data_X[start:stop], y_true[start:stop],
+                                         {column: labels[start:stop] for column, labels in groups.items()})
+                pending[future] = split
+
+        for future in wait(pending).done:
+            metrics[pending[future]].merge(future.result())
+
+    return {split: split_metrics.result() for split, split_metrics in metrics.items()}
+
+def init_worker(model):
+    """
+    Keep the model of a process pool worker
+
+    Args:
+        model (Model): Trained model
+    """
+    WORKER_MODEL["model"] = model
+
+def score_chunk(model, chunk_X, chunk_y: np.ndarray, chunk_groups: Dict[str, np.ndarray]) -> StreamingMetrics:
+    """
+    Predict a chunk of rows and return its error sums
+
+    Args:
+        model (Model): Trained model, None inside a process pool worker
+        chunk_X: Features of the chunk, dense or sparse CSR
+        chunk_y (np.ndarray): Target of the chunk
+        chunk_groups (Dict[str, np.ndarray]): Label of every row of the chunk per group column
+
+    Returns:
+        StreamingMetrics: Error sums of the chunk
+    """
+    if model is None:
+        model = WORKER_MODEL["model"]
+
+    return StreamingMetrics().update(chunk_y, model.predict(chunk_X), chunk_groups)
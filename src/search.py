@@ -0,0 +1,237 @@
+from src.data_pipeline import datapipeline
+from src.data_pipeline.cache import load_arrays, load_objects, save_arrays
+from src.models.model_factory import ModelFactory
+from src.train import (CONF_PATH, PIPELINE_CONF_PATH, RAW_STATION_DATA_PATH, RAW_TRAFFIC_DATA_PATH,
+                       load_conf, train_and_evaluate)
+
+import itertools
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Any
+
+import numpy as np
+import yaml
+
+logger = logging.getLogger("Search")
+
+# Feature matrices of the search, memory-mapped once per worker process
+SHARED_DATA = {}
+
+def search():
+    """
+    Search the hyperparameters of the model specified in conf/model.yaml with the grid, random
+    or successive halving strategy of its search section. Every trial is scored on the val
+    split, only the best candidate is retrained, saved and logged along with the leaderboard
+    """
+    logger.info("Loading Configurations")
+    conf = load_conf(CONF_PATH)
+    model_to_be_used = conf["model"]
+    search_conf = conf["search"]
+    pipeline_conf = load_conf(PIPELINE_CONF_PATH)
+
+    data = datapipeline.run_pipeline(RAW_TRAFFIC_DATA_PATH, RAW_STATION_DATA_PATH, pipeline_conf)
+    if datapipeline.is_per_state(pipeline_conf) or datapipeline.is_per_target(pipeline_conf):
+        raise ValueError("Hyperparameter search runs on a single dataset, set output to combined "
+                         "and rush_hour_type to am or pm")
+
+    rng = np.random.default_rng(conf.get("random_state"))
+    candidates = build_candidates(conf[model_to_be_used], search_conf[model_to_be_used],
+                                  search_conf["method"], search_conf["n_iter"], rng)
+    logger.info(f"Searching {len(candidates)} candidates with {search_conf['method']} search")
+
+    num_train = data["train"][0].shape[0]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Written once and memory-mapped by every worker, trials never pickle the matrices
+        shared_dir = Path(tmp_dir) / "shared"
+        save_arrays(shared_dir, {
+            "train_X": data["train"][0], "train_y": data["train"][1],
+            "val_X": data["val"][0], "val_y": data["val"][1],
+            "sample_order": rng.permutation(num_train)
+        }, {"preprocessor": data["preprocessor"]})
+
+        with ProcessPoolExecutor(max_workers=search_conf.get("n_jobs"), initializer=init_worker,
+                                 initargs=(shared_dir,)) as executor:
+            if search_conf["method"] == "halving":
+                leaderboard = successive_halving(executor, model_to_be_used, candidates, num_train,
+                                                 search_conf.get("halving_factor", 3))
+            else:
+                leaderboard = evaluate_candidates(executor, model_to_be_used, candidates, num_train)
+
+    # Candidates trained on the full train set rank first
+    leaderboard.sort(key=lambda trial: (-trial["train_rows"], trial["val_rmse"]))
+    for rank, trial in enumerate(leaderboard[:5], start=1):
+        logger.info(f"#{rank} val rmse {trial['val_rmse']:.4f} with {trial['params']}")
+
+    logger.info("Retraining the best candidate")
+    model = train_and_evaluate(model_to_be_used, leaderboard[0]["params"], data)
+    with open(os.path.join(model.SAVE_DIR, "leaderboard.yaml"), "w") as file:
+        yaml.dump(leaderboard, file, sort_keys=False)
+
+def build_candidates(base_params: Dict[str, Any], search_space: Dict[str, Any], method: str,
+                     n_iter: int, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """
+    Build the hyperparameter candidates from the search space, parameters that are not searched
+    keep their value in base_params
+
+    Args:
+        base_params (Dict[str, Any]): Hyperparameters of the model section of conf/model.yaml
+        search_space (Dict[str, Any]): Lists of values or {distribution, low, high} per parameter
+        method (str): grid, random or halving
+        n_iter (int): Number of candidates sampled for random and halving search
+        rng (np.random.Generator): Random generator used for sampling
+
+    Returns:
+        List[Dict[str, Any]]: Hyperparameters of every candidate
+    """
+    if method == "grid":
+        if any(isinstance(values, dict) for values in search_space.values()):
+            raise ValueError("Grid search only supports lists of values")
+
+        names = list(search_space)
+        return [{**base_params, **dict(zip(names, values))}
+                for values in itertools.product(*search_space.values())]
+
+    if method not in ["random", "halving"]:
+        raise ValueError(f"Unknown search method {method}, use grid, random or halving")
+
+    candidates, seen = [], set()
+    for _ in range(n_iter * 10):
+        candidate = {**base_params, **{name: sample_value(values, rng) for name, values in search_space.items()}}
+        key = json.dumps(candidate, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            candidates.append(candidate)
+        if len(candidates) == n_iter:
+            break
+
+    return candidates
+
+def sample_value(values: Any, rng: np.random.Generator) -> Any:
+    """
+    Sample one value of a hyperparameter
+
+    Args:
+        values (Any): List of values or a {distribution, low, high} dictionary where distribution
+            is randint, uniform or loguniform
+        rng (np.random.Generator): Random generator used for sampling
+
+    Returns:
+        Any: Sampled value
+    """
+    if isinstance(values, list):
+        return values[rng.integers(len(values))]
+
+    distribution, low, high = values["distribution"], values["low"], values["high"]
+    if distribution == "randint":
+        return int(rng.integers(low, high))
+    elif distribution == "uniform":
+        return float(rng.uniform(low, high))
+    elif distribution == "loguniform":
+        return float(math.exp(rng.uniform(math.log(low), math.log(high))))
+
+    raise ValueError(f"Unknown distribution {distribution}, use randint, uniform or loguniform")
+
+def successive_halving(executor: ProcessPoolExecutor, model_to_be_used: str, candidates: List[Dict[str, Any]],
+                       num_train: int, factor: int) -> List[Dict[str, Any]]:
+    """
+    Train every candidate on a subset of the train rows and keep the best 1/factor of them for
+    the next round on factor times more rows, the last round uses the full train set
+
+    Args:
+        executor (ProcessPoolExecutor): Pool of workers initialized with init_worker
+        model_to_be_used (str): Model type as specified in conf/model.yaml
+        candidates (List[Dict[str, Any]]): Hyperparameters of every candidate
+        num_train (int): Number of rows in the train set
+        factor (int): Halving factor
+
+    Returns:
+        List[Dict[str, Any]]: Trials of every round
+    """
+    num_rounds = max(math.ceil(math.log(len(candidates)) / math.log(factor)), 0)
+
+    leaderboard = []
+    for round_index in range(num_rounds + 1):
+        num_samples = max(int(num_train * factor ** (round_index - num_rounds)), 1)
+        logger.info(f"Round {round_index}: {len(candidates)} candidates on {num_samples} rows")
+
+        trials = evaluate_candidates(executor, model_to_be_used, candidates, num_samples)
+        for trial in trials:
+            trial["round"] = round_index
+        leaderboard.extend(trials)
+
+        trials.sort(key=lambda trial: trial["val_rmse"])
+        candidates = [trial["params"] for trial in trials[:max(math.ceil(len(trials) / factor), 1)]]
+
+    return leaderboard
+
+def evaluate_candidates(executor: ProcessPoolExecutor, model_to_be_used: str,
+                        candidates: List[Dict[str, Any]], num_samples: int) -> List[Dict[str, Any]]:
+    """
+    Run one trial per candidate across the pool
+
+    Args:
+        executor (ProcessPoolExecutor): Pool of workers initialized with init_worker
+        model_to_be_used (str): Model type as specified in conf/model.yaml
+        candidates (List[Dict[str, Any]]): Hyperparameters of every candidate
+        num_samples (int): Number of train rows used by every trial
+
+    Returns:
+        List[Dict[str, Any]]: Result of every trial
+    """
+    futures = [executor.submit(run_trial, model_to_be_used, params, num_samples) for params in candidates]
+
+    return [future.result() for future in futures]
+
+def init_worker(shared_dir: Path):
+    """
+    Memory-map the shared feature matrices once per worker process
+
+    Args:
+        shared_dir (Path): Folder written with save_arrays
+    """
+    SHARED_DATA.update(load_arrays(shared_dir))
+    SHARED_DATA.update(load_objects(shared_dir))
+
+def run_trial(model_to_be_used: str, params: Dict[str, Any], num_samples: int) -> Dict[str, Any]:
+    """
+    Train one candidate on the first num_samples rows of the shuffled train set and score it
+    on the val set, run inside a worker process
+
+    Args:
+        model_to_be_used (str): Model type as specified in conf/model.yaml
+        params (Dict[str, Any]): Hyperparameters of the candidate
+        num_samples (int): Number of train rows to use
+
+    Returns:
+        Dict[str, Any]: Hyperparameters, val rmse, number of train rows and fit time of the trial
+    """
+    train_X, train_y = SHARED_DATA["train_X"], SHARED_DATA["train_y"]
+    if num_samples < train_X.shape[0]:
+        rows = np.sort(SHARED_DATA["sample_order"][:num_samples])
+        train_X, train_y = train_X[rows], train_y[rows]
+
+    model = ModelFactory().create_model(model_to_be_used, params)
+    model.preprocessor = SHARED_DATA["preprocessor"]
+    start_time = time.perf_counter()
+    model.train(train_X, train_y, SHARED_DATA["val_X"], SHARED_DATA["val_y"])
+    fit_seconds = time.perf_counter() - start_time
+
+    val_predictions = model.predict(SHARED_DATA["val_X"])
+    val_score = model.evaluate(SHARED_DATA["val_y"], val_predictions, metrics="rmse")
+
+    return {
+        "params": params,
+        "val_rmse": float(val_score),
+        "train_rows": int(num_samples),
+        "fit_seconds": float(fit_seconds)
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    search()
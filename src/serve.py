@@ -0,0 +1,307 @@
+from src.data_pipeline.preprocess_data import prepare_inference_data
+from src.data_pipeline.station_store import StationStore
+from src.models.model_factory import ModelFactory
+
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any
+
+import numpy as np
+import pandas as pd
+
+MAX_BATCH_SIZE = 256
+MAX_WAIT_MS = 5.0
+LATENCY_WINDOW = 10000
+
+logger = logging.getLogger("Serving")
+
+class LatencyStats:
+    """
+    Thread safe request counters and a rolling window of request latencies
+    """
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.start_time = time.perf_counter()
+        self.requests = 0
+        self.records = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_request(self, latency: float, num_records: int, failed: bool = False):
+        """
+        Record a served request
+
+        Args:
+            latency (float): Time taken to serve the request in seconds
+            num_records (int): Number of traffic records in the request
+            failed (bool): Whether the request failed
+        """
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+            self.records += num_records
+            self.errors += int(failed)
+
+    def record_batch(self):
+        """
+        Record a micro-batch sent to the model
+        """
+        with self.lock:
+            self.batches += 1
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Summarize the latency percentiles and throughput since the server started
+
+        Returns:
+            Dict[str, float]: Latencies in milliseconds and throughput counters
+        """
+        with self.lock:
+            latencies = np.array(self.latencies)
+            elapsed = time.perf_counter() - self.start_time
+            summary = {
+                "requests": self.requests,
+                "records": self.records,
+                "batches": self.batches,
+                "errors": self.errors,
+                "requests_per_second": self.requests / elapsed,
+                "records_per_second": self.records / elapsed,
+                "mean_batch_requests": self.requests / max(self.batches, 1)
+            }
+
+        if len(latencies) > 0:
+            summary["p50_latency_ms"] = float(np.percentile(latencies, 50) * 1000)
+            summary["p99_latency_ms"] = float(np.percentile(latencies, 99) * 1000)
+
+        return summary
+
+class MicroBatcher:
+    """
+    Coalesce concurrent prediction requests into micro-batches. A batch is sent to the model
+    once it holds max_batch_size traffic records or max_wait_ms has passed since its first
+    request arrived, so the pandas and sklearn overhead is paid per batch instead of per request
+    """
+    def __init__(self, model, stats: LatencyStats, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS, station_store: StationStore = None):
+        self.model = model
+        self.station_store = station_store
+        self.stats = stats
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, traffic_records: List[Dict[str, Any]], station_records: List[Dict[str, Any]]) -> Future:
+        """
+        Queue a request for the next micro-batch
+
+        Args:
+            traffic_records (List[Dict[str, Any]]): Raw traffic records to predict
+            station_records (List[Dict[str, Any]]): Raw records of the stations of the traffic records
+
+        Returns:
+            Future: Resolves to the list of predictions, None for records without a matching station
+        """
+        future = Future()
+        self.requests.put((traffic_records, station_records, future))
+
+        return future
+
+    def run(self):
+        """
+        Collect queued requests into micro-batches until the server shuts down
+        """
+        while True:
+            batch = [self.requests.get()]
+            num_records = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_wait
+
+            while num_records < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                num_records += len(batch[-1][0])
+
+            self.process(batch)
+
+    def process(self, batch: List[tuple]):
+        """
+        Predict a micro-batch and resolve the futures of its requests. If the batch fails, its
+        requests are retried one by one so that a malformed request does not fail the others
+
+        Args:
+            batch (List[tuple]): Queued (traffic_records, station_records, future) requests
+        """
+        try:
+            results = self.predict_batch(batch)
+        except Exception as exc:
+            if len(batch) == 1:
+                batch[0][2].set_exception(exc)
+            else:
+                for request in batch:
+                    self.process([request])
+            return
+
+        for (_, _, future), predictions in zip(batch, results):
+            future.set_result(predictions)
+
+    def predict_batch(self, batch: List[tuple]) -> List[List[float]]:
+        """
+        Build the features of all the records in the batch and predict them with one model call
+
+        Args:
+            batch (List[tuple]): Queued (traffic_records, station_records, future) requests
+
+        Returns:
+            List[List[float]]: Predictions of every request in the batch
+        """
+        self.stats.record_batch()
+        traffic_records = [record for traffic, _, _ in batch for record in traffic]
+        station_records = [record for _, stations, _ in batch for record in stations]
+
+        predictions = predict_records(self.model, pd.DataFrame.from_records(traffic_records),
+                                      pd.DataFrame.from_records(station_records), self.station_store)
+
+        results, offset = [], 0
+        for traffic, _, _ in batch:
+            request_predictions = predictions[offset:offset + len(traffic)]
+            results.append([None if np.isnan(value) else float(value) for value in request_predictions])
+            offset += len(traffic)
+
+        return results
+
+def predict_records(model, traffic_df: pd.DataFrame, station_df: pd.DataFrame = None,
+                    station_store: StationStore = None) -> np.ndarray:
+    """
+    Predict raw traffic records with the records of their stations, records without a station
+    record are looked up in the station store
+
+    Args:
+        model (Model): Trained model with its preprocessor
+        traffic_df (pd.DataFrame): Raw traffic records
+        station_df (pd.DataFrame): Raw records of their stations
+        station_store (StationStore): Prebuilt station store, see build_station_store
+
+    Returns:
+        np.ndarray: Prediction of every traffic record, NaN when its station is missing
+    """
+    preprocessor = model.inference_preprocessor
+    traffic_df = traffic_df.assign(request_row=np.arange(len(traffic_df)))
+    if "state" in preprocessor.cat_columns:
+        traffic_df["state"] = traffic_df["fips_state_code"].astype(str)
+
+    if station_df is not None:
+        station_df = station_df.drop_duplicates()
+    combined_df = prepare_inference_data(traffic_df, station_df, station_store)
+    combined_df = combined_df.drop_duplicates("request_row")
+
+    predictions = np.full(len(traffic_df), np.nan)
+    if len(combined_df) > 0:
+        features = preprocessor.transform(combined_df)
+        predictions[combined_df["request_row"].to_numpy()] = model.predict(features)
+
+    return predictions
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with {"traffic": [...], "stations": [...]} raw records returns
+    {"predictions": [...]}, the stations can be left out when the server has a station store.
+    GET /metrics returns the latency and throughput counters
+    """
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_json(200, self.server.stats.summary())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        start_time = time.perf_counter()
+        num_records = 0
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            traffic_records = body["traffic"]
+            num_records = len(traffic_records)
+            future = self.server.batcher.submit(traffic_records, body.get("stations", []))
+            status, response = 200, {"predictions": future.result()}
+        except Exception as exc:
+            status, response = 400, {"error": f"{type(exc).__name__}: {exc}"}
+
+        self.server.stats.record_request(time.perf_counter() - start_time, num_records, failed=status != 200)
+        self.send_json(status, response)
+
+    def send_json(self, status: int, response: Dict[str, Any]):
+        encoded_response = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded_response)))
+        self.end_headers()
+        self.wfile.write(encoded_response)
+
+    def log_message(self, format: str, *args):
+        logger.debug(format % args)
+
+def serve(model_dir: str, host: str = "127.0.0.1", port: int = 8000,
+          max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS,
+          station_store_dir: str = None):
+    """
+    Load the saved model and its preprocessor once and serve predictions over HTTP
+
+    Args:
+        model_dir (str): Model folder created by save_model
+        host (str): Host to bind to
+        port (int): Port to listen on
+        max_batch_size (int): Maximum number of traffic records per micro-batch
+        max_wait_ms (float): Maximum time a request waits for its micro-batch to fill up
+        station_store_dir (str): Station store built by build_station_store, used for the
+            traffic records sent without their station records
+    """
+    logger.info(f"Loading model from {model_dir}")
+    model = ModelFactory().load_model(model_dir)
+    if model.inference_preprocessor is None:
+        raise FileNotFoundError(f"No preprocessor.joblib found in {model_dir}")
+    station_store = StationStore.load(station_store_dir) if station_store_dir is not None else None
+
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.stats = LatencyStats()
+    server.batcher = MicroBatcher(model, server.stats, max_batch_size, max_wait_ms, station_store)
+
+    logger.info(f"Serving predictions on http://{host}:{port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info(f"Shutting down, {server.stats.summary()}")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve rush hour traffic volume predictions")
+    parser.add_argument("--model-dir", required=True, help="Model folder created by save_model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--station-store", help="Station store folder, see build_station_store")
+    args = parser.parse_args()
+
+    serve(args.model_dir, args.host, args.port, args.max_batch_size, args.max_wait_ms, args.station_store)
@@ -1,51 +1,191 @@
+from src.cross_validation import cross_validate
 from src.data_pipeline import datapipeline
+from src.models.compression import compress_model
 from src.models.model_factory import ModelFactory
+from src.instrumentation import INSTRUMENTATION, run_stage
+from src.registry import REGISTRY_PATH, RunRegistry, config_hash, data_fingerprint
+from src.scoring import score_splits
 
 import yaml
 from pathlib import Path
-from typing import Dict, Union
+from typing import Callable, Dict, List, Any, Union
 import logging
 import pickle
+import time
 
 RAW_STATION_DATA_PATH = Path("data/raw/dot_traffic_stations_2015.txt.gz")
 RAW_TRAFFIC_DATA_PATH = Path("data/raw/dot_traffic_2015.txt.gz")
 CONF_PATH = Path("conf/model.yaml")
+PIPELINE_CONF_PATH = Path("conf/pipeline.yaml")
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("Training")
 
-def experiment():
+def experiment(retrain: bool = False):
+    """
+    Run the data pipeline and train, evaluate and save the model of conf/model.yaml
+
+    Args:
+        retrain (bool): Train even when the run registry holds a run of the same config on
+            the same data, the new run is recorded
 
+    Returns:
+        Any: The trained model, keyed by state code or rush hour when the pipeline outputs
+            more than one dataset
+    """
     logger.info("Loading Configurations")
     conf = load_conf(CONF_PATH)
     model_to_be_used = conf["model"]
     model_params = conf[model_to_be_used]
+    predictor = conf.get("predictor", "auto")
+    cv_conf = conf.get("cross_validation") or {}
+    cv_conf = cv_conf if cv_conf.get("enabled") else None
+    scoring_conf = conf.get("scoring")
+    compression_conf = conf.get("compression") or {}
+    compression_conf = compression_conf if compression_conf.get("enabled") else None
+    sharding_conf = conf.get("sharding") or {}
+    sharding_conf = sharding_conf if sharding_conf.get("enabled") else None
+    pipeline_conf = load_conf(PIPELINE_CONF_PATH)
+
+    registry_conf = conf.get("registry") or {}
+    registry = RunRegistry(registry_conf.get("path", REGISTRY_PATH)) if registry_conf.get("enabled") else None
+
+    instrumentation_conf = conf.get("instrumentation") or {}
+    if instrumentation_conf.get("enabled"):
+        logger.info("Instrumenting the pipeline and training stages")
+        INSTRUMENTATION.enable(profile=instrumentation_conf.get("profile", False))
+
+    data = datapipeline.run_pipeline(RAW_TRAFFIC_DATA_PATH, RAW_STATION_DATA_PATH, pipeline_conf)
+
+    if datapipeline.is_per_state(pipeline_conf):
+        models = {}
+        for state_code, state_data in data.items():
+            logger.info(f"Training model for state {state_code}")
+            models[state_code] = train_and_evaluate(model_to_be_used, model_params, state_data,
+                                                    model_dir=f"models/state_{state_code}", predictor=predictor,
+                                                    cv_conf=cv_conf, scoring_conf=scoring_conf,
+                                                    compression_conf=compression_conf, sharding_conf=sharding_conf,
+                                                    registry=registry, retrain=retrain)
+    elif datapipeline.is_per_target(pipeline_conf):
+        # Both rush hours are trained on the matrices of one pipeline run
+        models = {}
+        for rush_hour_type, rush_hour_data in data.items():
+            logger.info(f"Training model for the {rush_hour_type} rush hour")
+            models[rush_hour_type] = train_and_evaluate(model_to_be_used, model_params, rush_hour_data,
+                                                        model_dir=f"models/{rush_hour_type}", predictor=predictor,
+                                                        cv_conf=cv_conf, scoring_conf=scoring_conf,
+                                                        compression_conf=compression_conf,
+                                                        sharding_conf=sharding_conf, registry=registry,
+                                                        retrain=retrain)
+    else:
+        models = train_and_evaluate(model_to_be_used, model_params, data, predictor=predictor, cv_conf=cv_conf,
+                                    scoring_conf=scoring_conf, compression_conf=compression_conf,
+                                    sharding_conf=sharding_conf, registry=registry, retrain=retrain)
+
+    if registry is not None:
+        registry.close()
+
+    return models
+
+def train_and_evaluate(model_to_be_used: str, model_params: Dict[str, Union[str, int]],
+                       data: Dict[str, List], model_dir: str = "models", predictor: str = "auto",
+                       cv_conf: Dict[str, Any] = None, scoring_conf: Dict[str, Any] = None,
+                       compression_conf: Dict[str, Any] = None, sharding_conf: Dict[str, Any] = None,
+                       registry: RunRegistry = None, retrain: bool = False):
+    """
+    Train, evaluate and save one model on the output of the data pipeline. Models that can be
+    compressed are compressed on the val split before they are scored. With a registry,
+    a run of the same config on the same matrices is loaded from its model folder with its
+    recorded metrics instead of training again, and new runs are recorded in it
+
+    Args:
+        model_to_be_used (str): Model type as specified in conf/model.yaml
+        model_params (Dict[str, Union[str, int]]): Hyperparameters of the model
+        data (Dict[str, List]): Features and targets for each of train, val and test
+        model_dir (str): Folder where the model folder is created
+        predictor (str): auto, arrays or sklearn, see Model.predict_estimator
+        cv_conf (Dict[str, Any]): Cross validation parameters, None skips cross validation
+        scoring_conf (Dict[str, Any]): Chunk size and pool of the scoring, see score_splits
+        compression_conf (Dict[str, Any]): Compression parameters, None skips the compression
+        sharding_conf (Dict[str, Any]): Sharding parameters, None trains one model on every row
+        registry (RunRegistry): Registry of the runs, None always trains
+        retrain (bool): Train even when the registry holds a run of the same config on the
+            same data
 
-    data = datapipeline.run_pipeline(RAW_TRAFFIC_DATA_PATH, RAW_STATION_DATA_PATH)
+    Returns:
+        Model: The trained and saved model, its metrics of every split are kept as metrics
+    """
+    if registry is not None:
+        run_config_hash = config_hash(model_to_be_used, model_params, cv_conf, compression_conf, sharding_conf)
+        run_data_hash = data_fingerprint(data)
+        run = registry.find(run_config_hash, run_data_hash) if not retrain else None
+        if run is not None:
+            logger.warning(f"Run {run['id']} trained the same config on the same data, loading "
+                           f"{run['artifact_path']} instead of training. Nothing is trained or written, "
+                           f"python -m src train --retrain trains again")
+            model = ModelFactory().load_model(run["artifact_path"])
+            model.predictor = predictor
+            model.metrics = run["metrics"]
+            logger.info(f"Recorded RMSE: train {run['train_rmse']}, val {run['val_rmse']}, test {run['test_rmse']}")
+            return model
 
     train_X, train_y = data["train"][0], data["train"][1]
     val_X, val_y = data["val"][0], data["val"][1]
-    test_X, test_y = data["test"][0], data["test"][1]
+    timings = {}
+
+    cv_results = None
+    if cv_conf is not None:
+        cv_results = timed_stage(timings, "cross_validate", cross_validate, model_to_be_used, model_params,
+                                 data, cv_conf)
 
     logger.info("Building model")
     model_factory = ModelFactory()
-    model = model_factory.create_model(model_to_be_used, model_params)
+    model = model_factory.create_model(model_to_be_used, model_params, sharding_conf)
+    model.MODEL_DIR = model_dir
+    model.preprocessor = data["preprocessor"]
+    model.predictor = predictor
 
     logger.info("Training model, might take a while")
-    model.train(train_X, train_y)
+    timed_stage(timings, "fit", model.train, train_X, train_y, val_X, val_y)
 
-    logger.info("Performing predictions + evaluations")
-    train_predictions = model.predict(train_X)
-    val_predictions = model.predict(val_X)
-    test_predictions = model.predict(test_X)
+    if compression_conf is not None and model.COMPRESSIBLE:
+        logger.info("Compressing model")
+        timed_stage(timings, "compress", compress_model, model, data, compression_conf)
 
-    train_score = model.evaluate(train_y, train_predictions, metrics="rmse")
-    val_score = model.evaluate(val_y, val_predictions, metrics="rmse")
-    test_score  = model.evaluate(test_y, test_predictions, metrics="rmse")
+    logger.info("Performing predictions + evaluations")
+    metrics = timed_stage(timings, "score", score_splits, model, data, scoring_conf)
+    model.metrics = metrics
 
     logger.info("Saving and logging results")
-    model.save_model()
-    model.log_results(train_score, val_score, test_score)
+    timed_stage(timings, "save", model.save_model)
+    model.log_results(metrics["train"]["rmse"], metrics["val"]["rmse"], metrics["test"]["rmse"],
+                      cv_results, metrics)
+    if INSTRUMENTATION.enabled:
+        INSTRUMENTATION.save(model.SAVE_DIR)
+
+    if registry is not None:
+        run_id = registry.record(model_to_be_used, model_params, run_config_hash, run_data_hash, metrics, timings,
+                                 model.SAVE_DIR, cv_results)
+        logger.info(f"Recorded run {run_id} in the registry")
+
+    return model
+
+def timed_stage(timings: Dict[str, float], name: str, function: Callable, *args, **kwargs) -> Any:
+    """
+    Run a stage through run_stage and record its wall time in seconds under name
+
+    Args:
+        timings (Dict[str, float]): Seconds of every stage of the run
+        name (str): Name of the stage
+        function (Callable): Stage to run
+
+    Returns:
+        Any: Output of the stage
+    """
+    start_time = time.perf_counter()
+    output = run_stage(name, function, *args, **kwargs)
+    timings[name] = time.perf_counter() - start_time
+
+    return output
 
 
 def load_conf(conf_path: Path) -> Dict[str, Union[str, int]]:
@@ -60,4 +200,5 @@ def load_conf(conf_path: Path) -> Dict[str, Union[str, int]]:
     return conf
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     experiment()
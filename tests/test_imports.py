@@ -0,0 +1,24 @@
+from pathlib import Path
+
+import pytest
+
+from src.benchmarks.imports import FORBIDDEN_IMPORTS, IMPORT_PATHS, time_import
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+# Import time budget of the predict path in a fresh interpreter, generous so that slow
+# machines pass while a path pulling sklearn back in does not
+MAX_PREDICT_SECONDS = 3.0
+
+@pytest.fixture(autouse=True)
+def root_dir(monkeypatch):
+    # time_import puts the working directory on the PYTHONPATH of the fresh interpreter
+    monkeypatch.chdir(ROOT_DIR)
+
+@pytest.mark.parametrize("path", sorted(FORBIDDEN_IMPORTS))
+def test_light_paths_skip_forbidden_imports(path):
+    packages = time_import(IMPORT_PATHS[path])["packages"]
+
+    assert not set(FORBIDDEN_IMPORTS[path]) & set(packages)
+
+def test_predict_path_import_time():
+    assert time_import(IMPORT_PATHS["predict"])["seconds"] < MAX_PREDICT_SECONDS
@@ -0,0 +1,61 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.benchmarks.synthetic_data import generate_raw_data
+from src.data_pipeline.datapipeline import run_pipeline
+
+STATE_CODE = 36
+# Months of the first incremental run, the second run adds the rest of the year
+FIRST_RUN_MONTHS = 6
+
+@pytest.fixture
+def raw_data(tmp_path, monkeypatch):
+    # The full run writes data/interim/cleaned_data.csv relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    Path("data/interim").mkdir(parents=True)
+
+    traffic_data_path, station_data_path = generate_raw_data(Path("raw"), 4000, num_states=1, num_stations=300)
+    traffic_df = pd.read_csv(traffic_data_path, dtype=str)
+    first_months = traffic_df["month_of_data"].astype(int) <= FIRST_RUN_MONTHS
+    split_paths = [Path("first.txt.gz"), Path("second.txt.gz")]
+    for split_path, rows in zip(split_paths, [first_months, ~first_months]):
+        traffic_df[rows].to_csv(split_path, index=False, compression="gzip")
+
+    return traffic_data_path, station_data_path, split_paths
+
+def pipeline_conf(**overrides):
+    return {"state_code": STATE_CODE, "csv_engine": "pandas", "dataset_dir": None, "cache_dir": "cache", **overrides}
+
+def run_incremental(station_data_path, split_paths, incremental_refit):
+    conf = pipeline_conf(incremental=True, incremental_refit=incremental_refit,
+                         cache_dir=f"cache_incremental_{incremental_refit}")
+    for split_path in split_paths:
+        splits = run_pipeline(split_path, station_data_path, conf)
+
+    return splits
+
+def test_incremental_matches_full_run(raw_data):
+    traffic_data_path, station_data_path, split_paths = raw_data
+    full = run_pipeline(traffic_data_path, station_data_path, pipeline_conf())
+    incremental = run_incremental(station_data_path, split_paths, incremental_refit=True)
+
+    assert incremental["preprocessor"].feature_names == full["preprocessor"].feature_names
+    for split in ["train", "val", "test"]:
+        # The incremental store stacks the rows month by month
+        order = np.argsort(full["months"][split], kind="stable")
+        np.testing.assert_allclose(incremental[split][0].toarray(), full[split][0][order].toarray())
+        np.testing.assert_array_equal(incremental[split][1], full[split][1][order])
+
+def test_incremental_without_refit_warns(raw_data, caplog):
+    traffic_data_path, station_data_path, split_paths = raw_data
+    full = run_pipeline(traffic_data_path, station_data_path, pipeline_conf())
+    with caplog.at_level(logging.WARNING):
+        incremental = run_incremental(station_data_path, split_paths, incremental_refit=False)
+
+    assert len(incremental["preprocessor"].feature_names) < len(full["preprocessor"].feature_names)
+    assert any(record.levelno == logging.WARNING and "unknown to the encoder" in record.getMessage()
+               for record in caplog.records)